@@ -1,32 +1,38 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
 import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta
 import holidays
-import io
 import base64
 import time
 import re
 import requests
 import json
 import os
-import xlsxwriter
 import traceback
 
-st.set_page_config(page_title="Hotel Groups Displacement Analyzer v0.9.5r8", layout="wide")
+from displacement.alternatives import alternative_dates
+from displacement.availability import demand_grid, horizon
+from displacement.charts import WEEKLY_THRESHOLD_DAYS, create_demand_heatmap
+from displacement.diagnostics import LOG_LEVELS, PROFILERS, Diagnostics
+from displacement.engine import (DEFAULT_DECISION_PARAMETERS, MIN_SNAPSHOT_OBSERVATIONS, build_analysis_frame, fit_pickup_curve,
+                                 prepare_segments)
+from displacement.forecast import FORECAST_METHODS, history_from_frame, history_from_ly
+from displacement.graph import build_analysis_graph
+from displacement.importer import ImportJob, assign_import_roles
+from displacement.manual import ManualInputs
+from displacement.memory import SessionMemory, process_footprint
+from displacement.options import review_options
+from displacement.quotes import QUOTE_OUTCOMES, QuoteStore
+from displacement.shared import SHARED_STORE
+from displacement.shoulder import MAX_SHIFT_DAYS, SHIFT, shoulder_variants
+from displacement.simulation import DEFAULT_SIMULATIONS, pickup_sigma, simulate_impact
+from displacement.snapshots import SnapshotStore
+from displacement.tables import arrow_table
+from displacement.theme import COLOR_PALETTE
+from displacement.winloss import DIMENSIONS, MIN_DECIDED_QUOTES, AcceptanceCurve, quote_features, win_rates
 
-COLOR_PALETTE = {
-    "primary": "#D8C0B7",
-    "secondary": "#8CA68C",
-    "text": "#5E5E5E",
-    "background": "#F8F6F4",
-    "accent": "#B6805C",
-    "positive": "#8CA68C",
-    "negative": "#D8837F"
-}
+st.set_page_config(page_title="Hotel Groups Displacement Analyzer v0.9.5r8", layout="wide")
 
 js_code = """
 <script>
@@ -270,6 +276,22 @@ def authenticate():
 if not authenticate():
     st.stop()
 
+if 'diagnostics' not in st.session_state:
+    st.session_state['diagnostics'] = Diagnostics()
+diagnostics = st.session_state['diagnostics']
+diagnostics.begin_run()
+
+# Grafo di calcolo per sessione: ogni nodo viene ricalcolato solo quando cambiano i suoi input
+if 'analysis_graph' not in st.session_state:
+    st.session_state['analysis_graph'] = build_analysis_graph(diagnostics)
+analysis_graph = st.session_state['analysis_graph']
+
+# Memoria per sessione: oltre il budget i dati più grandi vanno su disco e tornano in memoria al primo accesso
+if 'session_memory' not in st.session_state:
+    st.session_state['session_memory'] = SessionMemory(owner=st.session_state['username'])
+session_memory = st.session_state['session_memory']
+session_memory.begin_run(st.session_state, analysis_graph)
+
 st.sidebar.info(f"Accesso effettuato come: {st.session_state['username']}")
 if st.sidebar.button("Logout"):
     for key in list(st.session_state.keys()):
@@ -371,143 +393,80 @@ st.markdown(js_code, unsafe_allow_html=True)
 
 italian_holidays = holidays.IT()
 
+
 def is_holiday(day):
     return day in italian_holidays
 
-def same_day_last_year(current_date):
-    days_to_subtract = 365
-    if (current_date.year % 4 == 0 and current_date.year % 100 != 0) or (current_date.year % 400 == 0):
-        days_to_subtract = 366
-    
-    last_year_date = current_date - timedelta(days=days_to_subtract)
-    
-    if last_year_date.weekday() != current_date.weekday():
-        days_diff = (current_date.weekday() - last_year_date.weekday()) % 7
-        last_year_date = last_year_date + timedelta(days=days_diff)
-    
-    return last_year_date
-
 def get_csv_download_link(df, filename, text):
     csv = df.to_csv(index=False)
     b64 = base64.b64encode(csv.encode()).decode()
     href = f'<a href="data:file/csv;base64,{b64}" download="{filename}.csv">{text}</a>'
     return href
 
-def safe_date_conversion(date_val):
-    if pd.isna(date_val):
-        return pd.NaT
-    
-    if isinstance(date_val, (datetime, date)):
-        return pd.to_datetime(date_val)
+def poll_import_job(uploaded_files):
+    file_names = [uploaded_file.name for uploaded_file in uploaded_files]
+    import_job = st.session_state.get('import_job')
     
-    date_str = str(date_val)
-    date_only = re.search(r'(\d{2}/\d{2}/\d{4})', date_str)
-    if date_only:
-        try:
-            return pd.to_datetime(date_only.group(1), format='%d/%m/%Y')
-        except:
-            pass
+    if import_job is None or import_job.file_names != file_names:
+        import_job = ImportJob([(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files],
+                               store=SHARED_STORE).start()
+        st.session_state['import_job'] = import_job
     
-    formats = ['%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%m/%d/%Y']
-    for fmt in formats:
-        try:
-            return pd.to_datetime(date_str, format=fmt, errors='coerce')
-        except:
-            continue
+    if import_job.done():
+        return import_job
     
-    return pd.NaT
+    # Un solo controllo per esecuzione: il job prosegue in background e lo script viene rieseguito per aggiornare l'avanzamento
+    st.dataframe(
+        import_job.progress_frame(),
+        column_config={
+            "file": "File",
+            "fase": "Fase",
+            "avanzamento": st.column_config.ProgressColumn("Avanzamento", min_value=0, max_value=1)
+        },
+        hide_index=True,
+        use_container_width=True
+    )
+    time.sleep(0.25)
+    st.rerun()
 
-def process_excel_import(uploaded_files):
-    st.write(f"Debug: Numero file caricati: {len(uploaded_files)}")
-    for file in uploaded_files:
-        st.write(f"Debug: Nome file: {file.name}")
+def process_excel_import(import_job):
+    diagnostics.debug(f"Numero file caricati: {len(import_job.file_names)}", stage="import")
+    for file_name in import_job.file_names:
+        diagnostics.debug(f"Nome file: {file_name}", stage="import")
     
-    if not uploaded_files:
-        return None, None, None, None
+    reused = len(import_job.handles)
+    parsed_files = import_job.result()
+    del st.session_state['import_job']
     
-    idv_cy_data = None
-    idv_ly_data = None
-    grp_otb_data = None
-    grp_opz_data = None
+    # La sessione tiene solo gli handle: i DataFrame in sola lettura sono condivisi con le altre sessioni dello stesso file
+    st.session_state['raw_excel_handles'] = list(import_job.handles.values())
+    if reused:
+        diagnostics.info(f"{reused} file su {len(parsed_files)} già elaborati in un'altra sessione: dati condivisi senza nuova lettura",
+                         stage="import")
     
-    current_year = datetime.now().year
+    for file_name, stage, seconds in import_job.stage_timings():
+        diagnostics.record_timing(f"import {file_name}: {stage}", seconds)
     
-    for uploaded_file in uploaded_files:
-        try:
-            df = pd.read_excel(uploaded_file)
-            st.write(f"Debug: Prime righe di {uploaded_file.name}:")
-            st.write(df.head())
-            
-            file_type, year, month_year = identify_excel_file_type(df)
-            st.write(f"Debug: Tipo file: {file_type}, Anno: {year}")
-            
-            date_col_candidates = ['Giorno', 'Data', 'Date', 'day', 'date']
-            data_rows = None
-            
-            for candidate in date_col_candidates:
-                mask = df.iloc[:, 0].astype(str).str.contains(candidate, case=False, na=False)
-                if mask.any():
-                    data_rows = df[mask].index[0]
-                    break
-            
-            if data_rows is None:
-                st.error(f"Formato del file {uploaded_file.name} non riconosciuto: nessuna colonna data trovata")
-                continue
-                
-            headers = df.iloc[data_rows].values.tolist()
-            
-            data_df = df.iloc[data_rows+1:].reset_index(drop=True)
-            data_df.columns = headers[:len(data_df.columns)]
-            
-            date_column = None
-            for col in data_df.columns:
-                if isinstance(col, str) and any(candidate.lower() in col.lower() for candidate in date_col_candidates):
-                    date_column = col
-                    break
-            
-            if date_column is None:
-                date_column = data_df.columns[0]
-            
-            data_df = data_df.rename(columns={date_column: 'Giorno'})
-            
-            data_df = data_df[~data_df['Giorno'].isna()]
-            data_df = data_df[~data_df['Giorno'].astype(str).str.contains('Filtri applicati:', na=False)]
-            
-            data_df['Giorno'] = data_df['Giorno'].apply(safe_date_conversion)
-            data_df = data_df.dropna(subset=['Giorno'])
-            
-            if len(data_df) == 0:
-                st.error(f"Il file {uploaded_file.name} non contiene date valide dopo la pulizia")
-                continue
-            
-            st.write(f"Debug: Date estratte da {uploaded_file.name}:")
-            st.write(data_df['Giorno'].head())
-            
-            numeric_cols = ['Room nights', 'Bed nights', 'ADR Cam', 'ADR Bed', 'Room Revenue', 'RevPar']
-            for col in numeric_cols:
-                if col in data_df.columns:
-                    data_df[col] = pd.to_numeric(data_df[col], errors='coerce').fillna(0)
-            
-            data_df.rename(columns={'Giorno': 'data'}, inplace=True)
-            
-            if file_type == "IDV":
-                if str(current_year) in str(year) or (month_year and str(current_year) in str(month_year)):
-                    idv_cy_data = data_df
-                    st.success(f"File IDV Anno Corrente riconosciuto: {uploaded_file.name}")
-                else:
-                    idv_ly_data = data_df
-                    st.success(f"File IDV Anno Precedente riconosciuto: {uploaded_file.name}")
-            elif file_type == "GRP":
-                if 'Room nights' in data_df.columns and data_df['Room nights'].sum() > 0:
-                    grp_otb_data = data_df
-                    st.success(f"File Gruppi Confermati riconosciuto: {uploaded_file.name}")
-                else:
-                    grp_opz_data = data_df
-                    st.success(f"File Gruppi Opzionati riconosciuto: {uploaded_file.name}")
-        
-        except Exception as e:
-            st.error(f"Errore nell'elaborazione del file {uploaded_file.name}: {str(e)}")
-            st.code(traceback.format_exc())
+    for parsed in parsed_files:
+        diagnostics.debug(f"Tipo file {parsed['name']}: {parsed['file_type']}, Anno: {parsed['year']}", stage="import")
+        if parsed['data'] is not None:
+            diagnostics.frame(f"Date estratte da {parsed['name']}", parsed['data']['data'])
+        if parsed['error'] is not None:
+            diagnostics.error(parsed['error'], stage="import")
+    
+    imported, messages = assign_import_roles(parsed_files, datetime.now().year)
+    
+    for level, message in messages:
+        getattr(st, level)(message)
+    
+    for parsed in parsed_files:
+        if parsed['traceback']:
+            st.code(parsed['traceback'])
+    
+    idv_cy_data = imported['idv_cy']
+    idv_ly_data = imported['idv_ly']
+    grp_otb_data = imported['grp_otb']
+    grp_opz_data = imported['grp_opz']
     
     try:
         has_valid_dates = (idv_cy_data is not None and 'data' in idv_cy_data.columns 
@@ -517,7 +476,7 @@ def process_excel_import(uploaded_files):
             min_date = idv_cy_data['data'].min()
             max_date = idv_cy_data['data'].max()
             
-            st.write(f"Debug: Range date trovate: {min_date} - {max_date}")
+            diagnostics.debug(f"Range date trovate: {min_date} - {max_date}", stage="import")
             
             if pd.notna(min_date) and pd.notna(max_date):
                 available_dates = pd.date_range(start=min_date, end=max_date)
@@ -536,194 +495,38 @@ def process_excel_import(uploaded_files):
         st.warning(f"Utilizzando date predefinite: {fallback_start.strftime('%d/%m/%Y')} - {fallback_end.strftime('%d/%m/%Y')}")
     
     if idv_cy_data is not None and len(idv_cy_data) > 0:
-        st.write("Debug: Dati IDV CY trovati")
-        st.write(idv_cy_data.head())
+        diagnostics.frame("Dati IDV CY", idv_cy_data)
     if idv_ly_data is not None and len(idv_ly_data) > 0:
-        st.write("Debug: Dati IDV LY trovati")
-        st.write(idv_ly_data.head())
+        diagnostics.frame("Dati IDV LY", idv_ly_data)
     
     return idv_cy_data, idv_ly_data, grp_otb_data, grp_opz_data
 
-def identify_excel_file_type(df):
-    try:
-        found_filter_row = False
-        filter_text = ""
-        
-        for idx, row in df.iterrows():
-            row_str = ' '.join([str(val) for val in row.values if pd.notna(val)])
-            if 'Filtri applicati:' in row_str:
-                filter_text = row_str
-                found_filter_row = True
-                break
-        
-        if not found_filter_row:
-            return "UNKNOWN", None, None
-        
-        year_match = re.search(r'(\d{4})\s+\(S_Esercizio\)', filter_text)
-        month_match = re.search(r'(\w+)\s+(\d{4})\s+\(S_Anno\s+Mese\)', filter_text)
-        
-        year = year_match.group(1) if year_match else None
-        month_year = month_match.group(0).split('(')[0].strip() if month_match else None
-        
-        if "Descrizione Mercato TOB non è Gruppi" in filter_text:
-            return "IDV", year, month_year
-        elif "Descrizione Mercato TOB è Gruppi" in filter_text:
-            return "GRP", year, month_year
-        else:
-            return "UNKNOWN", year, month_year
-    
-    except Exception as e:
-        st.error(f"Errore nell'identificazione del tipo di file: {e}")
-        return "UNKNOWN", None, None
-
 def process_imported_data(idv_cy_data, idv_ly_data, grp_otb_data, grp_opz_data, date_range):
     try:
-        st.write(f"Debug: Elaborazione date range: {date_range.min()} - {date_range.max()}")
-        result_dates = date_range
-        result_df = pd.DataFrame({'data': result_dates})
-        
-        result_df['giorno'] = result_df['data'].dt.strftime('%a')
-        result_df['data_ly'] = result_df['data'].apply(same_day_last_year)
-        result_df['giorno_ly'] = result_df['data_ly'].dt.strftime('%a')
-        
-        if idv_cy_data is not None and 'data' in idv_cy_data.columns:
-            if 'Room nights' in idv_cy_data.columns:
-                idv_cy_data.rename(columns={
-                    'Room nights': 'otb_ind_rn',
-                    'ADR Cam': 'otb_ind_adr'
-                }, inplace=True)
-            
-            st.write("Debug: Filtro date IDV CY")
-            idv_cy_filtered = idv_cy_data[idv_cy_data['data'].isin(result_df['data'])]
-            
-            if not idv_cy_filtered.empty:
-                idv_cy_grouped = idv_cy_filtered.groupby('data').agg({
-                    'otb_ind_rn': 'sum',
-                    'otb_ind_adr': 'mean'
-                }).reset_index()
-                
-                result_df = pd.merge(result_df, idv_cy_grouped[['data', 'otb_ind_rn', 'otb_ind_adr']], 
-                                    on='data', how='left')
-            else:
-                result_df['otb_ind_rn'] = 0
-                result_df['otb_ind_adr'] = 0
-        else:
-            result_df['otb_ind_rn'] = 0
-            result_df['otb_ind_adr'] = 0
-        
-        if idv_ly_data is not None and 'data' in idv_ly_data.columns:
-            if 'Room nights' in idv_ly_data.columns:
-                idv_ly_data.rename(columns={
-                    'Room nights': 'ly_ind_rn',
-                    'ADR Cam': 'ly_ind_adr'
-                }, inplace=True)
-            
-            idv_ly_data['data'] = pd.to_datetime(idv_ly_data['data'])
-            
-            st.write("Debug: Filtro date IDV LY")
-            ly_dates = [same_day_last_year(d) for d in result_df['data']]
-            idv_ly_filtered = idv_ly_data[idv_ly_data['data'].isin(ly_dates)]
-            
-            if not idv_ly_filtered.empty:
-                idv_ly_filtered['data_ly'] = idv_ly_filtered['data']
-                
-                idv_ly_grouped = idv_ly_filtered.groupby('data_ly').agg({
-                    'ly_ind_rn': 'sum',
-                    'ly_ind_adr': 'mean'
-                }).reset_index()
-                
-                result_df = pd.merge(result_df, idv_ly_grouped[['data_ly', 'ly_ind_rn', 'ly_ind_adr']], 
-                                    on='data_ly', how='left')
-            else:
-                result_df['ly_ind_rn'] = 0
-                result_df['ly_ind_adr'] = 0
-        else:
-            result_df['ly_ind_rn'] = 0
-            result_df['ly_ind_adr'] = 0
-        
-        if grp_otb_data is not None and not grp_otb_data.empty and 'data' in grp_otb_data.columns:
-            if 'Room nights' in grp_otb_data.columns:
-                grp_otb_data.rename(columns={
-                    'Room nights': 'grp_otb_rn',
-                    'ADR Cam': 'grp_otb_adr'
-                }, inplace=True)
-            
-            st.write("Debug: Filtro date GRP OTB")
-            grp_otb_filtered = grp_otb_data[grp_otb_data['data'].isin(result_df['data'])]
-            
-            if not grp_otb_filtered.empty:
-                grp_otb_grouped = grp_otb_filtered.groupby('data').agg({
-                    'grp_otb_rn': 'sum',
-                    'grp_otb_adr': 'mean'
-                }).reset_index()
-                
-                result_df = pd.merge(result_df, grp_otb_grouped[['data', 'grp_otb_rn', 'grp_otb_adr']], 
-                                    on='data', how='left')
-            else:
-                result_df['grp_otb_rn'] = 0
-                result_df['grp_otb_adr'] = 0
-        else:
-            result_df['grp_otb_rn'] = 0
-            result_df['grp_otb_adr'] = 0
-        
-        if grp_opz_data is not None and not grp_opz_data.empty and 'data' in grp_opz_data.columns:
-            if 'Room nights' in grp_opz_data.columns:
-                grp_opz_data.rename(columns={
-                    'Room nights': 'grp_opz_rn',
-                    'ADR Cam': 'grp_opz_adr'
-                }, inplace=True)
-            
-            st.write("Debug: Filtro date GRP OPZ")
-            grp_opz_filtered = grp_opz_data[grp_opz_data['data'].isin(result_df['data'])]
-            
-            if not grp_opz_filtered.empty:
-                grp_opz_grouped = grp_opz_filtered.groupby('data').agg({
-                    'grp_opz_rn': 'sum',
-                    'grp_opz_adr': 'mean'
-                }).reset_index()
-                
-                result_df = pd.merge(result_df, grp_opz_grouped[['data', 'grp_opz_rn', 'grp_opz_adr']], 
-                                    on='data', how='left')
-            else:
-                result_df['grp_opz_rn'] = 0
-                result_df['grp_opz_adr'] = 0
-        else:
-            result_df['grp_opz_rn'] = 0
-            result_df['grp_opz_adr'] = 0
-        
-        result_df = result_df.fillna(0)
+        diagnostics.debug(f"Elaborazione date range: {date_range.min()} - {date_range.max()}", stage="elaborazione")
+        segments = prepare_segments(idv_cy_data, idv_ly_data, grp_otb_data, grp_opz_data)
         
         if 'forecast_method' not in st.session_state:
             st.session_state['forecast_method'] = "LY - OTB"
         
-        if st.session_state['forecast_method'] == "Basato su LY":
-            result_df['fcst_ind_rn'] = np.ceil(result_df['ly_ind_rn'] * st.session_state.get('pickup_factor', 1.0))
-        elif st.session_state['forecast_method'] == "Percentuale su OTB":
-            result_df['fcst_ind_rn'] = np.ceil(result_df['otb_ind_rn'] * (1 + st.session_state.get('pickup_percentage', 20)/100))
-        elif st.session_state['forecast_method'] == "Valore assoluto":
-            result_df['fcst_ind_rn'] = result_df['otb_ind_rn'] + st.session_state.get('pickup_value', 10)
-        else:
-            result_df['fcst_ind_rn'] = result_df['ly_ind_rn'] - result_df['otb_ind_rn']
-            result_df['fcst_ind_rn'] = result_df['fcst_ind_rn'].apply(lambda x: max(0, x))
-        
-        result_df['fcst_ind_adr'] = result_df['otb_ind_adr']
-        
-        result_df['otb_ind_rev'] = result_df['otb_ind_rn'] * result_df['otb_ind_adr']
-        result_df['ly_ind_rev'] = result_df['ly_ind_rn'] * result_df['ly_ind_adr']
-        result_df['grp_otb_rev'] = result_df['grp_otb_rn'] * result_df['grp_otb_adr']
-        result_df['grp_opz_rev'] = result_df['grp_opz_rn'] * result_df['grp_opz_adr']
-        result_df['fcst_ind_rev'] = result_df['fcst_ind_rn'] * result_df['fcst_ind_adr']
-        
-        result_df['finale_rn'] = result_df['fcst_ind_rn'] + result_df['otb_ind_rn'] + result_df['grp_otb_rn']
-        result_df['finale_opz_rn'] = result_df['finale_rn'] + result_df['grp_opz_rn']
-        
-        result_df['finale_rev'] = result_df['otb_ind_rev'] + result_df['fcst_ind_rev'] + result_df['grp_otb_rev']
-        result_df['finale_adr'] = np.where(result_df['finale_rn'] > 0,
-                                       result_df['finale_rev'] / result_df['finale_rn'],
-                                       0)
+        pickup_curve = None
+        as_of = pd.Timestamp(st.session_state.get('snapshot_as_of', datetime.now())).normalize()
+        if st.session_state['forecast_method'] == "Curva pickup":
+            pickup_curve = fit_pickup_curve(segments, as_of, snapshot_store.pickup_history(as_of=as_of))
+            st.session_state['pickup_curve'] = pickup_curve
+        
+        result_df = build_analysis_frame(
+            segments,
+            date_range,
+            st.session_state['forecast_method'],
+            pickup_factor=st.session_state.get('pickup_factor', 1.0),
+            pickup_percentage=st.session_state.get('pickup_percentage', 20),
+            pickup_value=st.session_state.get('pickup_value', 10),
+            curve=pickup_curve,
+            as_of=as_of
+        )
         
-        st.write("Debug: Risultato finale elaborazione")
-        st.write(result_df.head())
+        diagnostics.frame("Risultato finale elaborazione", result_df)
         
         return result_df
         
@@ -732,6 +535,66 @@ def process_imported_data(idv_cy_data, idv_ly_data, grp_otb_data, grp_opz_data,
         st.code(traceback.format_exc())
         return None
 
+def get_demand_grid(raw_excel_data, available_dates, hotel_capacity):
+    # Calcolato una volta per import: si rigenera solo se cambiano capacità, parametri di forecast, data OTB o giorno
+    forecast_method = st.session_state.get('forecast_method', "LY - OTB")
+    as_of = pd.Timestamp(st.session_state.get('snapshot_as_of', datetime.now())).normalize()
+    params = (hotel_capacity, forecast_method, st.session_state.get('pickup_factor', 1.0),
+              st.session_state.get('pickup_percentage', 20), st.session_state.get('pickup_value', 10),
+              as_of, snapshot_store.hotel, pd.Timestamp.today().normalize())
+    cached = st.session_state.get('demand_grid')
+    if cached is not None and cached['params'] == params:
+        return cached
+    
+    grid = None
+    date_range = horizon(available_dates)
+    if len(date_range) > 0:
+        # Solo funzioni del motore: il calendario non tocca la curva pickup né i dati dell'analisi in sessione
+        with diagnostics.stage("calendario disponibilità") as grid_stage:
+            try:
+                segments = prepare_segments(raw_excel_data['idv_cy'], raw_excel_data['idv_ly'],
+                                            raw_excel_data['grp_otb'], raw_excel_data['grp_opz'])
+                curve = None
+                if forecast_method == "Curva pickup":
+                    curve = fit_pickup_curve(segments, as_of, snapshot_store.pickup_history(as_of=as_of))
+                data = build_analysis_frame(segments, date_range, forecast_method, pickup_factor=params[2],
+                                            pickup_percentage=params[3], pickup_value=params[4], curve=curve,
+                                            as_of=as_of)
+                grid = demand_grid(data, hotel_capacity)
+            except Exception as e:
+                diagnostics.error(f"Calendario disponibilità non calcolato: {e}", stage="calendario disponibilità")
+            grid_stage['righe'] = len(date_range)
+    
+    cached = {'params': params, 'grid': grid, 'figure': None}
+    st.session_state['demand_grid'] = cached
+    return cached
+
+def get_acceptance_curve():
+    # Stima rifatta solo al cambio hotel o quando in questa sessione si registra un esito
+    cached = st.session_state.get('acceptance_curve')
+    if cached is None or cached[0] != quote_store.hotel:
+        decided = quote_store.decided_quotes()
+        curve = AcceptanceCurve.fit(quote_features(decided)) if not decided.empty else None
+        cached = (quote_store.hotel, curve)
+        st.session_state['acceptance_curve'] = cached
+    return cached[1]
+
+def save_quote_outcome(quote_id, outcome_key):
+    outcome = st.session_state[outcome_key]
+    quote_store.set_outcome(quote_id, None if outcome == "Pendente" else outcome)
+    st.session_state.pop('acceptance_curve', None)
+
+def get_pickup_history(analyzed_data, as_of):
+    # Storico per la dispersione del pickup: snapshot OTB se sufficienti, altrimenti LY vs OTB dell'import o dei dati inseriti
+    if 'raw_excel_data' in st.session_state:
+        history = snapshot_store.pickup_history(as_of=as_of)
+        if len(history) >= MIN_SNAPSHOT_OBSERVATIONS:
+            return history
+        raw_excel_data = session_memory.load(st.session_state, 'raw_excel_data')
+        segments = prepare_segments(raw_excel_data['idv_cy'], raw_excel_data['idv_ly'], None, None)
+        return history_from_ly(segments['idv_cy'], segments['idv_ly'], as_of)
+    return history_from_frame(analyzed_data, as_of)
+
 def get_booking_data():
     if 'booking_data_json' in st.session_state:
         try:
@@ -763,213 +626,7 @@ def get_overlapping_events(events_df, start_date, end_date):
     
     return overlapping
 
-def generate_excel_report(result_df, metrics, group_info, hotel_info):
-    output = io.BytesIO()
-    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
-    
-    title_format = workbook.add_format({
-        'bold': True,
-        'font_size': 16,
-        'align': 'center',
-        'valign': 'vcenter',
-        'bg_color': COLOR_PALETTE["background"],
-        'font_color': COLOR_PALETTE["text"],
-        'border': 1
-    })
-    
-    header_format = workbook.add_format({
-        'bold': True,
-        'font_size': 12,
-        'align': 'center',
-        'valign': 'vcenter',
-        'bg_color': COLOR_PALETTE["primary"],
-        'font_color': 'white',
-        'border': 1
-    })
-    
-    cell_format = workbook.add_format({
-        'align': 'center',
-        'valign': 'vcenter',
-        'border': 1
-    })
-    
-    number_format = workbook.add_format({
-        'align': 'center',
-        'valign': 'vcenter',
-        'border': 1,
-        'num_format': '#,##0'
-    })
-    
-    currency_format = workbook.add_format({
-        'align': 'center',
-        'valign': 'vcenter',
-        'border': 1,
-        'num_format': '€#,##0.00'
-    })
-    
-    percentage_format = workbook.add_format({
-        'align': 'center',
-        'valign': 'vcenter',
-        'border': 1,
-        'num_format': '0.0%'
-    })
-    
-    date_format = workbook.add_format({
-        'align': 'center',
-        'valign': 'vcenter',
-        'border': 1,
-        'num_format': 'dd/mm/yyyy'
-    })
-    
-    section_format = workbook.add_format({
-        'bold': True,
-        'font_size': 14,
-        'align': 'left',
-        'valign': 'vcenter',
-        'bg_color': COLOR_PALETTE["secondary"],
-        'font_color': 'white',
-        'border': 1
-    })
-    
-    result_positive = workbook.add_format({
-        'bold': True,
-        'font_size': 14,
-        'align': 'center',
-        'valign': 'vcenter',
-        'bg_color': COLOR_PALETTE["positive"],
-        'font_color': 'white',
-        'border': 1
-    })
-    
-    result_negative = workbook.add_format({
-        'bold': True,
-        'font_size': 14,
-        'align': 'center',
-        'valign': 'vcenter',
-        'bg_color': COLOR_PALETTE["negative"],
-        'font_color': 'white',
-        'border': 1
-    })
-    
-    summary_sheet = workbook.add_worksheet('Riepilogo')
-    summary_sheet.set_column('A:A', 30)
-    summary_sheet.set_column('B:B', 30)
-    summary_sheet.set_column('C:C', 20)
-    summary_sheet.set_column('D:D', 20)
-    
-    summary_sheet.merge_range('A1:D1', 'RIEPILOGO ANALISI DISPLACEMENT', title_format)
-    
-    summary_sheet.merge_range('A3:D3', 'DATI HOTEL', section_format)
-    summary_sheet.write('A4', 'Hotel', cell_format)
-    summary_sheet.write('B4', hotel_info['name'], cell_format)
-    summary_sheet.write('A5', 'Capacità camere', cell_format)
-    summary_sheet.write('B5', hotel_info['capacity'], number_format)
-    summary_sheet.write('A6', 'Aliquota IVA', cell_format)
-    summary_sheet.write('B6', hotel_info['iva_rate'], percentage_format)
-    
-    summary_sheet.merge_range('A8:D8', 'DATI GRUPPO', section_format)
-    summary_sheet.write('A9', 'Nome gruppo', cell_format)
-    summary_sheet.write('B9', group_info['name'], cell_format)
-    summary_sheet.write('A10', 'Data arrivo', cell_format)
-    summary_sheet.write('B10', group_info['arrival_date'], date_format)
-    summary_sheet.write('A11', 'Data partenza', cell_format)
-    summary_sheet.write('B11', group_info['departure_date'], date_format)
-    summary_sheet.write('A12', 'Numero camere', cell_format)
-    summary_sheet.write('B12', group_info['num_rooms'], number_format)
-    summary_sheet.write('A13', 'ADR lordo', cell_format)
-    summary_sheet.write('B13', group_info['adr_lordo'], currency_format)
-    summary_sheet.write('A14', 'ADR netto', cell_format)
-    summary_sheet.write('B14', group_info['adr_netto'], currency_format)
-    summary_sheet.write('A15', 'Revenue ancillare', cell_format)
-    summary_sheet.write('B15', group_info['ancillary_revenue'], currency_format)
-    
-    summary_sheet.merge_range('A17:D17', 'RISULTATI ANALISI', section_format)
-    summary_sheet.write('A18', 'Camere richieste', cell_format)
-    summary_sheet.write('B18', metrics['total_group_rooms'], number_format)
-    summary_sheet.write('A19', 'Camere accettate', cell_format)
-    summary_sheet.write('B19', metrics['accepted_rooms'], number_format)
-    summary_sheet.write('A20', 'Camere displaced', cell_format)
-    summary_sheet.write('B20', metrics['displaced_rooms'], number_format)
-    summary_sheet.write('A21', 'Revenue camere gruppo', cell_format)
-    summary_sheet.write('B21', metrics['group_room_revenue'], currency_format)
-    summary_sheet.write('A22', 'Revenue ancillare', cell_format)
-    summary_sheet.write('B22', metrics['group_ancillary'], currency_format)
-    summary_sheet.write('A23', 'Revenue displaced', cell_format)
-    summary_sheet.write('B23', metrics['revenue_displaced'], currency_format)
-    summary_sheet.write('A24', 'Impatto totale', cell_format)
-    summary_sheet.write('B24', metrics['total_impact'], currency_format)
-    summary_sheet.write('A25', 'Valore totale lordo', cell_format)
-    summary_sheet.write('B25', metrics['total_lordo'], currency_format)
-    
-    decision_text = "ACCETTA GRUPPO" if metrics['should_accept'] else "DECLINA GRUPPO"
-    decision_format = result_positive if metrics['should_accept'] else result_negative
-    summary_sheet.merge_range('A27:D27', decision_text, decision_format)
-    
-    if metrics['needs_authorization']:
-        summary_sheet.merge_range('A29:D29', 'ATTENZIONE: RICHIEDE AUTORIZZAZIONE (>€35.000)', result_negative)
-    
-    summary_sheet.merge_range('A31:D31', f'Report generato il {datetime.now().strftime("%d/%m/%Y %H:%M")} da {st.session_state["username"]}', cell_format)
-    
-    data_sheet = workbook.add_worksheet('Dati Dettagliati')
-    
-    columns = ['data', 'giorno', 'finale_rn', 'camere_gruppo', 'camere_disponibili', 
-              'camere_displaced', 'adr_gruppo_netto', 'finale_adr', 
-              'revenue_camere_gruppo_effettivo', 'revenue_displaced', 'impatto_revenue_totale']
-    
-    headers = ['Data', 'Giorno', 'FCST OTB', 'REQ', 'Disponibili', 
-              'DSPL', 'ADR Netto', 'ADR Attuale', 
-              'REV REQ', 'REV DSPL', 'DIFF']
-    
-    for i, col in enumerate(columns):
-        data_sheet.set_column(i, i, 15)
-    
-    for i, header in enumerate(headers):
-        data_sheet.write(0, i, header, header_format)
-    
-    for i, row in result_df.reset_index(drop=True).iterrows():
-        data_sheet.write(i+1, 0, row['data'], date_format)
-        data_sheet.write(i+1, 1, row['giorno'], cell_format)
-        data_sheet.write(i+1, 2, row['finale_rn'], number_format)
-        data_sheet.write(i+1, 3, row['camere_gruppo'], number_format)
-        data_sheet.write(i+1, 4, row['camere_disponibili'], number_format)
-        data_sheet.write(i+1, 5, row['camere_displaced'], number_format)
-        data_sheet.write(i+1, 6, row['adr_gruppo_netto'], currency_format)
-        data_sheet.write(i+1, 7, row['finale_adr'], currency_format)
-        data_sheet.write(i+1, 8, row['revenue_camere_gruppo_effettivo'], currency_format)
-        data_sheet.write(i+1, 9, row['revenue_displaced'], currency_format)
-        data_sheet.write(i+1, 10, row['impatto_revenue_totale'], currency_format)
-    
-    forecast_sheet = workbook.add_worksheet('Forecast e OTB')
-    
-    forecast_cols = ['data', 'giorno', 'otb_ind_rn', 'ly_ind_rn', 'fcst_ind_rn', 
-                    'grp_otb_rn', 'grp_opz_rn', 'finale_rn']
-    
-    forecast_headers = ['Data', 'Giorno', 'OTB IND', 'LY IND', 'FCST IND', 
-                        'GRP OTB', 'GRP OPZ', 'TOTALE']
-    
-    for i, col in enumerate(forecast_cols):
-        forecast_sheet.set_column(i, i, 15)
-    
-    for i, header in enumerate(forecast_headers):
-        forecast_sheet.write(0, i, header, header_format)
-    
-    for i, row in result_df.reset_index(drop=True).iterrows():
-        forecast_sheet.write(i+1, 0, row['data'], date_format)
-        forecast_sheet.write(i+1, 1, row['giorno'], cell_format)
-        forecast_sheet.write(i+1, 2, row['otb_ind_rn'], number_format)
-        forecast_sheet.write(i+1, 3, row['ly_ind_rn'], number_format)
-        forecast_sheet.write(i+1, 4, row['fcst_ind_rn'], number_format)
-        forecast_sheet.write(i+1, 5, row['grp_otb_rn'], number_format)
-        forecast_sheet.write(i+1, 6, row['grp_opz_rn'], number_format)
-        forecast_sheet.write(i+1, 7, row['finale_rn'], number_format)
-    
-    workbook.close()
-    
-    output.seek(0)
-    return output.getvalue()
-
-def get_excel_download_link(result_df, metrics, group_info, hotel_info, filename):
-    excel_data = generate_excel_report(result_df, metrics, group_info, hotel_info)
+def get_excel_download_link(excel_data, filename):
     b64 = base64.b64encode(excel_data).decode()
     
     return f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}.xlsx" class="download-button">📥 Scarica Report Excel</a>'
@@ -1041,373 +698,20 @@ def load_events_from_json_url(city, url="https://www.revguardian.altervista.org/
         st.error(f"Errore nella richiesta degli eventi: {e}")
         return pd.DataFrame()
 
-class ExcelCompatibleDisplacementAnalyzer:
-    def __init__(self, hotel_capacity, iva_rate=0.1):
-        self.hotel_capacity = hotel_capacity
-        self.iva_rate = iva_rate
-        self.data = None
-        self.group_request = None
-        self.decision_params = None
-        self.room_types = None
-    
-    def set_data(self, data_df):
-        self.data = data_df
-        return self
-    
-    def set_group_request(self, start_date, end_date, num_rooms, adr_lordo, adr_netto=None, fb_revenue=0, meeting_revenue=0, other_revenue=0):
-        if adr_netto is None:
-            adr_netto = adr_lordo / (1 + self.iva_rate)
-            
-        try:
-            date_range = pd.date_range(start=start_date, end=end_date - timedelta(days=1))
-        except Exception as e:
-            st.error(f"Errore nella creazione del date range: {e}")
-            date_range = pd.date_range(start=datetime.now(), end=datetime.now() + timedelta(days=3))
-            
-        total_days = len(date_range)
-        
-        daily_fb = fb_revenue / total_days if total_days > 0 else 0
-        daily_meeting = meeting_revenue / total_days if total_days > 0 else 0
-        daily_other = other_revenue / total_days if total_days > 0 else 0
-        total_ancillary = daily_fb + daily_meeting + daily_other
-        
-        self.group_request = pd.DataFrame({
-            'data': date_range,
-            'camere_gruppo': num_rooms,
-            'adr_gruppo_lordo': adr_lordo,
-            'adr_gruppo_netto': adr_netto,
-            'revenue_camere_gruppo': num_rooms * adr_netto,
-            'revenue_fb_gruppo': daily_fb,
-            'revenue_meeting_gruppo': daily_meeting,
-            'revenue_other_gruppo': daily_other,
-            'revenue_ancillare_gruppo': total_ancillary,
-            'revenue_totale_gruppo': (num_rooms * adr_netto) + total_ancillary
-        })
-        
-        return self
-    
-    def set_group_request_variable(self, start_date, end_date, rooms_data, adr_lordo, adr_netto=None, fb_revenue=0, meeting_revenue=0, other_revenue=0):
-        if adr_netto is None:
-            adr_netto = adr_lordo / (1 + self.iva_rate)
-            
-        try:
-            date_range = pd.date_range(start=start_date, end=end_date - timedelta(days=1))
-        except Exception as e:
-            st.error(f"Errore nella creazione del date range: {e}")
-            date_range = pd.date_range(start=datetime.now(), end=datetime.now() + timedelta(days=3))
-            
-        total_days = len(date_range)
-        
-        daily_fb = fb_revenue / total_days if total_days > 0 else 0
-        daily_meeting = meeting_revenue / total_days if total_days > 0 else 0
-        daily_other = other_revenue / total_days if total_days > 0 else 0
-        total_ancillary = daily_fb + daily_meeting + daily_other
-        
-        base_df = pd.DataFrame({'data': date_range})
-        rooms_data = pd.merge(base_df, rooms_data, on='data', how='left')
-        rooms_data['camere'] = rooms_data['camere'].fillna(0)
-        
-        self.group_request = pd.DataFrame({
-            'data': date_range,
-            'camere_gruppo': rooms_data['camere'].values,
-            'adr_gruppo_lordo': adr_lordo,
-            'adr_gruppo_netto': adr_netto,
-            'revenue_camere_gruppo': rooms_data['camere'].values * adr_netto,
-            'revenue_fb_gruppo': daily_fb,
-            'revenue_meeting_gruppo': daily_meeting,
-            'revenue_other_gruppo': daily_other,
-            'revenue_ancillare_gruppo': total_ancillary,
-            'revenue_totale_gruppo': (rooms_data['camere'].values * adr_netto) + total_ancillary
-        })
-        
-        return self
-    
-    def set_group_request_with_types(self, start_date, end_date, room_types, adr_lordo, adr_netto=None, fb_revenue=0, meeting_revenue=0, other_revenue=0):
-        if adr_netto is None:
-            adr_netto = adr_lordo / (1 + self.iva_rate)
-            
-        try:
-            date_range = pd.date_range(start=start_date, end=end_date - timedelta(days=1))
-        except Exception as e:
-            st.error(f"Errore nella creazione del date range: {e}")
-            date_range = pd.date_range(start=datetime.now(), end=datetime.now() + timedelta(days=3))
-            
-        total_days = len(date_range)
-        
-        daily_fb = fb_revenue / total_days if total_days > 0 else 0
-        daily_meeting = meeting_revenue / total_days if total_days > 0 else 0
-        daily_other = other_revenue / total_days if total_days > 0 else 0
-        total_ancillary = daily_fb + daily_meeting + daily_other
-        
-        if isinstance(room_types, pd.DataFrame):
-            room_types = room_types.to_dict('records')
-        elif not isinstance(room_types, list):
-            st.error(f"Tipo di room_types non supportato: {type(room_types)}")
-            room_types = [{"tipo": "ROH", "numero": 1, "adr_addon": 0.0}]
-        
-        total_rooms = sum(rt["numero"] for rt in room_types)
-        total_revenue = sum((rt["numero"] * (adr_netto + rt["adr_addon"] / (1 + self.iva_rate))) for rt in room_types)
-        
-        if total_rooms > 0:
-            weighted_adr_netto = total_revenue / total_rooms
-        else:
-            weighted_adr_netto = adr_netto
-        
-        weighted_adr_lordo = weighted_adr_netto * (1 + self.iva_rate)
-        
-        self.group_request = pd.DataFrame({
-            'data': date_range,
-            'camere_gruppo': total_rooms,
-            'adr_gruppo_lordo': weighted_adr_lordo,
-            'adr_gruppo_netto': weighted_adr_netto,
-            'revenue_camere_gruppo': total_rooms * weighted_adr_netto,
-            'revenue_fb_gruppo': daily_fb,
-            'revenue_meeting_gruppo': daily_meeting,
-            'revenue_other_gruppo': daily_other,
-            'revenue_ancillare_gruppo': total_ancillary,
-            'revenue_totale_gruppo': (total_rooms * weighted_adr_netto) + total_ancillary
-        })
-        
-        self.room_types = room_types
-        
-        return self
-    
-    def set_decision_parameters(self, params):
-        self.decision_params = params
-        return self
-    
-    def analyze(self):
-        if self.data is None or self.group_request is None or self.decision_params is None:
-            raise ValueError("Dati, richiesta gruppo o parametri decisionali mancanti")
-        
-        result = pd.merge(self.data, self.group_request, on='data', how='right')
-        
-        result['finale_rn'] = result['fcst_ind_rn'] + result['otb_ind_rn'] + result['grp_otb_rn']
-        result['finale_opz_rn'] = result['finale_rn']
-        
-        result['camere_disponibili'] = self.hotel_capacity - result['finale_rn']
-        result['camere_displaced'] = np.where(
-            self.hotel_capacity - (result['finale_rn'] + result['camere_gruppo']) > 0,
-            0,
-            (result['finale_rn'] + result['camere_gruppo']) - self.hotel_capacity
-        )
-        
-        result['camere_gruppo_accettate'] = result['camere_gruppo']
-        
-        result['revenue_displaced'] = result['camere_displaced'] * result['finale_adr']
-        
-        result['revenue_camere_gruppo_effettivo'] = result['camere_gruppo'] * result['adr_gruppo_netto']
-        
-        result['impatto_revenue_camera'] = result['revenue_camere_gruppo_effettivo'] - result['revenue_displaced']
-        result['impatto_revenue_totale'] = result['impatto_revenue_camera'] + result['revenue_ancillare_gruppo']
-        
-        result['occupazione_attuale'] = result['finale_rn'] / self.hotel_capacity * 100
-        result['occupazione_con_gruppo'] = (result['finale_rn'] + result['camere_gruppo_accettate'] - result['camere_displaced']) / self.hotel_capacity * 100
-        
-        if result['otb_ind_rn'].sum() > 0:
-            avg_adr_cy = np.average(result['otb_ind_adr'], weights=result['otb_ind_rn'])
-        else:
-            avg_adr_cy = result['otb_ind_adr'].mean() if len(result['otb_ind_adr']) > 0 else 0
-            
-        if result['ly_ind_rn'].sum() > 0:
-            avg_adr_ly = np.average(result['ly_ind_adr'], weights=result['ly_ind_rn'])
-        else:
-            avg_adr_ly = result['ly_ind_adr'].mean() if len(result['ly_ind_adr']) > 0 else 0
-        
-        result['avg_adr_cy'] = avg_adr_cy
-        result['avg_adr_ly'] = avg_adr_ly
-        
-        result['extra_vs_ly'] = result['adr_gruppo_netto'] - avg_adr_ly
-        
-        return result
-    
-    def get_summary_metrics(self, analysis_df):
-        total_displaced_revenue = analysis_df['revenue_displaced'].sum()
-        total_group_rooms = analysis_df['camere_gruppo'].sum()
-        total_group_room_revenue = analysis_df['revenue_camere_gruppo_effettivo'].sum()
-        total_group_ancillary = analysis_df['revenue_ancillare_gruppo'].sum()
-        total_impact = analysis_df['impatto_revenue_totale'].sum()
-        
-        total_lordo = (total_group_room_revenue * (1 + self.iva_rate)) + total_group_ancillary
-        needs_authorization = total_lordo > 35000
-        
-        adr_netto = analysis_df['adr_gruppo_netto'].mean()
-        adr_lordo = analysis_df['adr_gruppo_lordo'].mean()
-        
-        avg_adr_cy = analysis_df['avg_adr_cy'].iloc[0] if not analysis_df.empty else 0
-        avg_adr_ly = analysis_df['avg_adr_ly'].iloc[0] if not analysis_df.empty else 0
-        
-        extra_vs_ly = adr_netto - avg_adr_ly
-        
-        accepted_rooms = analysis_df['camere_gruppo'].sum()
-        displaced_rooms = analysis_df['camere_displaced'].sum()
-        
-        avg_occ_current = analysis_df['occupazione_attuale'].mean()
-        avg_occ_with_group = analysis_df['occupazione_con_gruppo'].mean()
-        
-        should_accept = total_impact > 0
-        
-        return {
-            'revenue_displaced': total_displaced_revenue,
-            'group_room_revenue': total_group_room_revenue,
-            'group_ancillary': total_group_ancillary,
-            'total_impact': total_impact,
-            'total_lordo': total_lordo,
-            'needs_authorization': needs_authorization,
-            'should_accept': should_accept,
-            'current_adr_lordo': adr_lordo,
-            'current_adr_netto': adr_netto,
-            'avg_adr_cy': avg_adr_cy,
-            'avg_adr_ly': avg_adr_ly,
-            'extra_vs_ly': extra_vs_ly,
-            'total_group_rooms': total_group_rooms,
-            'accepted_rooms': accepted_rooms,
-            'displaced_rooms': displaced_rooms,
-            'avg_occ_current': avg_occ_current,
-            'avg_occ_with_group': avg_occ_with_group,
-            'room_profit': total_group_room_revenue - total_displaced_revenue,
-            'total_rev_profit': total_impact,
-            'profit_per_room': (total_group_room_revenue - total_displaced_revenue) / accepted_rooms if accepted_rooms > 0 else 0,
-        }
-    
-    def create_visualizations(self, analysis_df, metrics, events_df=None):
-        fig = make_subplots(rows=3, cols=1,
-                          shared_xaxes=True,
-                          vertical_spacing=0.1,
-                          subplot_titles=('Occupazione', 'ADR', 'Impatto Revenue'))
-        
-        fig.add_trace(
-            go.Bar(name='OTB', x=analysis_df['data'], y=analysis_df['finale_rn'],
-                  marker_color=COLOR_PALETTE["secondary"]),
-            row=1, col=1
-        )
-        
-        fig.add_trace(
-            go.Bar(name='Gruppo', x=analysis_df['data'], y=analysis_df['camere_gruppo'],
-                  marker_color=COLOR_PALETTE["primary"]),
-            row=1, col=1
-        )
-        
-        fig.add_trace(
-            go.Scatter(name='Capacità Hotel', x=analysis_df['data'], 
-                      y=[self.hotel_capacity]*len(analysis_df),
-                      mode='lines', line=dict(color=COLOR_PALETTE["accent"], dash='dash')),
-            row=1, col=1
-        )
-        
-        fig.add_trace(
-            go.Scatter(name='ADR Gruppo Netto', x=analysis_df['data'], y=analysis_df['adr_gruppo_netto'],
-                     mode='lines+markers', marker=dict(color=COLOR_PALETTE["primary"])),
-            row=2, col=1
-        )
-        
-        fig.add_trace(
-            go.Scatter(name='ADR Periodo CY', x=analysis_df['data'], 
-                      y=[metrics['avg_adr_cy']]*len(analysis_df),
-                      mode='lines', line=dict(color=COLOR_PALETTE["secondary"])),
-            row=2, col=1
-        )
-        
-        fig.add_trace(
-            go.Scatter(name='ADR Periodo LY', x=analysis_df['data'], 
-                      y=[metrics['avg_adr_ly']]*len(analysis_df),
-                      mode='lines', line=dict(color=COLOR_PALETTE["secondary"], dash='dot')),
-            row=2, col=1
-        )
-        
-        fig.add_trace(
-            go.Bar(name='Revenue Perso', x=analysis_df['data'], 
-                  y=analysis_df['revenue_displaced'],
-                  marker_color=COLOR_PALETTE["negative"]),
-            row=3, col=1
-        )
-        
-        fig.add_trace(
-            go.Bar(name='Revenue Camere', x=analysis_df['data'], 
-                  y=analysis_df['revenue_camere_gruppo_effettivo'],
-                  marker_color=COLOR_PALETTE["secondary"]),
-            row=3, col=1
-        )
-        
-        fig.add_trace(
-            go.Bar(name='Revenue Ancillare', x=analysis_df['data'], 
-                  y=analysis_df['revenue_ancillare_gruppo'],
-                  marker_color=COLOR_PALETTE["primary"]),
-            row=3, col=1
-        )
-        
-        if events_df is not None and not events_df.empty:
-            for _, event in events_df.iterrows():
-                opacity = {"Alto": 0.3, "Medio": 0.2, "Basso": 0.1}.get(event["impatto"], 0.1)
-                color = {"Alto": "rgba(255, 87, 51, {})", "Medio": "rgba(255, 195, 0, {})", "Basso": "rgba(218, 247, 166, {})"}
-                event_color = color.get(event["impatto"], "rgba(200, 200, 200, {})").format(opacity)
-                
-                fig.add_vrect(
-                    x0=event["data_inizio"], 
-                    x1=event["data_fine"],
-                    fillcolor=event_color,
-                    layer="below",
-                    line_width=0,
-                    annotation_text=event["nome"],
-                    annotation_position="top left",
-                    row=1, col=1
-                )
-        
-        fig.update_layout(
-            title_text='Analisi Displacement Gruppo',
-            height=800,
-            barmode='stack',
-            font_family="Inter, sans-serif",
-            plot_bgcolor=COLOR_PALETTE["background"],
-            paper_bgcolor=COLOR_PALETTE["background"],
-            font_color=COLOR_PALETTE["text"]
-        )
-        
-        fig_summary = go.Figure()
-        
-        summary_data = [
-            metrics['revenue_displaced'],
-            metrics['group_room_revenue'],
-            metrics['group_ancillary'],
-            metrics['total_impact']
-        ]
-        
-        summary_labels = [
-            'Revenue Perso',
-            'Revenue Camere',
-            'Revenue Ancillare',
-            'Impatto Totale'
-        ]
-        
-        colors = [COLOR_PALETTE["negative"], COLOR_PALETTE["secondary"], COLOR_PALETTE["primary"], 
-                 COLOR_PALETTE["positive"] if metrics['total_impact'] >= 0 else COLOR_PALETTE["negative"]]
-        
-        fig_summary.add_trace(go.Bar(
-            x=summary_labels,
-            y=summary_data,
-            marker_color=colors,
-            name='Impatto Revenue'
-        ))
-        
-        fig_summary.update_layout(
-            title_text=f'Riepilogo Finanziario',
-            font_family="Inter, sans-serif",
-            plot_bgcolor=COLOR_PALETTE["background"],
-            paper_bgcolor=COLOR_PALETTE["background"],
-            font_color=COLOR_PALETTE["text"]
-        )
-        
-        return fig, fig_summary
-
 
 st.title("Hotel Group Displacement Analyzer v0.9.5r8")
 st.markdown("*Strumento di analisi richieste preventivo gruppi*")
 
 with st.sidebar:
     st.header("Configurazione Hotel")
+    hotel_code = st.text_input("Codice hotel", value=os.environ.get("DISPLACEMENT_HOTEL", "default"),
+                               help="Usato per lo storico snapshot OTB, condiviso con batch e servizio REST per lo stesso codice")
     hotel_capacity = st.number_input("Capacità hotel (camere)", min_value=1, value=66)
     iva_rate = st.number_input("Aliquota IVA (%)", min_value=0.0, max_value=30.0, value=10.0) / 100
     
+    snapshot_store = SnapshotStore(hotel=hotel_code.strip() or "default")
+    quote_store = QuoteStore(hotel=snapshot_store.hotel)
+    
     st.header("Eventi & Fiere")
     city = st.selectbox("Città", ["Venezia", "Roma", "Taormina", "Olbia", "Cervinia", "Matera", "Siracusa", "Firenze"])
     
@@ -1448,6 +752,12 @@ with st.sidebar:
     enable_booking_parser = st.toggle("Parsing automatico richieste booking", value=True,
                                    help="Estrae automaticamente dati dalle richieste dell'ufficio booking")
     
+    with st.expander("Diagnostica", expanded=False):
+        log_level = st.selectbox("Livello log", LOG_LEVELS, index=LOG_LEVELS.index(diagnostics.level), key="log_level")
+        diagnostics.set_level(log_level)
+        show_diagnostics = st.toggle("Mostra pannello diagnostica", value=False, key="show_diagnostics",
+                                     help="Mostra log, tempi di esecuzione e anteprime dati catturati in questa sessione")
+    
     st.header("Tipo di Analisi")
     enable_series = st.toggle("Serie di Gruppi", value=False, 
                            help="Attiva per analizzare gruppi che si ripetono nel tempo")
@@ -1466,8 +776,9 @@ if 'series_data' not in st.session_state and enable_series:
 if enable_series and not st.session_state.get('series_complete', False):
     st.header(f"Serie Gruppo - Passaggio {st.session_state['current_passage']} di {num_passages}")
 
-if 'events_data_cache' in st.session_state and city in st.session_state['events_data_cache']:
-    city_events_data = st.session_state['events_data_cache'][city]
+events_data = session_memory.load(st.session_state, 'events_data_cache') if 'events_data_cache' in st.session_state else {}
+if city in events_data:
+    city_events_data = events_data[city]
     events_df = pd.DataFrame(city_events_data)
     
     events_df["data_inizio"] = pd.to_datetime(events_df["data_inizio"])
@@ -1545,10 +856,22 @@ if data_source == "Import file Excel":
         uploaded_files = st.file_uploader("Carica i file Excel (IDV CY, IDV LY, GRP OTB, GRP OPZ)", 
                                          type=["xlsx", "xls"], accept_multiple_files=True)
         
+        snapshot_as_of = st.date_input(
+            "Data estrazione OTB (as-of)",
+            value=st.session_state.get('snapshot_as_of', datetime.now().date()),
+            key="snapshot_as_of",
+            format="DD/MM/YYYY",
+            help="Data a cui si riferiscono i file OTB: ogni import viene salvato nello storico snapshot con questa data"
+        )
+        
         if uploaded_files:
             if 'raw_excel_data' not in st.session_state:
-                with st.spinner("Analisi file in corso..."):
-                    idv_cy_data, idv_ly_data, grp_otb_data, grp_opz_data = process_excel_import(uploaded_files)
+                import_job = poll_import_job(uploaded_files)
+                diagnostics.record_timing("import file (background)", time.time() - import_job.started_at,
+                                          rows=len(import_job.file_names))
+                with st.spinner("Analisi file in corso..."), diagnostics.stage("process_excel_import") as import_stage:
+                    idv_cy_data, idv_ly_data, grp_otb_data, grp_opz_data = process_excel_import(import_job)
+                    import_stage['righe'] = sum(len(df) for df in [idv_cy_data, idv_ly_data, grp_otb_data, grp_opz_data] if df is not None)
                     
                     if idv_cy_data is not None and idv_ly_data is not None:
                         st.session_state['raw_excel_data'] = {
@@ -1557,6 +880,13 @@ if data_source == "Import file Excel":
                             'grp_otb': grp_otb_data,
                             'grp_opz': grp_opz_data
                         }
+                        st.session_state.pop('demand_grid', None)
+                        
+                        try:
+                            snapshot_store.save_import(snapshot_as_of, st.session_state['raw_excel_data'])
+                            st.info(f"Snapshot OTB salvato nello storico al {snapshot_as_of.strftime('%d/%m/%Y')}")
+                        except Exception as e:
+                            st.warning(f"Impossibile salvare lo snapshot OTB: {e}")
                         
                         available_dates = pd.date_range(
                             start=idv_cy_data['data'].min(),
@@ -1573,12 +903,25 @@ if data_source == "Import file Excel":
                 
                 if st.button("📊 Debug: Mostra i dati importati"):
                     st.write("IDV CY Data:")
-                    st.write(st.session_state['raw_excel_data']['idv_cy'].head())
+                    st.write(session_memory.load(st.session_state, 'raw_excel_data')['idv_cy'].head())
                     st.write("IDV LY Data:")
-                    st.write(st.session_state['raw_excel_data']['idv_ly'].head())
+                    st.write(session_memory.load(st.session_state, 'raw_excel_data')['idv_ly'].head())
                 
                 available_dates = st.session_state['available_dates']
                 
+                if st.toggle("Mostra calendario disponibilità", key="show_demand_heatmap",
+                             help="Camere libere e costo di displacement per camera extra su ogni data futura dell'import (fino a due anni)"):
+                    demand = get_demand_grid(session_memory.load(st.session_state, 'raw_excel_data'), available_dates, hotel_capacity)
+                    if demand['grid'] is None:
+                        st.info("Nessuna data futura nei file importati")
+                    else:
+                        if demand['figure'] is None:
+                            demand['figure'] = create_demand_heatmap(demand['grid'], hotel_capacity)
+                        st.plotly_chart(demand['figure'], use_container_width=True)
+                        full_days = int((demand['grid']['camere_disponibili'] <= 0).sum())
+                        st.caption(f"{full_days} date su {len(demand['grid'])} già piene: ogni camera di gruppo in più sposta individuale "
+                                   f"al costo indicato (ADR finale della data). Verde: camere libere, rosso: data piena.")
+                
                 col1, col2 = st.columns(2)
                 with col1:
                     start_date = st.date_input(
@@ -1600,27 +943,35 @@ if data_source == "Import file Excel":
                         format="DD/MM/YYYY"
                     )
                 
+                forecast_method = st.selectbox(
+                    "Metodo di Forecast",
+                    FORECAST_METHODS,
+                    index=FORECAST_METHODS.index(st.session_state.get('forecast_method', "LY - OTB")),
+                    key="import_forecast_method"
+                )
+                st.session_state['forecast_method'] = forecast_method
+                
                 if st.button("Carica dati per il periodo selezionato", type="primary"):
                     with st.spinner("Elaborazione dati in corso..."):
                         try:
                             start_datetime = pd.to_datetime(start_date)
                             end_datetime = pd.to_datetime(end_date)
                             
-                            st.write(f"Debug: Range date selezionato: {start_datetime} - {end_datetime}")
+                            diagnostics.debug(f"Range date selezionato: {start_datetime} - {end_datetime}", stage="elaborazione")
                             date_range = pd.date_range(start=start_datetime, end=end_datetime)
                             
-                            processed_data = process_imported_data(
-                                st.session_state['raw_excel_data']['idv_cy'],
-                                st.session_state['raw_excel_data']['idv_ly'],
-                                st.session_state['raw_excel_data']['grp_otb'],
-                                st.session_state['raw_excel_data']['grp_opz'],
-                                date_range
-                            )
+                            raw_excel_data = session_memory.load(st.session_state, 'raw_excel_data')
+                            with diagnostics.stage("process_imported_data") as processing_stage:
+                                processed_data = process_imported_data(
+                                    raw_excel_data['idv_cy'],
+                                    raw_excel_data['idv_ly'],
+                                    raw_excel_data['grp_otb'],
+                                    raw_excel_data['grp_opz'],
+                                    date_range
+                                )
+                                processing_stage['righe'] = len(processed_data) if processed_data is not None else 0
                             
                             if processed_data is not None:
-                                st.write("Debug: Dati elaborati:")
-                                st.write(processed_data.head())
-                                
                                 st.session_state['analyzed_data'] = processed_data
                                 st.session_state['selected_start_date'] = start_date
                                 st.session_state['selected_end_date'] = end_date
@@ -1642,19 +993,25 @@ if data_source == "Import file Excel":
                     del st.session_state['selected_start_date']
                 if 'selected_end_date' in st.session_state:
                     del st.session_state['selected_end_date']
+                if 'pickup_curve' in st.session_state:
+                    del st.session_state['pickup_curve']
+                if 'demand_grid' in st.session_state:
+                    del st.session_state['demand_grid']
+                if 'raw_excel_handles' in st.session_state:
+                    del st.session_state['raw_excel_handles']
                 st.rerun()
     
     if 'analyzed_data' in st.session_state:
-        analyzed_data = st.session_state['analyzed_data']
+        analyzed_data = session_memory.load(st.session_state, 'analyzed_data')
         start_date = st.session_state['selected_start_date']
         end_date = st.session_state['selected_end_date']
         
         st.subheader("Dati elaborati")
-        tab1, tab2, tab3 = st.tabs(["Room Nights", "ADR", "Revenue"])
+        tab1, tab2, tab3, tab4, tab5 = st.tabs(["Room Nights", "ADR", "Revenue", "Pace", "Opzioni"])
         
         with tab1:
             st.dataframe(
-                analyzed_data[['data', 'giorno', 'otb_ind_rn', 'ly_ind_rn', 'fcst_ind_rn', 'grp_otb_rn', 'grp_opz_rn', 'finale_rn']],
+                arrow_table(analyzed_data, ['data', 'giorno', 'otb_ind_rn', 'ly_ind_rn', 'fcst_ind_rn', 'grp_otb_rn', 'grp_opz_rn', 'finale_rn']),
                 column_config={
                     "data": st.column_config.DateColumn("Data", format="DD/MM/YYYY"),
                     "giorno": "Giorno",
@@ -1670,7 +1027,7 @@ if data_source == "Import file Excel":
         
         with tab2:
             st.dataframe(
-                analyzed_data[['data', 'giorno', 'otb_ind_adr', 'ly_ind_adr', 'fcst_ind_adr', 'grp_otb_adr', 'grp_opz_adr', 'finale_adr']],
+                arrow_table(analyzed_data, ['data', 'giorno', 'otb_ind_adr', 'ly_ind_adr', 'fcst_ind_adr', 'grp_otb_adr', 'grp_opz_adr', 'finale_adr']),
                 column_config={
                     "data": st.column_config.DateColumn("Data", format="DD/MM/YYYY"),
                     "giorno": "Giorno",
@@ -1686,7 +1043,7 @@ if data_source == "Import file Excel":
         
         with tab3:
             st.dataframe(
-                analyzed_data[['data', 'giorno', 'otb_ind_rev', 'ly_ind_rev', 'fcst_ind_rev', 'grp_otb_rev', 'grp_opz_rev', 'finale_rev']],
+                arrow_table(analyzed_data, ['data', 'giorno', 'otb_ind_rev', 'ly_ind_rev', 'fcst_ind_rev', 'grp_otb_rev', 'grp_opz_rev', 'finale_rev']),
                 column_config={
                     "data": st.column_config.DateColumn("Data", format="DD/MM/YYYY"),
                     "giorno": "Giorno",
@@ -1699,6 +1056,64 @@ if data_source == "Import file Excel":
                 },
                 use_container_width=True
             )
+        
+        with tab4:
+            if len(snapshot_store.as_of_dates()) > 1:
+                pace_df = snapshot_store.pace(analyzed_data['data'])
+                st.dataframe(
+                    pace_df,
+                    column_config={
+                        "data": st.column_config.DateColumn("Data", format="DD/MM/YYYY"),
+                        "otb_0": st.column_config.NumberColumn("OTB arrivo", format="%d"),
+                        "otb_7": st.column_config.NumberColumn("OTB -7gg", format="%d"),
+                        "otb_14": st.column_config.NumberColumn("OTB -14gg", format="%d"),
+                        "otb_30": st.column_config.NumberColumn("OTB -30gg", format="%d")
+                    },
+                    use_container_width=True
+                )
+            else:
+                st.info("Il pace sarà disponibile dopo aver importato file OTB con almeno due date di estrazione diverse")
+        
+        with tab5:
+            with diagnostics.stage("revisione opzioni") as review_stage:
+                options_review = review_options(analyzed_data, hotel_capacity)
+                review_stage['righe'] = len(options_review)
+            
+            if options_review.empty:
+                st.info("Nessun gruppo opzionato (GRP OPZ) nel periodo selezionato")
+            else:
+                to_release = int(options_review['rilascio_consigliato'].sum())
+                if to_release > 0:
+                    st.warning(f"{to_release} opzioni su {len(options_review)} occupano date di maggior valore per l'individuale: valutarne il rilascio")
+                else:
+                    st.success(f"Tutte le {len(options_review)} opzioni hanno un impatto positivo rispetto all'OTB attuale")
+                st.dataframe(
+                    options_review.drop(columns=['blocco']),
+                    column_config={
+                        "start_date": st.column_config.DateColumn("Arrivo", format="DD/MM/YYYY"),
+                        "end_date": st.column_config.DateColumn("Partenza", format="DD/MM/YYYY"),
+                        "notti": st.column_config.NumberColumn("Notti", format="%d"),
+                        "camere": st.column_config.NumberColumn("Room nights", format="%d"),
+                        "adr_opzione": st.column_config.NumberColumn("ADR opzione", format="€%.2f"),
+                        "revenue_opzione": st.column_config.NumberColumn("Revenue opzione", format="€%.2f"),
+                        "camere_displaced": st.column_config.NumberColumn("Camere displaced", format="%d"),
+                        "revenue_displaced": st.column_config.NumberColumn("Revenue displaced", format="€%.2f"),
+                        "impatto": st.column_config.NumberColumn("Impatto", format="€%.2f"),
+                        "notti_alto_valore": st.column_config.NumberColumn("Notti alto valore", format="%d"),
+                        "date_alto_valore": st.column_config.TextColumn("Date alto valore"),
+                        "rilascio_consigliato": st.column_config.CheckboxColumn("Rilascio consigliato")
+                    },
+                    use_container_width=True
+                )
+                st.caption("Ogni blocco di giorni consecutivi con camere opzionate è valutato contro l'OTB e il forecast attuali. "
+                           "L'export GRP OPZ è un totale giornaliero: opzioni diverse sulle stesse date risultano in un unico blocco. "
+                           "Date alto valore: notti in cui l'opzione sposta individuale con ADR superiore a quello dell'opzione.")
+        
+        if st.session_state.get('forecast_method') == "Curva pickup" and 'pickup_curve' in st.session_state:
+            pickup_curve = st.session_state['pickup_curve']
+            with st.expander("Curva di pickup (rapporto finale/OTB per giorni all'arrivo)", expanded=False):
+                st.dataframe(pickup_curve.to_frame().style.format("{:.2f}"), use_container_width=True)
+                st.caption(f"Osservazioni: {pickup_curve.observations} | Fattore festivi: {pickup_curve.holiday_factor:.2f}")
     
     with st.expander("Mappatura campi (avanzato)", expanded=False):
         st.warning("Queste impostazioni sono utilizzate solo se il riconoscimento automatico fallisce")
@@ -1736,28 +1151,16 @@ elif data_source == "Inserimento manuale":
         if 'wizard_step' not in st.session_state and enable_wizard:
             st.session_state['wizard_step'] = 1
         
-        if 'forecast_method' not in st.session_state:
-            st.session_state['forecast_method'] = "LY - OTB"
-            st.session_state['pickup_factor'] = 1.0
-            st.session_state['pickup_percentage'] = 20
-            st.session_state['pickup_value'] = 10
-        
-        base_data = {
-            'data': date_range,
-            'giorno': [d.strftime('%a') for d in date_range],
-            'data_ly': [same_day_last_year(d) for d in date_range],
-            'giorno_ly': [same_day_last_year(d).strftime('%a') for d in date_range],
-            'otb_ind_rn': [0] * len(date_range),
-            'ly_ind_rn': [0] * len(date_range),
-            'grp_otb_rn': [0] * len(date_range),
-            'grp_opz_rn': [0] * len(date_range),
-            'otb_ind_adr': [0.0] * len(date_range),
-            'ly_ind_adr': [0.0] * len(date_range),
-            'grp_otb_adr': [0.0] * len(date_range),
-            'grp_opz_adr': [0.0] * len(date_range)
-        }
-    
-        df_base = pd.DataFrame(base_data)
+        # Chiavi inizializzate singolarmente: forecast_method può essere già stato impostato dalla modalità import
+        st.session_state.setdefault('forecast_method', "LY - OTB")
+        st.session_state.setdefault('pickup_factor', 1.0)
+        st.session_state.setdefault('pickup_percentage', 20)
+        st.session_state.setdefault('pickup_value', 10)
+        
+        # Frame di inserimento persistente: ricostruito solo quando cambia il periodo di analisi
+        if 'manual_inputs' not in st.session_state or not st.session_state['manual_inputs'].matches(date_range):
+            st.session_state['manual_inputs'] = ManualInputs(date_range)
+        manual_inputs = st.session_state['manual_inputs']
         
         if enable_wizard:
             wizard_steps = [
@@ -1792,8 +1195,8 @@ elif data_source == "Inserimento manuale":
             
             if enable_wizard:
                 st.markdown("👇 **Compila i valori Room Nights correnti**")
-            edited_rn_cy = st.data_editor(
-                df_base[['data', 'giorno', 'otb_ind_rn', 'grp_otb_rn', 'grp_opz_rn']],
+            st.data_editor(
+                manual_inputs.views['rn_cy'],
                 hide_index=True,
                 key="rn_cy",
                 column_config={
@@ -1813,8 +1216,8 @@ elif data_source == "Inserimento manuale":
                     if st.button("Avanti →", key="next1", type="primary", use_container_width=True):
                         next_step()
         else:
-            edited_rn_cy = st.data_editor(
-                df_base[['data', 'giorno', 'otb_ind_rn', 'grp_otb_rn', 'grp_opz_rn']],
+            st.data_editor(
+                manual_inputs.views['rn_cy'],
                 hide_index=True,
                 key="rn_cy",
                 disabled=True,
@@ -1831,8 +1234,8 @@ elif data_source == "Inserimento manuale":
             
             if enable_wizard:
                 st.markdown("👇 **Compila i valori ADR correnti**")
-            edited_adr_cy = st.data_editor(
-                df_base[['data', 'giorno', 'otb_ind_adr', 'grp_otb_adr', 'grp_opz_adr']],
+            st.data_editor(
+                manual_inputs.views['adr_cy'],
                 hide_index=True,
                 key="adr_cy",
                 column_config={
@@ -1855,8 +1258,8 @@ elif data_source == "Inserimento manuale":
                     if st.button("Avanti →", key="next2", type="primary", use_container_width=True):
                         next_step()
         else:
-            edited_adr_cy = st.data_editor(
-                df_base[['data', 'giorno', 'otb_ind_adr', 'grp_otb_adr', 'grp_opz_adr']],
+            st.data_editor(
+                manual_inputs.views['adr_cy'],
                 hide_index=True,
                 key="adr_cy",
                 disabled=True,
@@ -1873,8 +1276,8 @@ elif data_source == "Inserimento manuale":
             
             if enable_wizard:
                 st.markdown("👇 **Compila i valori Room Nights anno precedente**")
-            edited_rn_ly = st.data_editor(
-                df_base[['data_ly', 'giorno_ly', 'ly_ind_rn']],
+            st.data_editor(
+                manual_inputs.views['rn_ly'],
                 hide_index=True,
                 key="rn_ly",
                 column_config={
@@ -1895,8 +1298,8 @@ elif data_source == "Inserimento manuale":
                     if st.button("Avanti →", key="next3", type="primary", use_container_width=True):
                         next_step()
         else:
-            edited_rn_ly = st.data_editor(
-                df_base[['data_ly', 'giorno_ly', 'ly_ind_rn']],
+            st.data_editor(
+                manual_inputs.views['rn_ly'],
                 hide_index=True,
                 key="rn_ly",
                 disabled=True,
@@ -1913,8 +1316,8 @@ elif data_source == "Inserimento manuale":
             
             if enable_wizard:
                 st.markdown("👇 **Compila i valori ADR anno precedente**")
-            edited_adr_ly = st.data_editor(
-                df_base[['data_ly', 'giorno_ly', 'ly_ind_adr']],
+            st.data_editor(
+                manual_inputs.views['adr_ly'],
                 hide_index=True,
                 key="adr_ly",
                 column_config={
@@ -1935,8 +1338,8 @@ elif data_source == "Inserimento manuale":
                     if st.button("Avanti →", key="next4", type="primary", use_container_width=True):
                         next_step()
         else:
-            edited_adr_ly = st.data_editor(
-                df_base[['data_ly', 'giorno_ly', 'ly_ind_adr']],
+            st.data_editor(
+                manual_inputs.views['adr_ly'],
                 hide_index=True,
                 key="adr_ly",
                 disabled=True,
@@ -1955,8 +1358,8 @@ elif data_source == "Inserimento manuale":
                 
                 with col1:
                     forecast_method = st.selectbox("Metodo di Forecast", 
-                                                 ["LY - OTB", "Basato su LY", "Percentuale su OTB", "Valore assoluto"],
-                                                 index=["LY - OTB", "Basato su LY", "Percentuale su OTB", "Valore assoluto"].index(st.session_state['forecast_method']))
+                                                 FORECAST_METHODS,
+                                                 index=FORECAST_METHODS.index(st.session_state['forecast_method']))
                     st.session_state['forecast_method'] = forecast_method
                 
                 with col2:
@@ -1972,6 +1375,8 @@ elif data_source == "Inserimento manuale":
                         pickup_value = st.number_input("Camere da aggiungere", 0, 100, st.session_state['pickup_value'],
                                                     help="Aggiunge questo numero di camere all'OTB attuale")
                         st.session_state['pickup_value'] = pickup_value
+                    elif forecast_method == "Curva pickup":
+                        st.info("Il forecast applica rapporti di pickup per giorno della settimana e giorni all'arrivo, con correzione per i festivi")
                     else:  # LY - OTB
                         st.info("Il forecast è calcolato come LY IND - OTB IND (pickup rimanente dall'anno precedente)")
             
@@ -1987,40 +1392,15 @@ elif data_source == "Inserimento manuale":
             st.success("✅ Configurazione completata! Procedi con l'analisi dei dati.")
        
         try:
-            final_data = edited_rn_cy.copy()
-            final_data = pd.merge(final_data, edited_rn_ly[['data_ly', 'ly_ind_rn']], 
-                               left_index=True, right_index=True)
-           
-            final_data = pd.merge(final_data, edited_adr_cy[['otb_ind_adr', 'grp_otb_adr', 'grp_opz_adr']], 
-                               left_index=True, right_index=True)
-            final_data = pd.merge(final_data, edited_adr_ly[['ly_ind_adr']], 
-                               left_index=True, right_index=True)
-            
-            if st.session_state['forecast_method'] == "Basato su LY":
-                final_data['fcst_ind_rn'] = np.ceil(final_data['ly_ind_rn'] * st.session_state['pickup_factor'])
-            elif st.session_state['forecast_method'] == "Percentuale su OTB":
-                final_data['fcst_ind_rn'] = np.ceil(final_data['otb_ind_rn'] * (1 + st.session_state['pickup_percentage']/100))
-            elif st.session_state['forecast_method'] == "Valore assoluto":
-                final_data['fcst_ind_rn'] = final_data['otb_ind_rn'] + st.session_state['pickup_value']
-            else:  # LY - OTB (default)
-                final_data['fcst_ind_rn'] = final_data['ly_ind_rn'] - final_data['otb_ind_rn']
-                final_data['fcst_ind_rn'] = final_data['fcst_ind_rn'].apply(lambda x: max(0, x))
-           
-            final_data['fcst_ind_adr'] = final_data['otb_ind_adr']
-           
-            final_data['otb_ind_rev'] = final_data['otb_ind_rn'] * final_data['otb_ind_adr']
-            final_data['ly_ind_rev'] = final_data['ly_ind_rn'] * final_data['ly_ind_adr']
-            final_data['grp_otb_rev'] = final_data['grp_otb_rn'] * final_data['grp_otb_adr']
-            final_data['grp_opz_rev'] = final_data['grp_opz_rn'] * final_data['grp_opz_adr']
-            final_data['fcst_ind_rev'] = final_data['fcst_ind_rn'] * final_data['fcst_ind_adr']
-           
-            final_data['finale_rn'] = final_data['fcst_ind_rn'] + final_data['otb_ind_rn'] + final_data['grp_otb_rn']
-            final_data['finale_opz_rn'] = final_data['finale_rn'] + final_data['grp_opz_rn']
-           
-            final_data['finale_rev'] = final_data['otb_ind_rev'] + final_data['fcst_ind_rev'] + final_data['grp_otb_rev']
-            final_data['finale_adr'] = np.where(final_data['finale_rn'] > 0,
-                                            final_data['finale_rev'] / final_data['finale_rn'],
-                                            0)
+            final_data = manual_inputs.update(
+                {key: st.session_state.get(key) for key in ['rn_cy', 'adr_cy', 'rn_ly', 'adr_ly']},
+                {
+                    'forecast_method': st.session_state['forecast_method'],
+                    'pickup_factor': st.session_state['pickup_factor'],
+                    'pickup_percentage': st.session_state['pickup_percentage'],
+                    'pickup_value': st.session_state['pickup_value']
+                }
+            )
            
             if not enable_wizard or st.session_state.get('wizard_step') == 6:
                 st.subheader("Forecast Calcolato")
@@ -2403,297 +1783,97 @@ else:
             confirm = st.button("Conferma Analisi", type="primary", use_container_width=True)
             if confirm:
                 st.session_state['analysis_phase'] = 'analysis'
+                st.session_state['quote_pending'] = True
                 st.rerun()
     
     elif st.session_state['analysis_phase'] == 'analysis':
         with st.spinner("Elaborazione in corso..."):
-            analyzer = ExcelCompatibleDisplacementAnalyzer(hotel_capacity=hotel_capacity, iva_rate=iva_rate)
-            
-            analyzer.set_data(analyzed_data)
-            
-            decision_parameters = {
-                'min_adr_perc_cy': 100,
-                'min_adr_perc_ly': 100,
-                'ancillary_weight': 1.0,
-                'occ_threshold_low': 30,
-                'occ_threshold_high': 80,
-                'adr_flexibility_low': 0.3,
-                'adr_flexibility_high': 0.1,
+            group_request = {
+                'room_config': room_config_option,
+                'start_date': group_arrival,
+                'end_date': group_departure,
+                'num_rooms': num_rooms,
+                'adr_lordo': adr_lordo,
+                'fb_revenue': fb_revenue,
+                'meeting_revenue': meeting_revenue,
+                'other_revenue': other_revenue
             }
-       
-            analyzer.set_decision_parameters(decision_parameters)
-       
-            if room_config_option == "Contingente fisso ROH":
-                analyzer.set_group_request(
-                    start_date=group_arrival,
-                    end_date=group_departure,
-                    num_rooms=num_rooms,
-                    adr_lordo=adr_lordo,
-                    adr_netto=adr_netto,
-                    fb_revenue=fb_revenue,
-                    meeting_revenue=meeting_revenue,
-                    other_revenue=other_revenue
-                )
-            elif room_config_option == "Camere variabili per giorno":
-                analyzer.set_group_request_variable(
-                    start_date=group_arrival,
-                    end_date=group_departure,
-                    rooms_data=edited_rooms[['data', 'camere']],
-                    adr_lordo=adr_lordo,
-                    adr_netto=adr_netto,
-                    fb_revenue=fb_revenue,
-                    meeting_revenue=meeting_revenue,
-                    other_revenue=other_revenue
-                )
+            
+            if room_config_option == "Camere variabili per giorno":
+                group_request['rooms_data'] = edited_rooms[['data', 'camere']]
             elif room_config_option == "Tipologie multiple":
                 room_types_list = edited_types.to_dict('records') if isinstance(edited_types, pd.DataFrame) else room_types
-                
-                analyzer.set_group_request_with_types(
-                    start_date=group_arrival,
-                    end_date=group_departure,
-                    room_types=room_types_list,
-                    adr_lordo=adr_lordo,
-                    adr_netto=adr_netto,
-                    fb_revenue=fb_revenue,
-                    meeting_revenue=meeting_revenue,
-                    other_revenue=other_revenue
-                )
+                group_request['room_types'] = room_types_list
+            
+            decision_parameters = dict(DEFAULT_DECISION_PARAMETERS)
+            
+            analysis_graph.input('data', analyzed_data)
+            analysis_graph.input('request', group_request)
+            analysis_graph.input('hotel_capacity', hotel_capacity)
+            analysis_graph.input('iva_rate', iva_rate)
+            analysis_graph.input('adr_netto', adr_netto)
+            analysis_graph.input('dates', dates_for_analysis)
+            analysis_graph.input('events', overlapping_events)
+            analysis_graph.input('decision_params', decision_parameters)
        
-            result_df = analyzer.analyze()
-           
-            if dates_for_analysis and len(dates_for_analysis) < len(date_options):
-               result_df = result_df[result_df['data'].isin(dates_for_analysis)]
-    
-            metrics = analyzer.get_summary_metrics(result_df)
-            
-            if not overlapping_events.empty:
-                detail_fig, summary_fig = analyzer.create_visualizations(result_df, metrics, overlapping_events)
-            else:
-                detail_fig, summary_fig = analyzer.create_visualizations(result_df, metrics)
+            with diagnostics.stage("analyze", rows=len(analyzed_data)):
+                result_df = analysis_graph.get('result')
+                metrics = analysis_graph.get('metrics')
+            
+            # Ogni analisi confermata resta nello storico preventivi, una sola volta anche se la pagina viene rieseguita
+            if st.session_state.pop('quote_pending', False):
+                with diagnostics.stage("salvataggio preventivo", rows=len(result_df)):
+                    st.session_state['quote_id'] = quote_store.save_quote(
+                        group_name,
+                        group_request,
+                        metrics,
+                        result_df,
+                        {
+                            'hotel_capacity': hotel_capacity,
+                            'iva_rate': iva_rate,
+                            'fonte_dati': data_source,
+                            'forecast_method': st.session_state.get('forecast_method', "LY - OTB"),
+                            'pickup_factor': st.session_state.get('pickup_factor', 1.0),
+                            'pickup_percentage': st.session_state.get('pickup_percentage', 20),
+                            'pickup_value': st.session_state.get('pickup_value', 10),
+                            'dates': dates_for_analysis,
+                            'events': len(overlapping_events)
+                        },
+                        username=st.session_state['username']
+                    )
             
             if st.session_state.get('enable_extended_reasoning', False):
-                adr_variations = [-10, -5, 0, 5, 10]
-                scenario_results = []
-                
-                current_year = datetime.now().year
-                is_future_year = group_arrival.year > current_year
-                
-                avg_adr_cy_ly = (metrics['avg_adr_cy'] + metrics['avg_adr_ly']) / 2
-                avg_adr_label = "Media CY/LY"
-                
-                avg_occ = metrics['avg_occ_current']
-                if avg_occ < 60:
-                    future_increment = 0.03
-                elif avg_occ < 80:
-                    future_increment = 0.05
-                else:
-                    future_increment = 0.07
-                
-                future_adr = metrics['avg_adr_cy'] * (1 + future_increment)
-                future_adr_label = f"+{future_increment*100:.0f}% (Anno Successivo)"
-                
-                for variation in adr_variations:
-                    new_adr = adr_lordo * (1 + variation/100)
-                    new_adr_netto = new_adr / (1 + iva_rate)
-                    
-                    analyzer_scenario = ExcelCompatibleDisplacementAnalyzer(hotel_capacity=hotel_capacity, iva_rate=iva_rate)
-                    analyzer_scenario.set_data(analyzed_data)
-                    analyzer_scenario.set_decision_parameters(decision_parameters)
-                    
-                    if room_config_option == "Contingente fisso ROH":
-                        analyzer_scenario.set_group_request(
-                            start_date=group_arrival,
-                            end_date=group_departure,
-                            num_rooms=num_rooms,
-                            adr_lordo=new_adr,
-                            fb_revenue=fb_revenue,
-                            meeting_revenue=meeting_revenue,
-                            other_revenue=other_revenue
-                        )
-                    elif room_config_option == "Camere variabili per giorno":
-                        analyzer_scenario.set_group_request_variable(
-                            start_date=group_arrival,
-                            end_date=group_departure,
-                            rooms_data=edited_rooms[['data', 'camere']],
-                            adr_lordo=new_adr,
-                            fb_revenue=fb_revenue,
-                            meeting_revenue=meeting_revenue,
-                            other_revenue=other_revenue
-                        )
-                    elif room_config_option == "Tipologie multiple":
-                        scaled_room_types = []
-                        for rt in room_types_list:
-                            scaled_rt = rt.copy()
-                            scaled_rt['adr_addon'] = rt['adr_addon'] * (1 + variation/100)
-                            scaled_room_types.append(scaled_rt)
-                            
-                        analyzer_scenario.set_group_request_with_types(
-                            start_date=group_arrival,
-                            end_date=group_departure,
-                            room_types=scaled_room_types,
-                            adr_lordo=new_adr,
-                            fb_revenue=fb_revenue,
-                            meeting_revenue=meeting_revenue,
-                            other_revenue=other_revenue
-                        )
-                    
-                    result_scenario = analyzer_scenario.analyze()
-                    if dates_for_analysis and len(dates_for_analysis) < len(date_options):
-                        result_scenario = result_scenario[result_scenario['data'].isin(dates_for_analysis)]
-                    
-                    metrics_scenario = analyzer_scenario.get_summary_metrics(result_scenario)
-                    
-                    scenario_results.append({
-                        "variation": variation,
-                        "variation_label": f"{variation:+d}%",
-                        "adr_lordo": new_adr,
-                        "adr_netto": new_adr_netto,
-                        "total_impact": metrics_scenario['total_impact'],
-                        "room_profit": metrics_scenario['room_profit'],
-                        "total_rev_profit": metrics_scenario['total_rev_profit'],
-                        "displaced_rooms": metrics_scenario['displaced_rooms'],
-                        "should_accept": metrics_scenario['should_accept'],
-                        "total_lordo": metrics_scenario['total_lordo']
-                    })
-                
-                if not is_future_year:
-                    variation_perc = ((avg_adr_cy_ly / adr_netto) - 1) * 100
-                    
-                    analyzer_scenario = ExcelCompatibleDisplacementAnalyzer(hotel_capacity=hotel_capacity, iva_rate=iva_rate)
-                    analyzer_scenario.set_data(analyzed_data)
-                    analyzer_scenario.set_decision_parameters(decision_parameters)
-                    
-                    if room_config_option == "Contingente fisso ROH":
-                        analyzer_scenario.set_group_request(
-                            start_date=group_arrival,
-                            end_date=group_departure,
-                            num_rooms=num_rooms,
-                            adr_lordo=avg_adr_cy_ly * (1 + iva_rate),
-                            fb_revenue=fb_revenue,
-                            meeting_revenue=meeting_revenue,
-                            other_revenue=other_revenue
-                        )
-                    elif room_config_option == "Camere variabili per giorno":
-                        analyzer_scenario.set_group_request_variable(
-                            start_date=group_arrival,
-                            end_date=group_departure,
-                            rooms_data=edited_rooms[['data', 'camere']],
-                            adr_lordo=avg_adr_cy_ly * (1 + iva_rate),
-                            fb_revenue=fb_revenue,
-                            meeting_revenue=meeting_revenue,
-                            other_revenue=other_revenue
-                        )
-                    elif room_config_option == "Tipologie multiple":
-                        factor = avg_adr_cy_ly / adr_netto
-                        scaled_room_types = []
-                        for rt in room_types_list:
-                            scaled_rt = rt.copy()
-                            scaled_rt['adr_addon'] = rt['adr_addon'] * factor
-                            scaled_room_types.append(scaled_rt)
-                            
-                        analyzer_scenario.set_group_request_with_types(
-                            start_date=group_arrival,
-                            end_date=group_departure,
-                            room_types=scaled_room_types,
-                            adr_lordo=avg_adr_cy_ly * (1 + iva_rate),
-                            fb_revenue=fb_revenue,
-                            meeting_revenue=meeting_revenue,
-                            other_revenue=other_revenue
-                        )
-                    
-                    result_scenario = analyzer_scenario.analyze()
-                    if dates_for_analysis and len(dates_for_analysis) < len(date_options):
-                        result_scenario = result_scenario[result_scenario['data'].isin(dates_for_analysis)]
-                    
-                    metrics_scenario = analyzer_scenario.get_summary_metrics(result_scenario)
-                    
-                    scenario_results.append({
-                        "variation": variation_perc,
-                        "variation_label": avg_adr_label,
-                        "adr_lordo": avg_adr_cy_ly * (1 + iva_rate),
-                        "adr_netto": avg_adr_cy_ly,
-                        "total_impact": metrics_scenario['total_impact'],
-                        "room_profit": metrics_scenario['room_profit'],
-                        "total_rev_profit": metrics_scenario['total_rev_profit'],
-                        "displaced_rooms": metrics_scenario['displaced_rooms'],
-                        "should_accept": metrics_scenario['should_accept'],
-                        "total_lordo": metrics_scenario['total_lordo']
-                    })
-                
-                if is_future_year:
-                    variation_perc = ((future_adr / adr_netto) - 1) * 100
-                    
-                    analyzer_scenario = ExcelCompatibleDisplacementAnalyzer(hotel_capacity=hotel_capacity, iva_rate=iva_rate)
-                    analyzer_scenario.set_data(analyzed_data)
-                    analyzer_scenario.set_decision_parameters(decision_parameters)
-                    
-                    if room_config_option == "Contingente fisso ROH":
-                        analyzer_scenario.set_group_request(
-                            start_date=group_arrival,
-                            end_date=group_departure,
-                            num_rooms=num_rooms,
-                            adr_lordo=future_adr * (1 + iva_rate),
-                            fb_revenue=fb_revenue,
-                            meeting_revenue=meeting_revenue,
-                            other_revenue=other_revenue
-                        )
-                    elif room_config_option == "Camere variabili per giorno":
-                        analyzer_scenario.set_group_request_variable(
-                            start_date=group_arrival,
-                            end_date=group_departure,
-                            rooms_data=edited_rooms[['data', 'camere']],
-                            adr_lordo=future_adr * (1 + iva_rate),
-                            fb_revenue=fb_revenue,
-                            meeting_revenue=meeting_revenue,
-                            other_revenue=other_revenue
-                        )
-                    elif room_config_option == "Tipologie multiple":
-                        factor = future_adr / adr_netto
-                        scaled_room_types = []
-                        for rt in room_types_list:
-                            scaled_rt = rt.copy()
-                            scaled_rt['adr_addon'] = rt['adr_addon'] * factor
-                            scaled_room_types.append(scaled_rt)
-                            
-                        analyzer_scenario.set_group_request_with_types(
-                            start_date=group_arrival,
-                            end_date=group_departure,
-                            room_types=scaled_room_types,
-                            adr_lordo=future_adr * (1 + iva_rate),
-                            fb_revenue=fb_revenue,
-                            meeting_revenue=meeting_revenue,
-                            other_revenue=other_revenue
-                        )
-                    
-                    result_scenario = analyzer_scenario.analyze()
-                    if dates_for_analysis and len(dates_for_analysis) < len(date_options):
-                        result_scenario = result_scenario[result_scenario['data'].isin(dates_for_analysis)]
-                    
-                    metrics_scenario = analyzer_scenario.get_summary_metrics(result_scenario)
-                    
-                    scenario_results.append({
-                        "variation": variation_perc,
-                        "variation_label": future_adr_label,
-                        "adr_lordo": future_adr * (1 + iva_rate),
-                        "adr_netto": future_adr,
-                        "total_impact": metrics_scenario['total_impact'],
-                        "room_profit": metrics_scenario['room_profit'],
-                        "total_rev_profit": metrics_scenario['total_rev_profit'],
-                        "displaced_rooms": metrics_scenario['displaced_rooms'],
-                        "should_accept": metrics_scenario['should_accept'],
-                        "total_lordo": metrics_scenario['total_lordo']
-                    })
+                with diagnostics.stage("scenari ADR") as scenarios_stage:
+                    scenario_results = analysis_graph.get('scenarios')
+                    scenarios_stage['righe'] = len(scenario_results)
                 
                 scenarios_df = pd.DataFrame(scenario_results)
                 
                 optimal_scenario = max(scenario_results, key=lambda x: x['total_rev_profit'])
                 
+                # Con abbastanza esiti registrati l'ADR suggerita massimizza il profitto atteso (profitto x probabilità di vincere)
+                acceptance_curve = get_acceptance_curve()
+                if acceptance_curve is not None and metrics['avg_adr_ly'] > 0:
+                    scenarios_df['probabilita_accettazione'] = acceptance_curve.probability(scenarios_df['adr_netto'] / metrics['avg_adr_ly'])
+                    scenarios_df['profitto_atteso'] = scenarios_df['probabilita_accettazione'] * scenarios_df['total_rev_profit']
+                    best = int(scenarios_df['profitto_atteso'].idxmax())
+                    optimal_scenario = dict(scenario_results[best],
+                                            probabilita_accettazione=scenarios_df.at[best, 'probabilita_accettazione'],
+                                            profitto_atteso=scenarios_df.at[best, 'profitto_atteso'])
+                
                 extended_analysis_results = {
                     'scenarios_df': scenarios_df,
-                    'optimal_scenario': optimal_scenario
+                    'optimal_scenario': optimal_scenario,
+                    'acceptance_curve': acceptance_curve
                 }
                 
+                with diagnostics.stage("simulazione Monte Carlo", rows=DEFAULT_SIMULATIONS * len(result_df)):
+                    simulation_as_of = pd.Timestamp(st.session_state.get('snapshot_as_of', datetime.now())).normalize()
+                    sigma = pickup_sigma(get_pickup_history(analyzed_data, simulation_as_of))
+                    extended_analysis_results['simulation'] = simulate_impact(result_df, hotel_capacity, sigma, simulation_as_of)
+                
                 if data_source == "Import file Excel" and 'raw_excel_data' in st.session_state:
+                    result_df = result_df.copy()
                     result_df['criticità'] = pd.cut(
                         result_df['camere_displaced'],
                         bins=[-1, 0, 5, 10, float('inf')],
@@ -2701,6 +1881,19 @@ else:
                     )
                     
                     extended_analysis_results['critical_days'] = result_df[['data', 'giorno', 'finale_rn', 'camere_gruppo', 'camere_displaced', 'criticità']]
+                    
+                    # Le date alternative scorrono la richiesta su tutto l'orizzonte importato, non solo sul periodo di analisi
+                    demand = get_demand_grid(session_memory.load(st.session_state, 'raw_excel_data'),
+                                             st.session_state['available_dates'], hotel_capacity)
+                    if demand['grid'] is not None:
+                        with diagnostics.stage("date alternative", rows=len(demand['grid'])):
+                            alternatives = alternative_dates(demand['grid'], analysis_graph.get('group'), hotel_capacity,
+                                                             requested_arrival=group_arrival)
+                        extended_analysis_results['alternative_dates'] = alternatives
+                        
+                        with diagnostics.stage("varianti shoulder days"):
+                            variants = shoulder_variants(demand['grid'], analysis_graph.get('group'), hotel_capacity)
+                        extended_analysis_results['shoulder_variants'] = variants
            
         st.subheader("Riepilogo Decisione")
            
@@ -2713,12 +1906,50 @@ else:
             st.metric("REV DSPL", f"€{metrics['revenue_displaced']:,.2f}")
         with col4:
             st.metric("DIFF", f"€{metrics['total_impact']:,.2f}")
+        st.caption(f"ADR minimo per un impatto non negativo sull'intero soggiorno: €{metrics['floor_adr_lordo']:,.2f} lordo "
+                   f"(€{metrics['floor_adr_netto']:,.2f} netto, media per room night)")
+        
+        # Controproposta: blocco ridotto notte per notte al punto di pareggio con l'ADR spostato
+        with diagnostics.stage("blocco ottimale", rows=len(result_df)):
+            counter_offer = analysis_graph.get('counter_offer')
+            counter_metrics = analysis_graph.get('counter_metrics')
+        if counter_metrics['accepted_rooms'] < metrics['accepted_rooms']:
+            st.info(f"💡 Controproposta: accettando {counter_metrics['accepted_rooms']:,.0f} room nights su {metrics['accepted_rooms']:,.0f} "
+                    f"l'impatto sarebbe di €{counter_metrics['total_impact']:,.2f} "
+                    f"(€{counter_metrics['total_impact'] - metrics['total_impact']:+,.2f} rispetto al blocco intero)")
+            with st.expander("Blocco ottimale per notte"):
+                reduced = counter_offer[counter_offer['camere_gruppo_accettate'] < counter_offer['camere_gruppo']]
+                st.dataframe(
+                    reduced[['data', 'giorno', 'camere_gruppo', 'camere_gruppo_accettate', 'camere_disponibili',
+                             'adr_gruppo_netto', 'finale_adr', 'impatto_revenue_totale']],
+                    column_config={
+                        "data": st.column_config.DateColumn("Data", format="DD/MM/YYYY"),
+                        "giorno": "Giorno",
+                        "camere_gruppo": st.column_config.NumberColumn("Richieste", format="%d"),
+                        "camere_gruppo_accettate": st.column_config.NumberColumn("Massimo conveniente", format="%d"),
+                        "camere_disponibili": st.column_config.NumberColumn("Disponibili", format="%d"),
+                        "adr_gruppo_netto": st.column_config.NumberColumn("ADR Netto", format="€%.2f"),
+                        "finale_adr": st.column_config.NumberColumn("ADR Attuale", format="€%.2f"),
+                        "impatto_revenue_totale": st.column_config.NumberColumn("DIFF", format="€%.2f")
+                    },
+                    hide_index=True,
+                    use_container_width=True
+                )
+                st.caption("Nelle notti in cui ADR netto e ancillare per camera non coprono l'ADR attuale spostato conviene "
+                           "accettare solo le camere ancora libere; l'ancillare della controproposta segue le camere accettate.")
         
         col1, col2 = st.columns(2)
         with col1:
-            st.plotly_chart(detail_fig, use_container_width=True)
+            # Il grafico di dettaglio viene costruito solo se visualizzato; sui periodi lunghi è nascosto di default
+            show_detail_chart = st.toggle("Mostra grafico di dettaglio", value=len(result_df) <= WEEKLY_THRESHOLD_DAYS,
+                                          key="show_detail_chart",
+                                          help=f"Oltre {WEEKLY_THRESHOLD_DAYS} giorni le barre sono aggregate per settimana")
+            if show_detail_chart:
+                with diagnostics.stage("create_visualizations", rows=len(result_df)):
+                    detail_fig = analysis_graph.get('detail_figure')
+                st.plotly_chart(detail_fig, use_container_width=True)
         with col2:
-            st.plotly_chart(summary_fig, use_container_width=True)
+            st.plotly_chart(analysis_graph.get('summary_figure'), use_container_width=True)
                
             st.subheader("Riepilogo")
                
@@ -2746,6 +1977,7 @@ else:
             st.header("🧠 Ragionamento Esteso")
             
             st.subheader("Confronto Scenari di ADR")
+            st.info(f"Soglia di pareggio: sotto €{metrics['floor_adr_lordo']:,.2f} lordo per room night l'impatto del gruppo diventa negativo")
             st.dataframe(
                 extended_analysis_results['scenarios_df'],
                 column_config={
@@ -2757,37 +1989,45 @@ else:
                     "room_profit": st.column_config.NumberColumn("Profitto Camere", format="€%.2f"),
                     "total_rev_profit": st.column_config.NumberColumn("Profitto Totale", format="€%.2f"),
                     "displaced_rooms": st.column_config.NumberColumn("Camere Displaced", format="%d"),
-                    "should_accept": st.column_config.CheckboxColumn("Da Accettare")
+                    "should_accept": st.column_config.CheckboxColumn("Da Accettare"),
+                    "probabilita_accettazione": st.column_config.ProgressColumn("Prob. Accettazione", format="%.0f%%",
+                                                                                min_value=0, max_value=1),
+                    "profitto_atteso": st.column_config.NumberColumn("Profitto Atteso", format="€%.2f")
                 },
                 use_container_width=True
             )
+            if 'profitto_atteso' in extended_analysis_results['scenarios_df'].columns:
+                st.caption(f"Probabilità di accettazione stimata su {extended_analysis_results['acceptance_curve'].observations} "
+                           "preventivi con esito registrato, in base al rapporto tra ADR netto del gruppo e ADR LY del periodo. "
+                           "Il suggerimento tariffario massimizza il profitto atteso.")
             
             scenarios_df_sorted = extended_analysis_results['scenarios_df'].sort_values('variation')
             
-            fig_scenarios = px.line(
-                scenarios_df_sorted, 
-                x="variation_label", 
-                y=["total_rev_profit", "room_profit"],
-                markers=True,
-                labels={
-                    "variation_label": "Scenario ADR",
-                    "value": "Profitto (€)",
-                    "variable": "Tipo"
-                },
-                category_orders={"variation_label": scenarios_df_sorted["variation_label"].tolist()},
-                title="Impatto delle variazioni di ADR sul profitto",
-                color_discrete_map={
-                    "total_rev_profit": COLOR_PALETTE["positive"],
-                    "room_profit": COLOR_PALETTE["secondary"]
-                }
-            )
+            with diagnostics.stage("grafico scenari", rows=len(scenarios_df_sorted)):
+                fig_scenarios = px.line(
+                    scenarios_df_sorted, 
+                    x="variation_label", 
+                    y=["total_rev_profit", "room_profit"],
+                    markers=True,
+                    labels={
+                        "variation_label": "Scenario ADR",
+                        "value": "Profitto (€)",
+                        "variable": "Tipo"
+                    },
+                    category_orders={"variation_label": scenarios_df_sorted["variation_label"].tolist()},
+                    title="Impatto delle variazioni di ADR sul profitto",
+                    color_discrete_map={
+                        "total_rev_profit": COLOR_PALETTE["positive"],
+                        "room_profit": COLOR_PALETTE["secondary"]
+                    }
+                )
             
-            fig_scenarios.update_layout(
-                font_family="Inter, sans-serif",
-                plot_bgcolor=COLOR_PALETTE["background"],
-                paper_bgcolor=COLOR_PALETTE["background"],
-                font_color=COLOR_PALETTE["text"]
-            )
+                fig_scenarios.update_layout(
+                    font_family="Inter, sans-serif",
+                    plot_bgcolor=COLOR_PALETTE["background"],
+                    paper_bgcolor=COLOR_PALETTE["background"],
+                    font_color=COLOR_PALETTE["text"]
+                )
             
             st.plotly_chart(fig_scenarios, use_container_width=True)
             
@@ -2811,9 +2051,40 @@ else:
                     con un incremento di €{optimal_scenario['total_rev_profit'] - metrics['total_rev_profit']:,.2f} 
                     rispetto all'ADR proposta originalmente.
                     """)
+                if 'profitto_atteso' in optimal_scenario:
+                    st.caption(f"Probabilità di accettazione a questa tariffa: {optimal_scenario['probabilita_accettazione']:.0%} "
+                               f"(profitto atteso €{optimal_scenario['profitto_atteso']:,.2f})")
             else:
                 st.success("✅ L'ADR proposta è già ottimale per massimizzare il profitto.")
             
+            if 'simulation' in extended_analysis_results:
+                simulation = extended_analysis_results['simulation']
+                st.subheader("Rischio forecast (Monte Carlo)")
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("P(impatto > 0)", f"{simulation['probabilita_positivo']:.1%}")
+                with col2:
+                    st.metric("Impatto atteso", f"€{simulation['impatto_medio']:,.2f}")
+                with col3:
+                    st.metric("Impatto P5 / P95", f"€{simulation['percentili'][5]:,.0f} / €{simulation['percentili'][95]:,.0f}")
+                with col4:
+                    st.metric("Camere displaced attese", f"{simulation['camere_displaced_attese']:,.1f}",
+                              delta=f"{simulation['camere_displaced_attese'] - metrics['displaced_rooms']:+,.1f} vs forecast",
+                              delta_color="inverse")
+                
+                fig_simulation = px.histogram(
+                    pd.DataFrame({'impatto': simulation['impatti']}), x='impatto', nbins=60,
+                    labels={'impatto': "Impatto revenue (€)"},
+                    color_discrete_sequence=[COLOR_PALETTE["primary"]]
+                )
+                fig_simulation.add_vline(x=0, line_dash="dash", line_color=COLOR_PALETTE["negative"])
+                fig_simulation.add_vline(x=metrics['total_impact'], line_dash="dot", line_color=COLOR_PALETTE["secondary"],
+                                         annotation_text="Forecast")
+                fig_simulation.update_layout(height=350, showlegend=False, yaxis_title="Simulazioni")
+                st.plotly_chart(fig_simulation, use_container_width=True)
+                st.caption(f"{simulation['simulazioni']:,} percorsi del forecast individuale con la dispersione del pickup per giorni "
+                           "all'arrivo stimata dallo storico (snapshot OTB o LY vs OTB); l'OTB già confermato non diminuisce.")
+            
             if data_source == "Import file Excel" and 'raw_excel_data' in st.session_state and 'critical_days' in extended_analysis_results:
                 st.subheader("Analisi Shoulder Days")
                 
@@ -2834,15 +2105,101 @@ else:
                     use_container_width=True
                 )
                 
-                st.markdown("*La funzionalità di suggerimento date alternative sarà disponibile nei prossimi aggiornamenti.*")
+                if 'alternative_dates' in extended_analysis_results:
+                    st.subheader("Date alternative")
+                    alternatives = extended_analysis_results['alternative_dates']
+                    better = alternatives[alternatives['differenza'] > 0]
+                    if alternatives['differenza'].isna().all():
+                        st.info("Le date richieste sono fuori dall'orizzonte importato: confronto con la richiesta non disponibile")
+                    elif better.empty:
+                        st.success("✅ Nessuna data di arrivo alternativa con impatto migliore della richiesta")
+                    else:
+                        best = better.iloc[0]
+                        st.info(f"💡 Con arrivo il {best['arrivo'].strftime('%d/%m/%Y')} l'impatto sarebbe di €{best['impatto']:,.2f} "
+                                f"(€{best['differenza']:+,.2f} rispetto alle date richieste)")
+                    st.dataframe(
+                        alternatives,
+                        column_config={
+                            "arrivo": st.column_config.DateColumn("Arrivo", format="DD/MM/YYYY"),
+                            "partenza": st.column_config.DateColumn("Partenza", format="DD/MM/YYYY"),
+                            "camere_displaced": st.column_config.NumberColumn("Camere displaced", format="%d"),
+                            "revenue_displaced": st.column_config.NumberColumn("Revenue displaced", format="€%.2f"),
+                            "revenue_gruppo": st.column_config.NumberColumn("Revenue gruppo", format="€%.2f"),
+                            "impatto": st.column_config.NumberColumn("Impatto", format="€%.2f"),
+                            "differenza": st.column_config.NumberColumn("Diff. vs richiesta", format="€%.2f")
+                        },
+                        hide_index=True,
+                        use_container_width=True
+                    )
+                    st.caption("Stessa durata, camere per notte e ADR della richiesta, su ogni data di arrivo futura dei file importati (fino a due anni).")
+                
+                if 'shoulder_variants' in extended_analysis_results:
+                    st.subheader("Flessibilità arrivo e partenza")
+                    variants = extended_analysis_results['shoulder_variants']
+                    shifts = variants[variants['tipo'] == SHIFT]
+                    lengths = variants[variants['tipo'] != SHIFT]
+                    variant_columns = {
+                        "tipo": "Tipo",
+                        "arrivo": st.column_config.DateColumn("Arrivo", format="DD/MM/YYYY"),
+                        "partenza": st.column_config.DateColumn("Partenza", format="DD/MM/YYYY"),
+                        "notti": st.column_config.NumberColumn("Notti", format="%d"),
+                        "spostamento_arrivo": st.column_config.NumberColumn("Δ arrivo (gg)", format="%+d"),
+                        "spostamento_partenza": st.column_config.NumberColumn("Δ partenza (gg)", format="%+d"),
+                        "notte_ridotta": st.column_config.DateColumn("Notte di picco ridotta", format="DD/MM/YYYY"),
+                        "camere_ridotte": st.column_config.NumberColumn("Camere tolte", format="%d"),
+                        "camere_gruppo": st.column_config.NumberColumn("Room nights gruppo", format="%d"),
+                        "camere_displaced": st.column_config.NumberColumn("Camere displaced", format="%d"),
+                        "revenue_displaced": st.column_config.NumberColumn("Revenue displaced", format="€%.2f"),
+                        "revenue_gruppo": st.column_config.NumberColumn("Revenue gruppo", format="€%.2f"),
+                        "impatto": st.column_config.NumberColumn("Impatto", format="€%.2f"),
+                        "differenza": st.column_config.NumberColumn("Diff. vs richiesta", format="€%.2f"),
+                        "impatto_per_camera": st.column_config.NumberColumn("Impatto camere per RN", format="€%.2f"),
+                        "differenza_per_camera": st.column_config.NumberColumn("Diff. per RN vs richiesta", format="€%.2f")
+                    }
+                    if shifts.empty or shifts['differenza'].isna().all():
+                        st.info("Date richieste o giorni adiacenti fuori dall'orizzonte importato: varianti non disponibili")
+                    else:
+                        best = shifts.iloc[0]
+                        if best['differenza'] > 0:
+                            trim_note = (f", riducendo a {best['camere_ridotte']:.0f} camere in meno la notte del {best['notte_ridotta'].strftime('%d/%m/%Y')}"
+                                         if pd.notna(best['notte_ridotta']) else "")
+                            st.info(f"💡 Con arrivo il {best['arrivo'].strftime('%d/%m/%Y')} e partenza il {best['partenza'].strftime('%d/%m/%Y')}{trim_note} "
+                                    f"l'impatto sarebbe di €{best['impatto']:,.2f} (€{best['differenza']:+,.2f} rispetto alla richiesta)")
+                        else:
+                            st.success("✅ Nessuno spostamento di arrivo e partenza a parità di notti migliora l'impatto della richiesta")
+                        st.dataframe(
+                            shifts.drop(columns=['tipo', 'notti']),
+                            column_config=variant_columns,
+                            hide_index=True,
+                            use_container_width=True
+                        )
+                        st.caption(f"Stesso numero di notti con arrivo e partenza spostati insieme fino a {MAX_SHIFT_DAYS} giorni, "
+                                   "con o senza la notte di picco ridotta alle camere libere.")
+                    
+                    if not lengths.empty and not lengths['differenza_per_camera'].isna().all():
+                        st.markdown("**Estensioni e riduzioni del soggiorno**")
+                        best = lengths.iloc[0]
+                        if best['differenza_per_camera'] > 0:
+                            st.info(f"💡 {best['tipo']} a {best['notti']:.0f} {'notte' if best['notti'] == 1 else 'notti'} (arrivo {best['arrivo'].strftime('%d/%m/%Y')}, "
+                                    f"partenza {best['partenza'].strftime('%d/%m/%Y')}): €{best['impatto_per_camera']:,.2f} per room night "
+                                    f"(€{best['differenza_per_camera']:+,.2f} rispetto alla richiesta)")
+                        st.dataframe(
+                            lengths,
+                            column_config=variant_columns,
+                            hide_index=True,
+                            use_container_width=True
+                        )
+                        st.caption("Durata diversa dalla richiesta, confrontata per room night: impatto delle camere (revenue camere meno revenue displaced, "
+                                   "senza l'ancillare) diviso per le room night del gruppo. Le notti aggiunte ripetono camere e ADR della prima o dell'ultima notte.")
                
         st.subheader("Dati Dettagliati")
         display_cols = ['data', 'giorno', 'finale_rn', 'camere_gruppo', 'camere_disponibili', 
                          'camere_displaced', 'adr_gruppo_netto', 'finale_adr', 
-                         'revenue_camere_gruppo_effettivo', 'revenue_displaced', 'impatto_revenue_totale']
+                         'revenue_camere_gruppo_effettivo', 'revenue_displaced', 'impatto_revenue_totale', 'adr_minimo_netto']
            
+        # Conversione in Arrow una volta per risultato del grafo: ai rerun successivi si riusa la stessa tabella
         st.dataframe(
-               result_df[display_cols],
+               arrow_table(result_df, display_cols),
                column_config={
                    "data": st.column_config.DateColumn("Data", format="DD/MM/YYYY"),
                    "giorno": "Giorno",
@@ -2854,7 +2211,8 @@ else:
                    "finale_adr": st.column_config.NumberColumn("ADR Attuale", format="€%.2f"),
                    "revenue_camere_gruppo_effettivo": st.column_config.NumberColumn("REV REQ", format="€%.2f"),
                    "revenue_displaced": st.column_config.NumberColumn("REV DSPL", format="€%.2f"),
-                   "impatto_revenue_totale": st.column_config.NumberColumn("DIFF", format="€%.2f")
+                   "impatto_revenue_totale": st.column_config.NumberColumn("DIFF", format="€%.2f"),
+                   "adr_minimo_netto": st.column_config.NumberColumn("ADR Min Netto", format="€%.2f")
                },
                use_container_width=True
            )
@@ -2880,13 +2238,15 @@ else:
                 'iva_rate': iva_rate
             }
             
-            excel_download_link = get_excel_download_link(
-                result_df, 
-                metrics, 
-                group_info, 
-                hotel_info, 
-                f"Report_Displacement_{group_name}_{datetime.now().strftime('%Y%m%d')}"
-            )
+            analysis_graph.input('group_info', group_info)
+            analysis_graph.input('hotel_info', hotel_info)
+            analysis_graph.input('author', st.session_state['username'])
+            
+            with diagnostics.stage("generate_excel_report", rows=len(result_df)):
+                excel_download_link = get_excel_download_link(
+                    analysis_graph.get('report'),
+                    f"Report_Displacement_{group_name}_{datetime.now().strftime('%Y%m%d')}"
+                )
             
             st.markdown(excel_download_link, unsafe_allow_html=True)
            
@@ -2936,9 +2296,128 @@ else:
             with col2:
                 st.info("💡 Per copiare l'email, seleziona tutto il testo nella casella sopra (Ctrl+A), poi premi Ctrl+C (o Cmd+C su Mac)")
         
+        with st.expander("Storico preventivi"):
+            past_quotes = pd.concat([
+                quote_store.quotes(start=group_arrival, end=group_departure),
+                quote_store.quotes(group_name=group_name)
+            ]).drop_duplicates('id')
+            past_quotes = past_quotes[past_quotes['id'] != st.session_state.get('quote_id')]
+            
+            if past_quotes.empty:
+                st.info("Nessun preventivo precedente per queste date o per questo gruppo.")
+            else:
+                past_quotes = past_quotes.sort_values('created_at', ascending=False)
+                st.dataframe(
+                    past_quotes[['created_at', 'username', 'group_name', 'start_date', 'end_date', 'group_rooms',
+                                 'adr_lordo', 'decision', 'total_impact', 'displaced_rooms', 'floor_adr_lordo', 'outcome']],
+                    hide_index=True,
+                    use_container_width=True,
+                    column_config={
+                        "created_at": st.column_config.DatetimeColumn("Salvato il", format="DD/MM/YYYY HH:mm"),
+                        "username": "Utente",
+                        "group_name": "Gruppo",
+                        "start_date": st.column_config.DateColumn("Arrivo", format="DD/MM/YYYY"),
+                        "end_date": st.column_config.DateColumn("Partenza", format="DD/MM/YYYY"),
+                        "group_rooms": st.column_config.NumberColumn("Room nights", format="%d"),
+                        "adr_lordo": st.column_config.NumberColumn("ADR Lordo", format="€%.2f"),
+                        "decision": "Decisione",
+                        "total_impact": st.column_config.NumberColumn("Impatto", format="€%.2f"),
+                        "displaced_rooms": st.column_config.NumberColumn("Displaced", format="%d"),
+                        "floor_adr_lordo": st.column_config.NumberColumn("ADR Minimo", format="€%.2f"),
+                        "outcome": "Esito"
+                    }
+                )
+                
+                quote_ids = {
+                    f"#{quote.id} {quote.group_name} del {quote.created_at.strftime('%d/%m/%Y %H:%M')} "
+                    f"({quote.decision}, €{quote.total_impact:,.0f})": quote.id
+                    for quote in past_quotes.itertuples()
+                }
+                compare_id = quote_ids[st.selectbox("Confronta con", list(quote_ids), key="compare_quote")]
+                past_quote, past_days = quote_store.load_quote(compare_id)
+                past_metrics = past_quote['metrics']
+                
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("Impatto revenue", f"€{metrics['total_impact']:,.2f}",
+                              delta=f"€{metrics['total_impact'] - past_metrics['total_impact']:+,.2f}")
+                with col2:
+                    st.metric("ADR Lordo", f"€{adr_lordo:,.2f}", delta=f"€{adr_lordo - past_quote['adr_lordo']:+,.2f}")
+                with col3:
+                    st.metric("Camere displaced", f"{metrics['displaced_rooms']:,.0f}",
+                              delta=f"{metrics['displaced_rooms'] - past_metrics['displaced_rooms']:+,.0f}",
+                              delta_color="inverse")
+                with col4:
+                    st.metric("ADR minimo lordo", f"€{metrics['floor_adr_lordo']:,.2f}",
+                              delta=f"€{metrics['floor_adr_lordo'] - past_metrics.get('floor_adr_lordo', 0):+,.2f}",
+                              delta_color="inverse")
+                
+                st.dataframe(
+                    past_days,
+                    hide_index=True,
+                    use_container_width=True,
+                    column_config={
+                        "data": st.column_config.DateColumn("Data", format="DD/MM/YYYY"),
+                        "camere_gruppo": st.column_config.NumberColumn("Camere Gruppo", format="%d"),
+                        "camere_gruppo_accettate": None,
+                        "camere_displaced": st.column_config.NumberColumn("Displaced", format="%d"),
+                        "finale_rn": st.column_config.NumberColumn("Finale RN", format="%d"),
+                        "finale_adr": st.column_config.NumberColumn("ADR Finale", format="€%.2f"),
+                        "adr_gruppo_netto": st.column_config.NumberColumn("ADR Gruppo Netto", format="€%.2f"),
+                        "revenue_displaced": st.column_config.NumberColumn("Revenue Displaced", format="€%.2f"),
+                        "impatto_revenue_totale": st.column_config.NumberColumn("Impatto", format="€%.2f")
+                    }
+                )
+                st.caption(f"Forecast del preventivo: {past_quote['forecast_method'] or 'n.d.'}, "
+                           f"capacità {past_quote['hotel_capacity']} camere.")
+                
+                outcome_options = ["Pendente"] + QUOTE_OUTCOMES
+                col1, col2 = st.columns([3, 1])
+                with col1:
+                    st.selectbox("Esito del preventivo selezionato", outcome_options,
+                                 index=outcome_options.index(past_quote['outcome'] or "Pendente"),
+                                 key=f"outcome_{compare_id}")
+                with col2:
+                    st.button("Salva esito", key="save_outcome", use_container_width=True,
+                              on_click=save_quote_outcome, args=(compare_id, f"outcome_{compare_id}"))
+        
+        with st.expander("Analisi win/loss"):
+            decided_quotes = quote_store.decided_quotes()
+            if decided_quotes.empty:
+                st.info("Nessun preventivo con esito registrato: imposta l'esito (Vinto/Perso) dallo storico preventivi.")
+            else:
+                features = quote_features(decided_quotes)
+                st.metric("Win rate complessivo", f"{features['vinto'].mean():.0%}",
+                          help=f"{int(features['vinto'].sum())} vinti su {len(features)} preventivi con esito")
+                
+                dimension_label = st.selectbox("Raggruppa per", list(DIMENSIONS.values()), key="winloss_dimension")
+                dimension = next(column for column, label in DIMENSIONS.items() if label == dimension_label)
+                rates = win_rates(features, dimension)
+                fig_winloss = px.bar(
+                    rates, x=dimension, y='win_rate', text='preventivi',
+                    labels={dimension: DIMENSIONS[dimension], 'win_rate': "Win rate", 'preventivi': "Preventivi"},
+                    color_discrete_sequence=[COLOR_PALETTE["primary"]]
+                )
+                fig_winloss.update_layout(height=320, yaxis_tickformat=".0%")
+                st.plotly_chart(fig_winloss, use_container_width=True)
+                
+                acceptance_curve = get_acceptance_curve()
+                if acceptance_curve is not None:
+                    curve_df = acceptance_curve.to_frame()
+                    fig_curve = px.line(
+                        curve_df, x='adr_ratio', y='probabilita_accettazione', markers=True,
+                        labels={'adr_ratio': "ADR netto gruppo / ADR LY", 'probabilita_accettazione': "Probabilità di accettazione"},
+                        color_discrete_sequence=[COLOR_PALETTE["secondary"]]
+                    )
+                    fig_curve.update_layout(height=320, yaxis_tickformat=".0%", xaxis_tickformat=".0%")
+                    st.plotly_chart(fig_curve, use_container_width=True)
+                else:
+                    st.caption(f"La curva di accettazione usata negli scenari ADR richiede almeno {MIN_DECIDED_QUOTES} preventivi "
+                               "con esito, sia vinti sia persi.")
+        
         if enable_series:
             if st.button("Salva passaggio e continua", key="save_passage"):
-                st.session_state['series_data'].append({
+                session_memory.load(st.session_state, 'series_data').append({
                     'passage': st.session_state['current_passage'],
                     'date_range': f"{group_arrival.strftime('%d/%m/%Y')} - {group_departure.strftime('%d/%m/%Y')}",
                     'rooms': num_rooms,
@@ -2973,8 +2452,9 @@ else:
 if enable_series and st.session_state.get('series_complete', False):
     st.header("Riepilogo Serie di Gruppi")
     
+    series_data = session_memory.load(st.session_state, 'series_data')
     series_df_data = []
-    for item in st.session_state['series_data']:
+    for item in series_data:
         series_df_data.append({
             'Passaggio': item['passage'],
             'Date': item['date_range'],
@@ -3005,11 +2485,11 @@ if enable_series and st.session_state.get('series_complete', False):
         use_container_width=True
     )
     
-    total_series_revenue = sum(item['total_lordo'] for item in st.session_state['series_data'])
-    total_series_impact = sum(item['net_impact'] for item in st.session_state['series_data'])
-    total_series_room_revenue = sum(item['room_revenue'] for item in st.session_state['series_data'])
-    total_series_ancillary = sum(item['ancillary_revenue'] for item in st.session_state['series_data'])
-    total_series_displaced = sum(item['displaced_revenue'] for item in st.session_state['series_data'])
+    total_series_revenue = sum(item['total_lordo'] for item in series_data)
+    total_series_impact = sum(item['net_impact'] for item in series_data)
+    total_series_room_revenue = sum(item['room_revenue'] for item in series_data)
+    total_series_ancillary = sum(item['ancillary_revenue'] for item in series_data)
+    total_series_displaced = sum(item['displaced_revenue'] for item in series_data)
     
     st.subheader("Totale Serie")
     col1, col2, col3 = st.columns(3)
@@ -3085,6 +2565,136 @@ if enable_series and st.session_state.get('series_complete', False):
         st.session_state['analysis_phase'] = 'start'
         st.rerun()
 
+diagnostics.end_run()
+
+# Controllo del budget a fine pagina: i dati restano su disco anche mentre la sessione è inattiva
+with diagnostics.stage("budget memoria sessione"):
+    session_memory.enforce(st.session_state, analysis_graph)
+
+if show_diagnostics:
+    with st.expander("🔧 Diagnostica", expanded=True):
+        tab1, tab2, tab3, tab4, tab5 = st.tabs(["Log", "Tempi", "Anteprime dati", "Profilo", "Memoria"])
+        
+        with tab1:
+            st.dataframe(
+                diagnostics.records_frame().iloc[::-1],
+                column_config={
+                    "ora": st.column_config.DatetimeColumn("Ora", format="HH:mm:ss"),
+                    "livello": "Livello",
+                    "fase": "Fase",
+                    "messaggio": "Messaggio"
+                },
+                hide_index=True,
+                use_container_width=True
+            )
+        
+        with tab2:
+            col1, col2 = st.columns(2)
+            with col1:
+                # Il tracciamento della memoria è globale al processo: si attiva all'avvio del server, non per sessione
+                if diagnostics.track_memory:
+                    st.caption("Memoria netta allocata per fase attiva (DISPLACEMENT_TRACK_MEMORY=1)")
+                else:
+                    st.caption("Per la memoria per fase avviare il server con DISPLACEMENT_TRACK_MEMORY=1")
+            with col2:
+                st.download_button(
+                    "Esporta tempi (JSONL)",
+                    data=diagnostics.timings_jsonl(),
+                    file_name=f"diagnostica_tempi_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl",
+                    mime="application/x-ndjson",
+                    key="download_timings"
+                )
+            
+            timing_columns = {
+                "ora": st.column_config.DatetimeColumn("Ora", format="HH:mm:ss"),
+                "fase": "Fase",
+                "esecuzioni": st.column_config.NumberColumn("Esecuzioni", format="%d"),
+                "totale_ms": st.column_config.NumberColumn("Totale (ms)", format="%.1f"),
+                "media_ms": st.column_config.NumberColumn("Media (ms)", format="%.1f"),
+                "max_ms": st.column_config.NumberColumn("Max (ms)", format="%.1f"),
+                "durata_ms": st.column_config.NumberColumn("Durata (ms)", format="%.1f"),
+                "righe": st.column_config.NumberColumn("Righe", format="%d"),
+                "memoria_netta_mb": st.column_config.NumberColumn("Memoria netta (MB)", format="%.2f"),
+                "picco_memoria_mb": st.column_config.NumberColumn("Picco memoria (MB)", format="%.2f")
+            }
+            
+            st.caption("Riepilogo per fase (clicca sulle intestazioni per ordinare)")
+            st.dataframe(diagnostics.timings_summary(), column_config=timing_columns, hide_index=True, use_container_width=True)
+            
+            st.caption("Singole esecuzioni")
+            st.dataframe(diagnostics.timings_frame().iloc[::-1], column_config=timing_columns, hide_index=True, use_container_width=True)
+            
+            st.caption("Grafo di calcolo: ricalcoli per nodo nella sessione (un nodo viene ricalcolato solo quando cambiano i suoi input)")
+            st.dataframe(analysis_graph.stats(), hide_index=True, use_container_width=True)
+        
+        with tab3:
+            if diagnostics.frames:
+                for captured in reversed(diagnostics.frames):
+                    st.caption(f"{captured['ora'].strftime('%H:%M:%S')} - {captured['etichetta']} ({captured['righe']} righe)")
+                    st.dataframe(captured['anteprima'], use_container_width=True)
+            else:
+                st.info("Nessuna anteprima catturata: imposta il livello log su DEBUG per catturare i dati intermedi")
+        
+        with tab4:
+            col1, col2 = st.columns([2, 1])
+            with col1:
+                profiler_name = st.selectbox("Profiler", PROFILERS, key="profiler_name",
+                                             help="pyinstrument è disponibile solo se installato")
+            with col2:
+                if st.button("Profila la prossima esecuzione", key="arm_profiler"):
+                    diagnostics.arm_profiler(profiler_name)
+            
+            if diagnostics.profile_next:
+                st.caption(f"Profilazione {diagnostics.profile_next} attiva per la prossima esecuzione")
+            
+            if diagnostics.profiles:
+                for profile in reversed(diagnostics.profiles):
+                    st.caption(f"{profile['profiler']} - {profile['ora'].strftime('%d/%m/%Y %H:%M:%S')}")
+                    st.code(profile['report'], language=None)
+            else:
+                st.info("Nessun profilo disponibile: avvia la profilazione e ripeti l'operazione da analizzare")
+        
+        with tab5:
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Memoria sessione", f"{session_memory.total / 1024 / 1024:,.1f} MB",
+                          help=f"Budget: {session_memory.budget / 1024 / 1024:,.0f} MB (DISPLACEMENT_SESSION_BUDGET_MB)")
+            with col2:
+                st.metric("Su disco", f"{session_memory.on_disk / 1024 / 1024:,.1f} MB")
+            with col3:
+                st.metric("Espulsioni / ricaricamenti", f"{session_memory.evictions} / {session_memory.restores}")
+            
+            memory_columns = {
+                "chiave": "Chiave",
+                "memoria_mb": st.column_config.NumberColumn("In memoria (MB)", format="%.2f"),
+                "su_disco_mb": st.column_config.NumberColumn("Su disco (MB)", format="%.2f"),
+                "stato": "Stato"
+            }
+            st.caption("Footprint stimato per chiave della sessione (i dati condivisi si contano una volta sola)")
+            st.dataframe(session_memory.report, column_config=memory_columns, hide_index=True, use_container_width=True)
+            
+            st.caption("Sessioni attive nel processo")
+            st.dataframe(process_footprint(), hide_index=True, use_container_width=True)
+            
+            st.caption("File importati condivisi tra le sessioni (in sola lettura, non contati nel budget delle sessioni)")
+            st.dataframe(
+                SHARED_STORE.stats(),
+                column_config={
+                    "contenuto": "Hash contenuto",
+                    "righe": st.column_config.NumberColumn("Righe", format="%d"),
+                    "memoria_mb": st.column_config.NumberColumn("Memoria (MB)", format="%.2f"),
+                    "sessioni": st.column_config.NumberColumn("Sessioni", format="%d"),
+                    "riutilizzi": st.column_config.NumberColumn("Riutilizzi", format="%d"),
+                    "creato": st.column_config.DatetimeColumn("Creato", format="DD/MM/YYYY HH:mm:ss")
+                },
+                hide_index=True,
+                use_container_width=True
+            )
+        
+        if st.button("Svuota diagnostica", key="clear_diagnostics"):
+            diagnostics.clear()
+            st.rerun()
+
 st.markdown("---")
 st.markdown(
    f"""
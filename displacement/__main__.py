@@ -0,0 +1,22 @@
+import sys
+
+COMMANDS = {
+    'run': "displacement.batch",
+    'benchmark': "displacement.benchmark",
+    'golden': "displacement.golden",
+    'serve': "displacement.service"
+}
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in COMMANDS:
+        print(f"Uso: python -m displacement {{{','.join(COMMANDS)}}} [opzioni]", file=sys.stderr)
+        return 0 if argv and argv[0] in ("-h", "--help") else 2
+
+    module = __import__(COMMANDS[argv[0]], fromlist=["main"])
+    return module.main(argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
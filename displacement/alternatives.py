@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+ALTERNATIVE_COLUMNS = ['arrivo', 'partenza', 'camere_displaced', 'revenue_displaced', 'revenue_gruppo', 'impatto',
+                       'differenza']
+
+
+def window_sums(values, length):
+    # Somma su ogni finestra di `length` giorni consecutivi tramite somma cumulata. Un NaN nella somma cumulata
+    # renderebbe NaN tutte le finestre successive: i valori mancanti si contano a parte e solo le finestre
+    # che li contengono restano NaN
+    values = np.asarray(values, dtype=float)
+    missing = np.concatenate([[0], np.cumsum(np.isnan(values))])
+    cumulative = np.concatenate([[0.0], np.cumsum(np.nan_to_num(values, nan=0.0))])
+    sums = cumulative[length:] - cumulative[:-length]
+    sums[missing[length:] - missing[:-length] > 0] = np.nan
+    return sums
+
+
+def stay_displacement(finale_rn, finale_adr, rooms, hotel_capacity):
+    # Camere e revenue spostati per ogni possibile arrivo, con la sequenza di camere della richiesta
+    length = len(rooms)
+    if np.all(rooms == rooms[0]):
+        displaced = np.maximum(0, finale_rn + rooms[0] - hotel_capacity)
+        return window_sums(displaced, length), window_sums(displaced * finale_adr, length)
+
+    candidates = len(finale_rn) - length + 1
+    displaced_rooms = np.zeros(candidates)
+    displaced_revenue = np.zeros(candidates)
+    for night, night_rooms in enumerate(rooms):
+        displaced = np.maximum(0, finale_rn[night:night + candidates] + night_rooms - hotel_capacity)
+        displaced_rooms += displaced
+        displaced_revenue += displaced * finale_adr[night:night + candidates]
+    return displaced_rooms, displaced_revenue
+
+
+def alternative_dates(data, group_request, hotel_capacity, top_k=5, requested_arrival=None):
+    # Scorre la richiesta (stessa durata, camere e ADR per notte) su tutto il periodo caricato
+    length = len(group_request)
+    days = data.set_index('data')[['finale_rn', 'finale_adr']].sort_index()
+    days = days.reindex(pd.date_range(days.index.min(), days.index.max()))
+    if length == 0 or len(days) < length:
+        return pd.DataFrame(columns=ALTERNATIVE_COLUMNS)
+
+    rooms = group_request['camere_gruppo'].to_numpy(dtype=float)
+    group_revenue = float((group_request['camere_gruppo'] * group_request['adr_gruppo_netto']
+                           + group_request['revenue_ancillare_gruppo']).sum())
+
+    displaced_rooms, displaced_revenue = stay_displacement(
+        days['finale_rn'].to_numpy(dtype=float), days['finale_adr'].to_numpy(dtype=float), rooms, hotel_capacity
+    )
+    impact = group_revenue - displaced_revenue
+    arrivals = days.index[:len(impact)]
+
+    # Finestre con giorni mancanti nell'import escluse; a parità di impatto prima le date più vicine alla richiesta
+    valid = ~np.isnan(impact)
+    baseline = np.nan
+    if requested_arrival is None:
+        distance = np.arange(len(arrivals))
+    else:
+        requested_arrival = pd.Timestamp(requested_arrival)
+        requested = arrivals == requested_arrival
+        # Confronto con la richiesta sulla stessa finestra completa, non sul solo periodo di analisi
+        if requested.any():
+            baseline = impact[requested][0]
+        valid &= ~requested
+        distance = np.abs((arrivals - requested_arrival).days)
+    candidates = np.flatnonzero(valid)
+    candidates = candidates[np.lexsort((distance[candidates], -impact[candidates]))[:top_k]]
+
+    return pd.DataFrame({
+        'arrivo': arrivals[candidates],
+        'partenza': arrivals[candidates] + pd.Timedelta(days=length),
+        'camere_displaced': displaced_rooms[candidates],
+        'revenue_displaced': displaced_revenue[candidates],
+        'revenue_gruppo': group_revenue,
+        'impatto': impact[candidates],
+        'differenza': impact[candidates] - baseline
+    }, columns=ALTERNATIVE_COLUMNS)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+# Orizzonte massimo del calendario disponibilità (due anni)
+MAX_HORIZON_DAYS = 730
+
+GRID_COLUMNS = ['data', 'settimana', 'giorno_settimana', 'finale_rn', 'finale_opz_rn', 'camere_disponibili',
+                'camere_disponibili_opz', 'finale_adr', 'costo_camera_extra']
+
+
+def horizon(available_dates, start=None, max_days=MAX_HORIZON_DAYS):
+    # Solo date future comprese nell'import, al massimo max_days giorni
+    available_dates = pd.DatetimeIndex(available_dates)
+    start = pd.Timestamp.today().normalize() if start is None else pd.Timestamp(start).normalize()
+    start = max(start, available_dates.min())
+    end = min(available_dates.max(), start + pd.Timedelta(days=max_days - 1))
+    return pd.date_range(start=start, end=end)
+
+
+def demand_grid(data, hotel_capacity):
+    days = data.sort_values('data')
+    dates = pd.DatetimeIndex(days['data'])
+
+    finale_rn = days['finale_rn'].to_numpy(dtype=float)
+    finale_opz_rn = days['finale_opz_rn'].to_numpy(dtype=float)
+    finale_adr = days['finale_adr'].to_numpy(dtype=float)
+    free = hotel_capacity - finale_rn
+
+    # Sulle date piene ogni camera in più sposta una camera individuale al suo ADR finale
+    return pd.DataFrame({
+        'data': dates,
+        'settimana': dates.to_period('W-SUN').start_time,
+        'giorno_settimana': dates.dayofweek,
+        'finale_rn': finale_rn,
+        'finale_opz_rn': finale_opz_rn,
+        'camere_disponibili': free,
+        'camere_disponibili_opz': hotel_capacity - finale_opz_rn,
+        'finale_adr': finale_adr,
+        'costo_camera_extra': np.where(free <= 0, finale_adr, 0.0)
+    }, columns=GRID_COLUMNS)
+
+
+def grid_matrix(grid, value_column):
+    # Matrice giorni della settimana x settimane per la heatmap: celle vuote fuori dall'orizzonte
+    weeks, columns = np.unique(grid['settimana'].to_numpy(), return_inverse=True)
+    matrix = np.full((7, len(weeks)), np.nan)
+    matrix[grid['giorno_settimana'].to_numpy(), columns] = grid[value_column].to_numpy(dtype=float)
+    return pd.DatetimeIndex(weeks), matrix
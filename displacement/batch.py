@@ -0,0 +1,311 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+from displacement.engine import (DEFAULT_DECISION_PARAMETERS, build_analysis_frame, evaluate_request,
+                                 fit_pickup_curve, prepare_segments)
+from displacement.forecast import FORECAST_METHODS
+from displacement.importer import import_excel_files
+from displacement.options import option_blocks, review_options
+from displacement.report import generate_excel_report
+from displacement.snapshots import SnapshotStore
+
+REQUEST_COLUMNS = ['name', 'start_date', 'end_date', 'num_rooms', 'adr_lordo',
+                   'fb_revenue', 'meeting_revenue', 'other_revenue']
+SUMMARY_COLUMNS = ['name', 'origine', 'start_date', 'end_date', 'notti', 'camere', 'adr_lordo', 'decisione',
+                   'total_impact', 'displaced_rooms', 'total_lordo', 'floor_adr_lordo', 'needs_authorization', 'report',
+                   'errore']
+
+_worker_state = {}
+
+
+def load_imports(directory, current_year=None):
+    paths = sorted(path for pattern in ("*.xlsx", "*.xls") for path in glob.glob(os.path.join(directory, pattern)))
+    if not paths:
+        raise ValueError(f"Nessun file Excel trovato in {directory}")
+
+    files = []
+    for path in paths:
+        with open(path, "rb") as f:
+            files.append((os.path.basename(path), f.read()))
+
+    imported, messages, _ = import_excel_files(files, current_year=current_year)
+    return imported, messages
+
+
+def load_requests(path):
+    requests = pd.read_csv(path)
+    missing = [column for column in ['name', 'start_date', 'end_date', 'adr_lordo'] if column not in requests.columns]
+    if missing:
+        raise ValueError(f"Colonne mancanti nel file richieste {path}: {', '.join(missing)}")
+
+    for column in REQUEST_COLUMNS:
+        if column not in requests.columns:
+            requests[column] = 0
+
+    requests['start_date'] = pd.to_datetime(requests['start_date'], format='mixed', dayfirst=True)
+    requests['end_date'] = pd.to_datetime(requests['end_date'], format='mixed', dayfirst=True)
+
+    pending = []
+    for row in requests[REQUEST_COLUMNS].fillna(0).to_dict('records'):
+        pending.append({
+            'name': str(row['name']),
+            'origine': "richieste",
+            'room_config': "Contingente fisso ROH",
+            'start_date': row['start_date'],
+            'end_date': row['end_date'],
+            'num_rooms': int(row['num_rooms']),
+            'adr_lordo': float(row['adr_lordo']),
+            'fb_revenue': float(row['fb_revenue']),
+            'meeting_revenue': float(row['meeting_revenue']),
+            'other_revenue': float(row['other_revenue'])
+        })
+    return pending
+
+
+def option_groups(grp_opz, iva_rate, start=None):
+    blocks = option_blocks(grp_opz, start=start)
+
+    pending = []
+    for _, days in blocks.groupby('blocco'):
+        start_date = days['data'].min()
+        end_date = days['data'].max() + pd.Timedelta(days=1)
+        pending.append({
+            'name': f"Opzione {start_date.strftime('%Y-%m-%d')}",
+            'origine': "grp_opz",
+            'room_config': "Camere variabili per giorno",
+            'start_date': start_date,
+            'end_date': end_date,
+            'num_rooms': int(round(days['grp_opz_rn'].mean())),
+            'rooms_data': days[['data', 'grp_opz_rn']].rename(columns={'grp_opz_rn': 'camere'}),
+            'adr_lordo': float(days['grp_opz_adr'].mean() * (1 + iva_rate)),
+            'fb_revenue': 0.0,
+            'meeting_revenue': 0.0,
+            'other_revenue': 0.0
+        })
+    return pending
+
+
+def _init_worker(data, settings):
+    _worker_state['data'] = data
+    _worker_state['settings'] = settings
+
+
+def _report_filename(request, index):
+    # Il progressivo della richiesta evita che due richieste con stesso nome e stesse date si sovrascrivano
+    name = re.sub(r'[^A-Za-z0-9_-]+', '_', request['name']).strip('_') or "gruppo"
+    return (f"Report_Displacement_{index:03d}_{name}_{request['start_date'].strftime('%Y%m%d')}"
+            f"_{request['end_date'].strftime('%Y%m%d')}.xlsx")
+
+
+def _summary_row(request):
+    return {
+        'name': request['name'],
+        'origine': request['origine'],
+        'start_date': request['start_date'].strftime('%Y-%m-%d'),
+        'end_date': request['end_date'].strftime('%Y-%m-%d'),
+        'notti': (request['end_date'] - request['start_date']).days,
+        'camere': request['num_rooms'],
+        'adr_lordo': request['adr_lordo'],
+        'errore': None
+    }
+
+
+def nights_out_of_period(request, imported_dates):
+    # Notti del soggiorno senza dati nell'import IDV anno corrente: lì OTB e forecast sarebbero zero
+    nights = pd.date_range(request['start_date'], request['end_date'] - pd.Timedelta(days=1))
+    return int((~nights.isin(imported_dates)).sum())
+
+
+def evaluate_pending(request, index=1):
+    data = _worker_state['data']
+    settings = _worker_state['settings']
+
+    summary = _summary_row(request)
+
+    try:
+        if request['end_date'] <= request['start_date']:
+            raise ValueError("La data di partenza deve essere successiva alla data di arrivo")
+
+        _, result_df, metrics = evaluate_request(data, request, settings['capacity'], settings['iva_rate'],
+                                                 DEFAULT_DECISION_PARAMETERS)
+
+        group_info = {
+            'name': request['name'],
+            'arrival_date': request['start_date'],
+            'departure_date': request['end_date'],
+            'num_rooms': request['num_rooms'],
+            'adr_lordo': request['adr_lordo'],
+            'adr_netto': request['adr_lordo'] / (1 + settings['iva_rate']),
+            'ancillary_revenue': request['fb_revenue'] + request['meeting_revenue'] + request['other_revenue']
+        }
+        hotel_info = {
+            'name': f"{settings['hotel']} (capacità: {settings['capacity']} camere)",
+            'capacity': settings['capacity'],
+            'iva_rate': settings['iva_rate']
+        }
+
+        report_path = os.path.join(settings['out'], _report_filename(request, index))
+        with open(report_path, "wb") as f:
+            f.write(generate_excel_report(result_df, metrics, group_info, hotel_info, author="batch notturno"))
+
+        summary.update({
+            'decisione': "ACCETTA" if metrics['should_accept'] else "DECLINA",
+            'total_impact': float(metrics['total_impact']),
+            'displaced_rooms': float(metrics['displaced_rooms']),
+            'total_lordo': float(metrics['total_lordo']),
+            'floor_adr_lordo': float(metrics['floor_adr_lordo']),
+            'needs_authorization': bool(metrics['needs_authorization']),
+            'report': report_path
+        })
+    except Exception as e:
+        summary['errore'] = f"{type(e).__name__}: {e}"
+
+    return summary
+
+
+def run(hotel, imports, out, requests_path=None, capacity=66, iva_rate=0.1, forecast_method="LY - OTB",
+        as_of=None, workers=None, save_snapshot=True, log=print):
+    as_of = pd.Timestamp(as_of or datetime.now()).normalize()
+    os.makedirs(out, exist_ok=True)
+
+    imported, messages = load_imports(imports)
+    for level, text in messages:
+        log(f"[{level}] {text}")
+
+    errors = [text for level, text in messages if level == 'error']
+    if errors or imported['idv_cy'] is None:
+        raise ValueError("Import non riuscito: " + ("; ".join(errors) or "file IDV anno corrente mancante"))
+
+    if save_snapshot:
+        saved = SnapshotStore(hotel=hotel).save_import(as_of, imported)
+        log(f"Snapshot OTB al {as_of.strftime('%d/%m/%Y')} salvato: {saved}")
+
+    segments = prepare_segments(imported['idv_cy'], imported['idv_ly'], imported['grp_otb'], imported['grp_opz'])
+
+    if requests_path:
+        pending = load_requests(requests_path)
+    else:
+        pending = option_groups(segments['grp_opz'], iva_rate, start=as_of)
+
+    if not pending:
+        log("Nessuna richiesta da valutare")
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+
+    # Richieste con notti fuori dal periodo importato: valutate su dati a zero risulterebbero sempre da accettare
+    imported_dates = pd.DatetimeIndex(segments['idv_cy']['data'].unique())
+    results = {}
+    indexed = []
+    for index, request in enumerate(pending, start=1):
+        missing = nights_out_of_period(request, imported_dates) if request['end_date'] > request['start_date'] else 0
+        if missing:
+            results[index] = dict(_summary_row(request), decisione="FUORI PERIODO")
+            log(f"[warning] Richiesta {request['name']} ({request['start_date'].strftime('%d/%m/%Y')} - "
+                f"{request['end_date'].strftime('%d/%m/%Y')}) non valutata: {missing} notti fuori dal periodo importato "
+                f"({imported_dates.min().strftime('%d/%m/%Y')} - {imported_dates.max().strftime('%d/%m/%Y')})")
+        else:
+            indexed.append((index, request))
+
+    data = None
+    if indexed:
+        date_range = pd.date_range(min(request['start_date'] for _, request in indexed),
+                                   max(request['end_date'] for _, request in indexed) - pd.Timedelta(days=1))
+
+        curve = None
+        if forecast_method == "Curva pickup":
+            curve = fit_pickup_curve(segments, as_of, SnapshotStore(hotel=hotel).pickup_history(as_of=as_of))
+
+        data = build_analysis_frame(segments, date_range, forecast_method, curve=curve, as_of=as_of)
+        settings = {'hotel': hotel, 'capacity': capacity, 'iva_rate': iva_rate, 'out': out}
+
+        workers = workers or min(len(indexed), os.cpu_count() or 1)
+        log(f"Valutazione di {len(indexed)} richieste con {workers} processi")
+
+        indices = [index for index, _ in indexed]
+        requests = [request for _, request in indexed]
+        if workers > 1:
+            context = multiprocessing.get_context("fork") if sys.platform.startswith("linux") else None
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                     initializer=_init_worker, initargs=(data, settings)) as executor:
+                results.update(zip(indices, executor.map(evaluate_pending, requests, indices)))
+        else:
+            _init_worker(data, settings)
+            results.update((index, evaluate_pending(request, index)) for index, request in indexed)
+
+    results = [results[index] for index in sorted(results)]
+    summary = pd.DataFrame(results).reindex(columns=SUMMARY_COLUMNS)
+
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if not requests_path and data is not None:
+        review = review_options(data, capacity)
+        review.to_csv(os.path.join(out, f"revisione_opzioni_{stamp}.csv"), index=False)
+        log(f"Revisione opzioni: {int(review['rilascio_consigliato'].sum())} opzioni su {len(review)} da rilasciare")
+    summary.to_csv(os.path.join(out, f"riepilogo_{stamp}.csv"), index=False)
+    with open(os.path.join(out, f"riepilogo_{stamp}.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            'hotel': hotel,
+            'as_of': as_of.strftime('%Y-%m-%d'),
+            'metodo_forecast': forecast_method,
+            'richieste': json.loads(summary.to_json(orient='records'))
+        }, f, indent=2, ensure_ascii=False)
+
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m displacement run",
+        description="Valutazione in batch delle richieste gruppo / opzioni pendenti con report Excel e riepilogo"
+    )
+    parser.add_argument("--hotel", required=True, help="Codice hotel (usato per snapshot OTB e report)")
+    parser.add_argument("--imports", required=True, help="Cartella con gli export Excel del PMS")
+    parser.add_argument("--requests", default=None,
+                        help="CSV con le richieste (name,start_date,end_date,num_rooms,adr_lordo,...); "
+                             "senza, si valutano i gruppi opzionati (grp_opz) dal file importato")
+    parser.add_argument("--out", default="reports", help="Cartella in cui salvare report e riepilogo")
+    parser.add_argument("--capacity", type=int, default=66, help="Capacità hotel (camere)")
+    parser.add_argument("--iva", type=float, default=10.0, help="Aliquota IVA (%%)")
+    parser.add_argument("--forecast-method", default="LY - OTB", choices=FORECAST_METHODS)
+    parser.add_argument("--as-of", default=None, help="Data di rilevazione OTB (AAAA-MM-GG, default oggi)")
+    parser.add_argument("--workers", type=int, default=None, help="Numero di processi (default: CPU disponibili)")
+    parser.add_argument("--no-snapshot", action="store_true", help="Non salvare lo snapshot OTB dell'import")
+    args = parser.parse_args(argv)
+
+    try:
+        summary = run(
+            args.hotel,
+            args.imports,
+            args.out,
+            requests_path=args.requests,
+            capacity=args.capacity,
+            iva_rate=args.iva / 100,
+            forecast_method=args.forecast_method,
+            as_of=args.as_of,
+            workers=args.workers,
+            save_snapshot=not args.no_snapshot
+        )
+    except ValueError as e:
+        print(f"Errore: {e}", file=sys.stderr)
+        return 2
+
+    if summary.empty:
+        return 0
+
+    print(summary[['name', 'start_date', 'end_date', 'camere', 'decisione', 'total_impact', 'floor_adr_lordo', 'errore']]
+          .to_string(index=False))
+    out_of_period = (summary['decisione'] == "FUORI PERIODO").sum()
+    if out_of_period:
+        print(f"{out_of_period} richieste su {len(summary)} fuori dal periodo importato, non valutate", file=sys.stderr)
+    failed = summary['errore'].notna().sum()
+    if failed:
+        print(f"{failed} richieste su {len(summary)} non valutate", file=sys.stderr)
+        return 1
+    return 0
@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from displacement.diagnostics import Diagnostics
+from displacement.engine import (ADR_VARIATIONS, DEFAULT_DECISION_PARAMETERS, adr_scenarios, build_analysis_frame,
+                                 evaluate_request, prepare_segments)
+from displacement.forecast import FORECAST_METHODS
+from displacement.importer import import_excel_files
+from displacement.report import generate_excel_report
+from displacement.synthetic import SIZES, size_to_days, synthetic_imports
+
+STAGES = ["process_excel_import", "process_imported_data", "analyze", "scenari ADR", "generate_excel_report"]
+DEFAULT_SIZES = ['1m', '1y', '5y']
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_size(size, repeat=3, capacity=66, forecast_method="LY - OTB", use_processes=None,
+             track_memory=False, seed=0):
+    days = size_to_days(size)
+    files = synthetic_imports(days, capacity=capacity, seed=seed)
+    current_year = pd.Timestamp.today().year
+    start = pd.Timestamp(current_year, 1, 1)
+
+    # La richiesta copre l'intero periodo, così analisi e report crescono con la dimensione
+    request = {
+        'room_config': "Contingente fisso ROH",
+        'start_date': start,
+        'end_date': start + pd.Timedelta(days=days),
+        'num_rooms': 20,
+        'adr_lordo': 180.0,
+        'fb_revenue': 1500.0,
+        'meeting_revenue': 500.0,
+        'other_revenue': 0.0
+    }
+
+    diagnostics = Diagnostics(level="WARNING")
+    # Il benchmark possiede l'intero processo: può misurare il picco di memoria azzerandolo a ogni fase
+    diagnostics.set_memory_tracking(track_memory, exclusive=True)
+
+    for _ in range(repeat):
+        with diagnostics.stage("process_excel_import") as stage:
+            imported, messages, _ = import_excel_files(files, current_year=current_year, use_processes=use_processes)
+            stage['righe'] = sum(len(df) for df in imported.values() if df is not None)
+
+        errors = [text for level, text in messages if level == 'error']
+        if errors:
+            raise ValueError("Import sintetico non riuscito: " + "; ".join(errors))
+
+        with diagnostics.stage("process_imported_data") as stage:
+            segments = prepare_segments(imported['idv_cy'], imported['idv_ly'], imported['grp_otb'], imported['grp_opz'])
+            data = build_analysis_frame(segments, pd.date_range(start, periods=days), forecast_method, as_of=start)
+            stage['righe'] = len(data)
+
+        with diagnostics.stage("analyze", rows=len(data)):
+            _, result_df, metrics = evaluate_request(data, request, capacity, 0.1, DEFAULT_DECISION_PARAMETERS)
+
+        with diagnostics.stage("scenari ADR", rows=len(ADR_VARIATIONS) + 1):
+            adr_scenarios(data, request, capacity, 0.1, metrics, DEFAULT_DECISION_PARAMETERS)
+
+        with diagnostics.stage("generate_excel_report", rows=len(result_df)):
+            generate_excel_report(
+                result_df,
+                metrics,
+                {
+                    'name': "Benchmark",
+                    'arrival_date': request['start_date'],
+                    'departure_date': request['end_date'],
+                    'num_rooms': request['num_rooms'],
+                    'adr_lordo': request['adr_lordo'],
+                    'adr_netto': request['adr_lordo'] / 1.1,
+                    'ancillary_revenue': request['fb_revenue'] + request['meeting_revenue']
+                },
+                {'name': "Hotel benchmark", 'capacity': capacity, 'iva_rate': 0.1},
+                author="benchmark"
+            )
+
+    diagnostics.set_memory_tracking(False, exclusive=True)
+
+    timings = diagnostics.timings_frame()
+    results = []
+    for stage_name in STAGES:
+        stage_timings = timings[timings['fase'] == stage_name]
+        peak = stage_timings['picco_memoria_mb'].max()
+        results.append({
+            'size': size,
+            'giorni': days,
+            'fase': stage_name,
+            'esecuzioni': len(stage_timings),
+            'mediana_ms': float(stage_timings['durata_ms'].median()),
+            'min_ms': float(stage_timings['durata_ms'].min()),
+            'max_ms': float(stage_timings['durata_ms'].max()),
+            'righe': int(stage_timings['righe'].max()),
+            'picco_memoria_mb': float(peak) if pd.notna(peak) else None
+        })
+
+    return results
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, repeat=3, **kwargs):
+    results = []
+    for size in sizes:
+        results.extend(run_size(size, repeat=repeat, **kwargs))
+
+    return {
+        'creato_il': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'ambiente': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'piattaforma': platform.platform(),
+            'cpu': os.cpu_count()
+        },
+        'parametri': dict(kwargs, sizes=list(sizes), repeat=repeat),
+        'risultati': results
+    }
+
+
+def compare(current, baseline):
+    current_df = pd.DataFrame(current['risultati'])
+    baseline_df = pd.DataFrame(baseline['risultati'])[['size', 'fase', 'mediana_ms']]
+
+    merged = pd.merge(current_df[['size', 'fase', 'mediana_ms']], baseline_df,
+                      on=['size', 'fase'], how='left', suffixes=('', '_baseline'))
+    merged['rapporto'] = merged['mediana_ms'] / merged['mediana_ms_baseline']
+    return merged
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m displacement.benchmark",
+        description="Benchmark import → elaborazione → analisi → report su export PMS sintetici"
+    )
+    parser.add_argument("--sizes", default=",".join(DEFAULT_SIZES),
+                        help=f"Dimensioni separate da virgola ({', '.join(SIZES)} o numero di giorni)")
+    parser.add_argument("--repeat", type=int, default=3, help="Ripetizioni per dimensione (si riporta la mediana)")
+    parser.add_argument("--capacity", type=int, default=66, help="Capacità hotel (camere)")
+    parser.add_argument("--forecast-method", default="LY - OTB", choices=FORECAST_METHODS)
+    parser.add_argument("--executor", choices=["process", "thread"], default=None,
+                        help="Executor per l'import (default: DISPLACEMENT_IMPORT_EXECUTOR)")
+    parser.add_argument("--memory", action="store_true", help="Misura il picco di memoria per fase (tracemalloc)")
+    parser.add_argument("--out", default="benchmarks", help="Cartella in cui salvare il risultato JSON")
+    parser.add_argument("--compare", default=None, help="Risultato JSON precedente da confrontare")
+    args = parser.parse_args(argv)
+
+    use_processes = None if args.executor is None else args.executor == "process"
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+
+    result = run_benchmark(
+        sizes,
+        repeat=args.repeat,
+        capacity=args.capacity,
+        forecast_method=args.forecast_method,
+        use_processes=use_processes,
+        track_memory=args.memory
+    )
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+
+    print(pd.DataFrame(result['risultati']).to_string(index=False))
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print()
+        print(compare(result, baseline).to_string(index=False))
+
+    print(f"\nRisultati salvati in {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
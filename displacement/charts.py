@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from displacement.availability import grid_matrix
+from displacement.theme import COLOR_PALETTE
+
+# Oltre questa durata le barre giornaliere sono aggregate per settimana
+WEEKLY_THRESHOLD_DAYS = 92
+
+EVENT_OPACITY = {"Alto": 0.3, "Medio": 0.2, "Basso": 0.1}
+WEEKDAY_LABELS = ['Lun', 'Mar', 'Mer', 'Gio', 'Ven', 'Sab', 'Dom']
+
+EVENT_COLORS = {"Alto": "rgba(255, 87, 51, {})", "Medio": "rgba(255, 195, 0, {})", "Basso": "rgba(218, 247, 166, {})"}
+
+
+def weekly(analysis_df):
+    week = analysis_df['data'].dt.to_period('W-SUN').dt.start_time.rename('data')
+    return analysis_df.groupby(week).agg({
+        'finale_rn': 'mean',
+        'camere_gruppo': 'mean',
+        'adr_gruppo_netto': 'mean',
+        'revenue_displaced': 'sum',
+        'revenue_camere_gruppo_effettivo': 'sum',
+        'revenue_ancillare_gruppo': 'sum'
+    }).reset_index()
+
+
+def event_shapes(events_df):
+    impact = events_df["impatto"]
+    colors = [EVENT_COLORS.get(level, "rgba(200, 200, 200, {})").format(EVENT_OPACITY.get(level, 0.1)) for level in impact]
+
+    shapes = [
+        dict(type="rect", xref="x", yref="y domain", x0=start, x1=end, y0=0, y1=1,
+             fillcolor=color, layer="below", line_width=0)
+        for start, end, color in zip(events_df["data_inizio"], events_df["data_fine"], colors)
+    ]
+    annotations = [
+        dict(xref="x", yref="y domain", x=start, y=1, text=name, showarrow=False, xanchor="left", yanchor="top")
+        for start, name in zip(events_df["data_inizio"], events_df["nome"])
+    ]
+    return shapes, annotations
+
+
+def create_detail_figure(analysis_df, metrics, hotel_capacity, events_df=None, weekly_threshold=WEEKLY_THRESHOLD_DAYS):
+    aggregated = len(analysis_df) > weekly_threshold
+    if aggregated:
+        analysis_df = weekly(analysis_df)
+
+    fig = make_subplots(rows=3, cols=1,
+                      shared_xaxes=True,
+                      vertical_spacing=0.1,
+                      subplot_titles=('Occupazione (media settimanale)' if aggregated else 'Occupazione',
+                                      'ADR (media settimanale)' if aggregated else 'ADR',
+                                      'Impatto Revenue (totale settimanale)' if aggregated else 'Impatto Revenue'))
+
+    fig.add_trace(
+        go.Bar(name='OTB', x=analysis_df['data'], y=analysis_df['finale_rn'],
+              marker_color=COLOR_PALETTE["secondary"]),
+        row=1, col=1
+    )
+
+    fig.add_trace(
+        go.Bar(name='Gruppo', x=analysis_df['data'], y=analysis_df['camere_gruppo'],
+              marker_color=COLOR_PALETTE["primary"]),
+        row=1, col=1
+    )
+
+    fig.add_hline(y=hotel_capacity, line=dict(color=COLOR_PALETTE["accent"], dash='dash'),
+                  annotation_text='Capacità Hotel', annotation_position='top left', row=1, col=1)
+
+    fig.add_trace(
+        go.Scatter(name='ADR Gruppo Netto', x=analysis_df['data'], y=analysis_df['adr_gruppo_netto'],
+                 mode='lines+markers', marker=dict(color=COLOR_PALETTE["primary"])),
+        row=2, col=1
+    )
+
+    fig.add_hline(y=metrics['avg_adr_cy'], line=dict(color=COLOR_PALETTE["secondary"]),
+                  annotation_text='ADR Periodo CY', annotation_position='top left', row=2, col=1)
+
+    fig.add_hline(y=metrics['avg_adr_ly'], line=dict(color=COLOR_PALETTE["secondary"], dash='dot'),
+                  annotation_text='ADR Periodo LY', annotation_position='bottom left', row=2, col=1)
+
+    fig.add_trace(
+        go.Bar(name='Revenue Perso', x=analysis_df['data'], 
+              y=analysis_df['revenue_displaced'],
+              marker_color=COLOR_PALETTE["negative"]),
+        row=3, col=1
+    )
+
+    fig.add_trace(
+        go.Bar(name='Revenue Camere', x=analysis_df['data'], 
+              y=analysis_df['revenue_camere_gruppo_effettivo'],
+              marker_color=COLOR_PALETTE["secondary"]),
+        row=3, col=1
+    )
+
+    fig.add_trace(
+        go.Bar(name='Revenue Ancillare', x=analysis_df['data'], 
+              y=analysis_df['revenue_ancillare_gruppo'],
+              marker_color=COLOR_PALETTE["primary"]),
+        row=3, col=1
+    )
+
+    if events_df is not None and not events_df.empty:
+        # Tutti gli eventi in un solo aggiornamento del layout invece di un add_vrect per evento
+        shapes, annotations = event_shapes(events_df)
+        fig.update_layout(shapes=list(fig.layout.shapes) + shapes,
+                          annotations=list(fig.layout.annotations) + annotations)
+
+    fig.update_layout(
+        title_text='Analisi Displacement Gruppo',
+        height=800,
+        barmode='stack',
+        font_family="Inter, sans-serif",
+        plot_bgcolor=COLOR_PALETTE["background"],
+        paper_bgcolor=COLOR_PALETTE["background"],
+        font_color=COLOR_PALETTE["text"]
+    )
+
+    return fig
+
+
+def create_summary_figure(metrics):
+    fig_summary = go.Figure()
+
+    summary_data = [
+        metrics['revenue_displaced'],
+        metrics['group_room_revenue'],
+        metrics['group_ancillary'],
+        metrics['total_impact']
+    ]
+
+    summary_labels = [
+        'Revenue Perso',
+        'Revenue Camere',
+        'Revenue Ancillare',
+        'Impatto Totale'
+    ]
+
+    colors = [COLOR_PALETTE["negative"], COLOR_PALETTE["secondary"], COLOR_PALETTE["primary"], 
+             COLOR_PALETTE["positive"] if metrics['total_impact'] >= 0 else COLOR_PALETTE["negative"]]
+
+    fig_summary.add_trace(go.Bar(
+        x=summary_labels,
+        y=summary_data,
+        marker_color=colors,
+        name='Impatto Revenue'
+    ))
+
+    fig_summary.update_layout(
+        title_text='Riepilogo Finanziario',
+        font_family="Inter, sans-serif",
+        plot_bgcolor=COLOR_PALETTE["background"],
+        paper_bgcolor=COLOR_PALETTE["background"],
+        font_color=COLOR_PALETTE["text"]
+    )
+
+    return fig_summary
+
+
+def create_demand_heatmap(grid, hotel_capacity):
+    weeks, free = grid_matrix(grid, 'camere_disponibili')
+    _, free_with_options = grid_matrix(grid, 'camere_disponibili_opz')
+    _, extra_room_cost = grid_matrix(grid, 'costo_camera_extra')
+    days = weeks.values[None, :] + np.arange(7)[:, None] * np.timedelta64(1, 'D')
+    labels = pd.DatetimeIndex(days.ravel()).strftime('%a %d/%m/%Y').to_numpy().reshape(days.shape)
+
+    fig = go.Figure(go.Heatmap(
+        x=weeks,
+        y=WEEKDAY_LABELS,
+        z=free,
+        zmin=min(0, np.nanmin(free)),
+        zmax=hotel_capacity,
+        colorscale=[[0, COLOR_PALETTE["negative"]], [0.5, COLOR_PALETTE["background"]], [1, COLOR_PALETTE["secondary"]]],
+        customdata=np.dstack([labels, free_with_options, extra_room_cost]),
+        hovertemplate="%{customdata[0]}<br>Camere disponibili: %{z:.0f}<br>Con opzioni: %{customdata[1]:.0f}"
+                      "<br>Costo camera extra: €%{customdata[2]:.2f}<extra></extra>",
+        colorbar=dict(title="Disponibili"),
+        hoverongaps=False,
+        xgap=1,
+        ygap=1
+    ))
+
+    fig.update_layout(
+        title_text='Calendario disponibilità e costo di displacement',
+        height=320,
+        yaxis=dict(autorange='reversed'),
+        xaxis=dict(tickformat='%b %Y'),
+        font_family="Inter, sans-serif",
+        plot_bgcolor=COLOR_PALETTE["background"],
+        paper_bgcolor=COLOR_PALETTE["background"],
+        font_color=COLOR_PALETTE["text"]
+    )
+
+    return fig
+
+
+def create_visualizations(analysis_df, metrics, hotel_capacity, events_df=None):
+    return create_detail_figure(analysis_df, metrics, hotel_capacity, events_df), create_summary_figure(metrics)
@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import holidays
+
+
+def same_day_last_year(current_date):
+    days_to_subtract = 365
+    if (current_date.year % 4 == 0 and current_date.year % 100 != 0) or (current_date.year % 400 == 0):
+        days_to_subtract = 366
+
+    last_year_date = current_date - timedelta(days=days_to_subtract)
+
+    if last_year_date.weekday() != current_date.weekday():
+        days_diff = (current_date.weekday() - last_year_date.weekday()) % 7
+        last_year_date = last_year_date + timedelta(days=days_diff)
+
+    return last_year_date
+
+
+def same_day_last_year_index(dates):
+    dates = pd.DatetimeIndex(dates)
+    days_to_subtract = np.where(dates.is_leap_year, 366, 365)
+    last_year = dates - pd.to_timedelta(days_to_subtract, unit='D')
+    days_diff = (dates.dayofweek - last_year.dayofweek) % 7
+    return last_year + pd.to_timedelta(days_diff, unit='D')
+
+
+def holiday_mask(dates):
+    dates = pd.DatetimeIndex(dates)
+    if len(dates) == 0:
+        return np.zeros(0, dtype=bool)
+
+    calendar = holidays.IT(years=range(dates.year.min(), dates.year.max() + 1))
+    holiday_dates = pd.DatetimeIndex(list(calendar.keys()))
+    return np.asarray(dates.normalize().isin(holiday_dates))
@@ -0,0 +1,242 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+DEFAULT_LOG_LEVEL = os.environ.get("DISPLACEMENT_LOG_LEVEL", "WARNING").upper()
+
+TRACK_MEMORY = os.environ.get("DISPLACEMENT_TRACK_MEMORY", "0") == "1"
+PROFILERS = ["cProfile"] + (["pyinstrument"] if pyinstrument is not None else [])
+TIMING_COLUMNS = ['ora', 'fase', 'durata_ms', 'righe', 'memoria_netta_mb', 'picco_memoria_mb']
+
+logger = logging.getLogger("displacement")
+
+
+def start_memory_tracking():
+    # tracemalloc è globale al processo: avviato una sola volta e mai fermato dalle singole sessioni
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+if TRACK_MEMORY:
+    start_memory_tracking()
+
+
+class Diagnostics:
+    def __init__(self, level=DEFAULT_LOG_LEVEL, capacity=500):
+        self.level = level if level in LOG_LEVELS else "WARNING"
+        self.records = deque(maxlen=capacity)
+        self.timings = deque(maxlen=capacity)
+        self.frames = deque(maxlen=20)
+        self.profiles = deque(maxlen=5)
+        self.profile_next = None
+        self.track_memory = TRACK_MEMORY
+        self.exclusive_memory = False
+        self._memory_stack = []
+        self._profiler = None
+        self._profiler_name = None
+        self._profile_started = None
+
+    def set_level(self, level):
+        if level in LOG_LEVELS:
+            self.level = level
+
+    def enabled(self, level):
+        return logging.getLevelName(level) >= logging.getLevelName(self.level)
+
+    def log(self, level, message, stage=None):
+        logger.log(logging.getLevelName(level), message)
+
+        if self.enabled(level):
+            self.records.append({
+                'ora': datetime.now(),
+                'livello': level,
+                'fase': stage,
+                'messaggio': message
+            })
+
+    def debug(self, message, stage=None):
+        self.log("DEBUG", message, stage)
+
+    def info(self, message, stage=None):
+        self.log("INFO", message, stage)
+
+    def warning(self, message, stage=None):
+        self.log("WARNING", message, stage)
+
+    def error(self, message, stage=None):
+        self.log("ERROR", message, stage)
+
+    def frame(self, label, df, rows=5):
+        # Le anteprime dei DataFrame vengono catturate solo in DEBUG e mostrate solo nel pannello
+        if not self.enabled("DEBUG") or df is None:
+            return
+
+        self.frames.append({
+            'ora': datetime.now(),
+            'etichetta': label,
+            'anteprima': df.head(rows).copy(),
+            'righe': len(df)
+        })
+
+    def set_memory_tracking(self, enabled, exclusive=False):
+        # Solo chi possiede l'intero processo (es. il benchmark) può avviare/fermare tracemalloc e azzerarne il picco;
+        # nelle sessioni condivise si registra solo la memoria netta allocata da ogni fase
+        self.track_memory = enabled
+        self.exclusive_memory = enabled and exclusive
+        if exclusive and enabled:
+            start_memory_tracking()
+        elif exclusive and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._memory_stack.clear()
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        info = {'righe': rows}
+        tracking = self.track_memory and tracemalloc.is_tracing()
+        memory = self._memory_start() if tracking and self.exclusive_memory else None
+        allocated = tracemalloc.get_traced_memory()[0] if tracking else None
+        started = time.perf_counter()
+        try:
+            yield info
+        finally:
+            duration = time.perf_counter() - started
+            peak = self._memory_stop(memory) if memory is not None else None
+            if allocated is not None and tracemalloc.is_tracing():
+                allocated = tracemalloc.get_traced_memory()[0] - allocated
+            else:
+                allocated = None
+            self.record_timing(name, duration, rows=info.get('righe'), peak_bytes=peak, net_bytes=allocated)
+
+    def _memory_start(self):
+        current, peak = tracemalloc.get_traced_memory()
+        # Le fasi annidate azzerano il picco: quello osservato finora passa alla fase esterna
+        if self._memory_stack:
+            self._memory_stack[-1]['peak'] = max(self._memory_stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        entry = {'start': current, 'peak': 0}
+        self._memory_stack.append(entry)
+        return entry
+
+    def _memory_stop(self, entry):
+        if not tracemalloc.is_tracing() or entry not in self._memory_stack:
+            return None
+        _, peak = tracemalloc.get_traced_memory()
+        while self._memory_stack and self._memory_stack[-1] is not entry:
+            self._memory_stack.pop()
+        self._memory_stack.pop()
+        peak = max(entry['peak'], peak)
+        if self._memory_stack:
+            self._memory_stack[-1]['peak'] = max(self._memory_stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        return max(0, peak - entry['start'])
+
+    def record_timing(self, name, seconds, rows=None, peak_bytes=None, net_bytes=None):
+        self.timings.append({
+            'ora': datetime.now(),
+            'fase': name,
+            'durata_ms': seconds * 1000,
+            'righe': rows,
+            'memoria_netta_mb': net_bytes / 1024 ** 2 if net_bytes is not None else None,
+            'picco_memoria_mb': peak_bytes / 1024 ** 2 if peak_bytes is not None else None
+        })
+        self.debug(f"{name} completata in {seconds * 1000:.1f} ms", stage=name)
+
+    def arm_profiler(self, profiler="cProfile"):
+        self.profile_next = profiler if profiler in PROFILERS else "cProfile"
+
+    def begin_run(self):
+        # Un profilo rimasto aperto (st.rerun o st.stop nell'esecuzione precedente) viene chiuso qui
+        if self._profiler is not None:
+            self.end_run()
+
+        if self.profile_next:
+            if self.profile_next == "pyinstrument":
+                self._profiler = pyinstrument.Profiler()
+                self._profiler.start()
+            else:
+                self._profiler = cProfile.Profile()
+                self._profiler.enable()
+            self._profiler_name = self.profile_next
+            self._profile_started = datetime.now()
+            self.profile_next = None
+
+    def end_run(self):
+        if self._profiler is None:
+            return
+
+        self._stop_profiler()
+        if self._profiler_name == "pyinstrument":
+            report = self._profiler.output_text(unicode=True, color=False)
+        else:
+            output = io.StringIO()
+            pstats.Stats(self._profiler, stream=output).sort_stats('cumulative').print_stats(40)
+            report = output.getvalue()
+
+        self.profiles.append({
+            'ora': self._profile_started,
+            'profiler': self._profiler_name,
+            'report': report
+        })
+        self._profiler = None
+
+    def _stop_profiler(self):
+        try:
+            if self._profiler_name == "pyinstrument":
+                self._profiler.stop()
+            else:
+                self._profiler.disable()
+        except Exception:
+            pass
+
+    def records_frame(self):
+        return pd.DataFrame(list(self.records), columns=['ora', 'livello', 'fase', 'messaggio'])
+
+    def timings_frame(self):
+        return pd.DataFrame(list(self.timings), columns=TIMING_COLUMNS)
+
+    def timings_summary(self):
+        timings = self.timings_frame()
+        if timings.empty:
+            return pd.DataFrame(columns=['fase', 'esecuzioni', 'totale_ms', 'media_ms', 'max_ms', 'righe', 'memoria_netta_mb',
+                                         'picco_memoria_mb'])
+
+        return (timings.groupby('fase')
+                .agg(esecuzioni=('durata_ms', 'size'),
+                     totale_ms=('durata_ms', 'sum'),
+                     media_ms=('durata_ms', 'mean'),
+                     max_ms=('durata_ms', 'max'),
+                     righe=('righe', 'max'),
+                     memoria_netta_mb=('memoria_netta_mb', 'max'),
+                     picco_memoria_mb=('picco_memoria_mb', 'max'))
+                .sort_values('totale_ms', ascending=False)
+                .reset_index())
+
+    def timings_jsonl(self):
+        lines = []
+        for timing in self.timings:
+            record = dict(timing)
+            record['ora'] = record['ora'].isoformat(timespec='milliseconds')
+            lines.append(json.dumps(record, ensure_ascii=False))
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def clear(self):
+        self.records.clear()
+        self.timings.clear()
+        self.frames.clear()
+        self.profiles.clear()
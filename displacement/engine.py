@@ -0,0 +1,536 @@
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from displacement.dates import same_day_last_year_index
+from displacement.forecast import PickupCurve, forecast_ind_rn, history_from_ly
+
+logger = logging.getLogger("displacement.engine")
+
+ROOM_CONFIG_OPTIONS = ["Contingente fisso ROH", "Camere variabili per giorno", "Tipologie multiple"]
+ADR_VARIATIONS = [-10, -5, 0, 5, 10]
+MIN_SNAPSHOT_OBSERVATIONS = 100
+
+DEFAULT_DECISION_PARAMETERS = {
+    'min_adr_perc_cy': 100,
+    'min_adr_perc_ly': 100,
+    'ancillary_weight': 1.0,
+    'occ_threshold_low': 30,
+    'occ_threshold_high': 80,
+    'adr_flexibility_low': 0.3,
+    'adr_flexibility_high': 0.1,
+}
+
+# Colonne room nights / ADR di ogni segmento dopo la rinomina dei campi PMS
+SEGMENT_COLUMNS = {
+    'idv_cy': ('otb_ind_rn', 'otb_ind_adr'),
+    'idv_ly': ('ly_ind_rn', 'ly_ind_adr'),
+    'grp_otb': ('grp_otb_rn', 'grp_otb_adr'),
+    'grp_opz': ('grp_opz_rn', 'grp_opz_adr')
+}
+
+# Colonne aggiunte da analyze() dopo quelle dei dati e della richiesta gruppo
+ANALYSIS_COLUMNS = ['finale_rn', 'finale_opz_rn', 'camere_disponibili', 'camere_displaced', 'camere_gruppo_accettate',
+                    'revenue_displaced', 'revenue_camere_gruppo_effettivo', 'impatto_revenue_camera',
+                    'impatto_revenue_totale', 'occupazione_attuale', 'occupazione_con_gruppo', 'avg_adr_cy',
+                    'avg_adr_ly', 'extra_vs_ly', 'adr_minimo_netto']
+
+
+def prepare_segments(idv_cy_data, idv_ly_data, grp_otb_data, grp_opz_data):
+    segments = {}
+    for key, data in zip(SEGMENT_COLUMNS, [idv_cy_data, idv_ly_data, grp_otb_data, grp_opz_data]):
+        if data is None or 'data' not in data.columns:
+            segments[key] = None
+            continue
+
+        rn_column, adr_column = SEGMENT_COLUMNS[key]
+        data = data.rename(columns={'Room nights': rn_column, 'ADR Cam': adr_column})
+        data['data'] = pd.to_datetime(data['data'])
+        segments[key] = data
+
+    return segments
+
+
+def _with_columns(frame, columns, order=None):
+    # Frame costruito una sola volta dagli array delle colonne, senza inserimenti colonna per colonna né copie: le
+    # colonne non ricalcolate condividono i buffer del frame di partenza. Quelle già presenti mantengono la posizione
+    order = list(frame.columns) + [column for column in columns if column not in frame.columns] if order is None else order
+    return pd.DataFrame({column: columns[column] if column in columns else frame[column].to_numpy() for column in order},
+                        index=frame.index, copy=False)
+
+
+def _weekdays(dates):
+    # strftime('%a') su una settimana invece che su ogni data del periodo (stessi nomi, stessa lingua)
+    names = pd.date_range('2024-01-01', periods=7).strftime('%a').to_numpy(dtype=object)
+    return names[pd.DatetimeIndex(dates).dayofweek]
+
+
+def _segment_columns(data, dates, rn_column, adr_column):
+    # Camere sommate e ADR medio per data, allineati alle date del periodo (0 dove mancano): stessi valori e tipi
+    # del merge a sinistra seguito da fillna(0)
+    if data is None or data.empty or rn_column not in data.columns:
+        return np.zeros(len(dates), dtype=np.int64), np.zeros(len(dates), dtype=np.int64)
+
+    if adr_column not in data.columns:
+        data = data.assign(**{adr_column: 0})
+
+    filtered = data[data['data'].isin(dates)]
+
+    if filtered.empty:
+        return np.zeros(len(dates), dtype=np.int64), np.zeros(len(dates), dtype=np.int64)
+
+    grouped = filtered.groupby('data').agg({rn_column: 'sum', adr_column: 'mean'}).reindex(dates)
+
+    aligned = []
+    for column in [rn_column, adr_column]:
+        values = grouped[column].to_numpy()
+        aligned.append(np.where(np.isnan(values), 0, values) if values.dtype.kind == 'f' else values)
+    return tuple(aligned)
+
+
+def fit_pickup_curve(segments, as_of, history=None, min_observations=MIN_SNAPSHOT_OBSERVATIONS):
+    if history is None or len(history) < min_observations:
+        history = history_from_ly(segments.get('idv_cy'), segments.get('idv_ly'), as_of)
+    return PickupCurve.fit(history)
+
+
+def build_analysis_frame(segments, date_range, forecast_method="LY - OTB", pickup_factor=1.0,
+                         pickup_percentage=20, pickup_value=10, curve=None, as_of=None):
+    dates = pd.DatetimeIndex(date_range)
+    dates_ly = same_day_last_year_index(dates)
+    columns = {'data': dates, 'giorno': _weekdays(dates), 'data_ly': dates_ly, 'giorno_ly': _weekdays(dates_ly)}
+
+    # Ogni segmento diventa due array allineati alle date: il frame si costruisce una volta sola
+    for key, (rn_column, adr_column) in SEGMENT_COLUMNS.items():
+        logger.debug("Unione segmento %s", key)
+        columns[rn_column], columns[adr_column] = _segment_columns(segments.get(key), dates_ly if key == 'idv_ly' else dates,
+                                                                   rn_column, adr_column)
+
+    result_df = pd.DataFrame(columns, copy=False)
+
+    if as_of is None:
+        as_of = pd.Timestamp.today().normalize()
+
+    result_df['fcst_ind_rn'] = forecast_ind_rn(
+        result_df,
+        forecast_method,
+        pickup_factor=pickup_factor,
+        pickup_percentage=pickup_percentage,
+        pickup_value=pickup_value,
+        curve=curve,
+        as_of=as_of
+    )
+
+    return finale_columns(result_df)
+
+
+def finale_columns(result_df):
+    values = {column: result_df[column].to_numpy() for column in
+              ['otb_ind_rn', 'otb_ind_adr', 'ly_ind_rn', 'ly_ind_adr', 'grp_otb_rn', 'grp_otb_adr', 'grp_opz_rn',
+               'grp_opz_adr', 'fcst_ind_rn']}
+    # Copia propria: l'inserimento manuale modifica sul posto l'ADR OTB, che non deve trascinare il forecast
+    columns = {'fcst_ind_adr': values['otb_ind_adr'].copy()}
+
+    columns['otb_ind_rev'] = values['otb_ind_rn'] * values['otb_ind_adr']
+    columns['ly_ind_rev'] = values['ly_ind_rn'] * values['ly_ind_adr']
+    columns['grp_otb_rev'] = values['grp_otb_rn'] * values['grp_otb_adr']
+    columns['grp_opz_rev'] = values['grp_opz_rn'] * values['grp_opz_adr']
+    columns['fcst_ind_rev'] = values['fcst_ind_rn'] * columns['fcst_ind_adr']
+
+    columns['finale_rn'] = values['fcst_ind_rn'] + values['otb_ind_rn'] + values['grp_otb_rn']
+    columns['finale_opz_rn'] = columns['finale_rn'] + values['grp_opz_rn']
+
+    columns['finale_rev'] = columns['otb_ind_rev'] + columns['fcst_ind_rev'] + columns['grp_otb_rev']
+    columns['finale_adr'] = np.divide(columns['finale_rev'], columns['finale_rn'],
+                                      out=np.zeros(len(result_df)), where=columns['finale_rn'] > 0)
+
+    return _with_columns(result_df, columns)
+
+
+class ExcelCompatibleDisplacementAnalyzer:
+    def __init__(self, hotel_capacity, iva_rate=0.1):
+        self.hotel_capacity = hotel_capacity
+        self.iva_rate = iva_rate
+        self.data = None
+        self.group_request = None
+        self.decision_params = None
+        self.room_types = None
+
+    def set_data(self, data_df):
+        self.data = data_df
+        return self
+
+    def _request_dates(self, start_date, end_date):
+        try:
+            return pd.date_range(start=start_date, end=end_date - timedelta(days=1))
+        except Exception as e:
+            logger.error("Errore nella creazione del date range: %s", e)
+            return pd.date_range(start=datetime.now(), end=datetime.now() + timedelta(days=3))
+
+    def set_group_request(self, start_date, end_date, num_rooms, adr_lordo, adr_netto=None, fb_revenue=0, meeting_revenue=0, other_revenue=0):
+        if adr_netto is None:
+            adr_netto = adr_lordo / (1 + self.iva_rate)
+
+        date_range = self._request_dates(start_date, end_date)
+        total_days = len(date_range)
+
+        daily_fb = fb_revenue / total_days if total_days > 0 else 0
+        daily_meeting = meeting_revenue / total_days if total_days > 0 else 0
+        daily_other = other_revenue / total_days if total_days > 0 else 0
+        total_ancillary = daily_fb + daily_meeting + daily_other
+
+        self.group_request = pd.DataFrame({
+            'data': date_range,
+            'camere_gruppo': num_rooms,
+            'adr_gruppo_lordo': adr_lordo,
+            'adr_gruppo_netto': adr_netto,
+            'revenue_camere_gruppo': num_rooms * adr_netto,
+            'revenue_fb_gruppo': daily_fb,
+            'revenue_meeting_gruppo': daily_meeting,
+            'revenue_other_gruppo': daily_other,
+            'revenue_ancillare_gruppo': total_ancillary,
+            'revenue_totale_gruppo': (num_rooms * adr_netto) + total_ancillary
+        })
+
+        return self
+
+    def set_group_request_variable(self, start_date, end_date, rooms_data, adr_lordo, adr_netto=None, fb_revenue=0, meeting_revenue=0, other_revenue=0):
+        if adr_netto is None:
+            adr_netto = adr_lordo / (1 + self.iva_rate)
+
+        date_range = self._request_dates(start_date, end_date)
+        total_days = len(date_range)
+
+        daily_fb = fb_revenue / total_days if total_days > 0 else 0
+        daily_meeting = meeting_revenue / total_days if total_days > 0 else 0
+        daily_other = other_revenue / total_days if total_days > 0 else 0
+        total_ancillary = daily_fb + daily_meeting + daily_other
+
+        base_df = pd.DataFrame({'data': date_range})
+        rooms_data = pd.merge(base_df, rooms_data, on='data', how='left')
+        rooms_data['camere'] = rooms_data['camere'].fillna(0)
+
+        self.group_request = pd.DataFrame({
+            'data': date_range,
+            'camere_gruppo': rooms_data['camere'].values,
+            'adr_gruppo_lordo': adr_lordo,
+            'adr_gruppo_netto': adr_netto,
+            'revenue_camere_gruppo': rooms_data['camere'].values * adr_netto,
+            'revenue_fb_gruppo': daily_fb,
+            'revenue_meeting_gruppo': daily_meeting,
+            'revenue_other_gruppo': daily_other,
+            'revenue_ancillare_gruppo': total_ancillary,
+            'revenue_totale_gruppo': (rooms_data['camere'].values * adr_netto) + total_ancillary
+        })
+
+        return self
+
+    def set_group_request_with_types(self, start_date, end_date, room_types, adr_lordo, adr_netto=None, fb_revenue=0, meeting_revenue=0, other_revenue=0):
+        if adr_netto is None:
+            adr_netto = adr_lordo / (1 + self.iva_rate)
+
+        date_range = self._request_dates(start_date, end_date)
+        total_days = len(date_range)
+
+        daily_fb = fb_revenue / total_days if total_days > 0 else 0
+        daily_meeting = meeting_revenue / total_days if total_days > 0 else 0
+        daily_other = other_revenue / total_days if total_days > 0 else 0
+        total_ancillary = daily_fb + daily_meeting + daily_other
+
+        if isinstance(room_types, pd.DataFrame):
+            room_types = room_types.to_dict('records')
+        elif not isinstance(room_types, list):
+            logger.error("Tipo di room_types non supportato: %s", type(room_types))
+            room_types = [{"tipo": "ROH", "numero": 1, "adr_addon": 0.0}]
+
+        total_rooms = sum(rt["numero"] for rt in room_types)
+        total_revenue = sum((rt["numero"] * (adr_netto + rt["adr_addon"] / (1 + self.iva_rate))) for rt in room_types)
+
+        if total_rooms > 0:
+            weighted_adr_netto = total_revenue / total_rooms
+        else:
+            weighted_adr_netto = adr_netto
+
+        weighted_adr_lordo = weighted_adr_netto * (1 + self.iva_rate)
+
+        self.group_request = pd.DataFrame({
+            'data': date_range,
+            'camere_gruppo': total_rooms,
+            'adr_gruppo_lordo': weighted_adr_lordo,
+            'adr_gruppo_netto': weighted_adr_netto,
+            'revenue_camere_gruppo': total_rooms * weighted_adr_netto,
+            'revenue_fb_gruppo': daily_fb,
+            'revenue_meeting_gruppo': daily_meeting,
+            'revenue_other_gruppo': daily_other,
+            'revenue_ancillare_gruppo': total_ancillary,
+            'revenue_totale_gruppo': (total_rooms * weighted_adr_netto) + total_ancillary
+        })
+
+        self.room_types = room_types
+
+        return self
+
+    def set_request(self, request, adr_lordo=None, adr_netto=None, addon_factor=None):
+        room_config = request.get('room_config', ROOM_CONFIG_OPTIONS[0])
+        common = {
+            'start_date': request['start_date'],
+            'end_date': request['end_date'],
+            'adr_lordo': request['adr_lordo'] if adr_lordo is None else adr_lordo,
+            'adr_netto': adr_netto,
+            'fb_revenue': request.get('fb_revenue', 0),
+            'meeting_revenue': request.get('meeting_revenue', 0),
+            'other_revenue': request.get('other_revenue', 0)
+        }
+
+        if room_config == "Contingente fisso ROH":
+            return self.set_group_request(num_rooms=request['num_rooms'], **common)
+        elif room_config == "Camere variabili per giorno":
+            return self.set_group_request_variable(rooms_data=request['rooms_data'][['data', 'camere']], **common)
+        elif room_config == "Tipologie multiple":
+            room_types = request['room_types']
+            if isinstance(room_types, pd.DataFrame):
+                room_types = room_types.to_dict('records')
+            if addon_factor is not None:
+                room_types = [dict(rt, adr_addon=rt['adr_addon'] * addon_factor) for rt in room_types]
+            return self.set_group_request_with_types(room_types=room_types, **common)
+
+        raise ValueError(f"Configurazione camere non supportata: {room_config}")
+
+    def set_decision_parameters(self, params):
+        self.decision_params = params
+        return self
+
+    def analyze(self):
+        if self.data is None or self.group_request is None or self.decision_params is None:
+            raise ValueError("Dati, richiesta gruppo o parametri decisionali mancanti")
+
+        rooms = self.analyze_rooms(self.group_request[['data', 'camere_gruppo']])
+        return self.analyze_revenue(rooms, self.group_request)
+
+    def analyze_rooms(self, group_rooms):
+        # Parte del displacement che dipende solo dalle camere: non cambia quando varia l'ADR del gruppo
+        result = pd.merge(self.data, group_rooms, on='data', how='right')
+        columns = {}
+
+        columns['finale_rn'] = result['fcst_ind_rn'].to_numpy() + result['otb_ind_rn'].to_numpy() + result['grp_otb_rn'].to_numpy()
+        columns['finale_opz_rn'] = columns['finale_rn']
+
+        rooms = result['camere_gruppo'].to_numpy()
+        columns['camere_disponibili'] = self.hotel_capacity - columns['finale_rn']
+        columns['camere_displaced'] = np.where(
+            self.hotel_capacity - (columns['finale_rn'] + rooms) > 0,
+            0,
+            (columns['finale_rn'] + rooms) - self.hotel_capacity
+        )
+
+        columns['camere_gruppo_accettate'] = rooms
+
+        columns['occupazione_attuale'] = columns['finale_rn'] / self.hotel_capacity * 100
+        columns['occupazione_con_gruppo'] = (columns['finale_rn'] + rooms - columns['camere_displaced']) / self.hotel_capacity * 100
+
+        return _with_columns(result, columns)
+
+    def analyze_revenue(self, rooms, group_request):
+        result = pd.merge(rooms, group_request.drop(columns=['camere_gruppo']), on='data', how='left')
+        columns = {}
+
+        columns['revenue_displaced'] = result['camere_displaced'].to_numpy() * result['finale_adr'].to_numpy()
+
+        columns['revenue_camere_gruppo_effettivo'] = result['camere_gruppo'].to_numpy() * result['adr_gruppo_netto'].to_numpy()
+
+        columns['impatto_revenue_camera'] = columns['revenue_camere_gruppo_effettivo'] - columns['revenue_displaced']
+        columns['impatto_revenue_totale'] = columns['impatto_revenue_camera'] + result['revenue_ancillare_gruppo'].to_numpy()
+
+        if result['otb_ind_rn'].sum() > 0:
+            avg_adr_cy = np.average(result['otb_ind_adr'], weights=result['otb_ind_rn'])
+        else:
+            avg_adr_cy = result['otb_ind_adr'].mean() if len(result['otb_ind_adr']) > 0 else 0
+
+        if result['ly_ind_rn'].sum() > 0:
+            avg_adr_ly = np.average(result['ly_ind_adr'], weights=result['ly_ind_rn'])
+        else:
+            avg_adr_ly = result['ly_ind_adr'].mean() if len(result['ly_ind_adr']) > 0 else 0
+
+        columns['avg_adr_cy'] = np.full(len(result), avg_adr_cy)
+        columns['avg_adr_ly'] = np.full(len(result), avg_adr_ly)
+
+        columns['extra_vs_ly'] = result['adr_gruppo_netto'].to_numpy() - avg_adr_ly
+
+        columns['adr_minimo_netto'] = floor_adr(columns['revenue_displaced'], result['revenue_ancillare_gruppo'].to_numpy(),
+                                                result['camere_gruppo'].to_numpy())
+
+        # Stesso ordine di colonne del calcolo in un unico passaggio: dati, richiesta gruppo, colonne calcolate
+        return _with_columns(result, columns,
+                             list(dict.fromkeys(list(self.data.columns) + list(group_request.columns) + ANALYSIS_COLUMNS)))
+
+    def optimal_block(self, analysis_df):
+        # Controproposta: per ogni notte conviene prendere tutte le camere del gruppo se ADR netto più ancillare
+        # per camera copre l'ADR finale spostato, altrimenti solo le camere ancora libere (il displacement è lineare)
+        result = analysis_df
+        rooms = result['camere_gruppo'].to_numpy(dtype=float)
+        free = np.clip(result['camere_disponibili'].to_numpy(dtype=float), 0, rooms)
+        ancillary_per_room = np.divide(result['revenue_ancillare_gruppo'].to_numpy(dtype=float), rooms,
+                                       out=np.zeros(len(result)), where=rooms > 0)
+        breakeven = result['adr_gruppo_netto'].to_numpy(dtype=float) + ancillary_per_room >= result['finale_adr'].to_numpy(dtype=float)
+        accepted = np.where(breakeven, rooms, free)
+        share = np.divide(accepted, rooms, out=np.ones(len(result)), where=rooms > 0)
+
+        finale_rn = result['finale_rn'].to_numpy()
+        columns = {'camere_gruppo_accettate': accepted}
+        columns['camere_displaced'] = np.maximum(0, finale_rn + accepted - self.hotel_capacity)
+        columns['occupazione_con_gruppo'] = (finale_rn + accepted - columns['camere_displaced']) / self.hotel_capacity * 100
+        columns['revenue_displaced'] = columns['camere_displaced'] * result['finale_adr'].to_numpy()
+        columns['revenue_camere_gruppo_effettivo'] = accepted * result['adr_gruppo_netto'].to_numpy()
+        # Nella controproposta l'ancillare segue le camere accettate
+        for column in ['revenue_fb_gruppo', 'revenue_meeting_gruppo', 'revenue_other_gruppo', 'revenue_ancillare_gruppo']:
+            columns[column] = result[column].to_numpy() * share
+        columns['revenue_totale_gruppo'] = columns['revenue_camere_gruppo_effettivo'] + columns['revenue_ancillare_gruppo']
+        columns['impatto_revenue_camera'] = columns['revenue_camere_gruppo_effettivo'] - columns['revenue_displaced']
+        columns['impatto_revenue_totale'] = columns['impatto_revenue_camera'] + columns['revenue_ancillare_gruppo']
+        columns['adr_minimo_netto'] = floor_adr(columns['revenue_displaced'], columns['revenue_ancillare_gruppo'], accepted)
+        # Nuovo frame con le colonne ricalcolate: l'analisi di partenza resta invariata senza copiarla
+        return _with_columns(result, columns)
+
+    def get_summary_metrics(self, analysis_df):
+        total_displaced_revenue = analysis_df['revenue_displaced'].sum()
+        total_group_rooms = analysis_df['camere_gruppo'].sum()
+        total_group_room_revenue = analysis_df['revenue_camere_gruppo_effettivo'].sum()
+        total_group_ancillary = analysis_df['revenue_ancillare_gruppo'].sum()
+        total_impact = analysis_df['impatto_revenue_totale'].sum()
+
+        total_lordo = (total_group_room_revenue * (1 + self.iva_rate)) + total_group_ancillary
+        needs_authorization = total_lordo > 35000
+
+        adr_netto = analysis_df['adr_gruppo_netto'].mean()
+        adr_lordo = analysis_df['adr_gruppo_lordo'].mean()
+
+        avg_adr_cy = analysis_df['avg_adr_cy'].iloc[0] if not analysis_df.empty else 0
+        avg_adr_ly = analysis_df['avg_adr_ly'].iloc[0] if not analysis_df.empty else 0
+
+        extra_vs_ly = adr_netto - avg_adr_ly
+
+        accepted_rooms = analysis_df['camere_gruppo_accettate'].sum()
+        displaced_rooms = analysis_df['camere_displaced'].sum()
+
+        avg_occ_current = analysis_df['occupazione_attuale'].mean()
+        avg_occ_with_group = analysis_df['occupazione_con_gruppo'].mean()
+
+        should_accept = total_impact > 0
+
+        # ADR medio per room night sotto il quale l'intero soggiorno ha impatto negativo
+        floor_adr_netto = float(floor_adr(total_displaced_revenue, total_group_ancillary, accepted_rooms)) if accepted_rooms > 0 else 0
+
+        return {
+            'revenue_displaced': total_displaced_revenue,
+            'group_room_revenue': total_group_room_revenue,
+            'group_ancillary': total_group_ancillary,
+            'total_impact': total_impact,
+            'total_lordo': total_lordo,
+            'needs_authorization': needs_authorization,
+            'should_accept': should_accept,
+            'current_adr_lordo': adr_lordo,
+            'current_adr_netto': adr_netto,
+            'avg_adr_cy': avg_adr_cy,
+            'avg_adr_ly': avg_adr_ly,
+            'extra_vs_ly': extra_vs_ly,
+            'total_group_rooms': total_group_rooms,
+            'accepted_rooms': accepted_rooms,
+            'displaced_rooms': displaced_rooms,
+            'avg_occ_current': avg_occ_current,
+            'avg_occ_with_group': avg_occ_with_group,
+            'room_profit': total_group_room_revenue - total_displaced_revenue,
+            'total_rev_profit': total_impact,
+            'profit_per_room': (total_group_room_revenue - total_displaced_revenue) / accepted_rooms if accepted_rooms > 0 else 0,
+            'floor_adr_netto': floor_adr_netto,
+            'floor_adr_lordo': floor_adr_netto * (1 + self.iva_rate),
+        }
+
+    def create_visualizations(self, analysis_df, metrics, events_df=None):
+        # Plotly viene importato solo quando servono i grafici (non nei percorsi headless)
+        from displacement.charts import create_visualizations
+        return create_visualizations(analysis_df, metrics, self.hotel_capacity, events_df)
+
+
+def floor_adr(revenue_displaced, ancillary, rooms):
+    # ADR netto minimo con impatto non negativo: camere * ADR + ancillare - revenue displaced >= 0
+    # (le camere spostate non dipendono dall'ADR del gruppo, quindi la soglia è in forma chiusa)
+    rooms = np.asarray(rooms, dtype=float)
+    floor = np.divide(np.asarray(revenue_displaced, dtype=float) - np.asarray(ancillary, dtype=float), rooms,
+                      out=np.full(rooms.shape, np.nan), where=rooms > 0)
+    return np.maximum(floor, 0)
+
+
+def filter_analysis_dates(result_df, dates=None):
+    if dates is not None and 0 < len(dates) < len(result_df):
+        return result_df[result_df['data'].isin(dates)]
+    return result_df
+
+
+def evaluate_request(data, request, hotel_capacity, iva_rate, decision_params=None, dates=None,
+                     adr_lordo=None, adr_netto=None, addon_factor=None):
+    analyzer = ExcelCompatibleDisplacementAnalyzer(hotel_capacity=hotel_capacity, iva_rate=iva_rate)
+    analyzer.set_data(data)
+    analyzer.set_decision_parameters(decision_params or DEFAULT_DECISION_PARAMETERS)
+    analyzer.set_request(request, adr_lordo=adr_lordo, adr_netto=adr_netto, addon_factor=addon_factor)
+
+    result_df = filter_analysis_dates(analyzer.analyze(), dates)
+    metrics = analyzer.get_summary_metrics(result_df)
+
+    return analyzer, result_df, metrics
+
+
+def adr_scenarios(data, request, hotel_capacity, iva_rate, metrics, decision_params=None, dates=None,
+                  variations=ADR_VARIATIONS, current_year=None):
+    if current_year is None:
+        current_year = datetime.now().year
+
+    adr_lordo = request['adr_lordo']
+    adr_netto = adr_lordo / (1 + iva_rate)
+    is_future_year = pd.Timestamp(request['start_date']).year > current_year
+
+    avg_adr_cy_ly = (metrics['avg_adr_cy'] + metrics['avg_adr_ly']) / 2
+
+    avg_occ = metrics['avg_occ_current']
+    if avg_occ < 60:
+        future_increment = 0.03
+    elif avg_occ < 80:
+        future_increment = 0.05
+    else:
+        future_increment = 0.07
+
+    future_adr = metrics['avg_adr_cy'] * (1 + future_increment)
+
+    scenarios = []
+
+    def add_scenario(variation, label, scenario_adr_lordo, scenario_adr_netto, addon_factor):
+        _, _, scenario_metrics = evaluate_request(
+            data, request, hotel_capacity, iva_rate, decision_params, dates,
+            adr_lordo=scenario_adr_lordo, addon_factor=addon_factor
+        )
+        scenarios.append({
+            "variation": variation,
+            "variation_label": label,
+            "adr_lordo": scenario_adr_lordo,
+            "adr_netto": scenario_adr_netto,
+            "total_impact": scenario_metrics['total_impact'],
+            "room_profit": scenario_metrics['room_profit'],
+            "total_rev_profit": scenario_metrics['total_rev_profit'],
+            "displaced_rooms": scenario_metrics['displaced_rooms'],
+            "should_accept": scenario_metrics['should_accept'],
+            "total_lordo": scenario_metrics['total_lordo']
+        })
+
+    for variation in variations:
+        new_adr = adr_lordo * (1 + variation/100)
+        add_scenario(variation, f"{variation:+d}%", new_adr, new_adr / (1 + iva_rate), 1 + variation/100)
+
+    if not is_future_year:
+        add_scenario(((avg_adr_cy_ly / adr_netto) - 1) * 100, "Media CY/LY",
+                     avg_adr_cy_ly * (1 + iva_rate), avg_adr_cy_ly, avg_adr_cy_ly / adr_netto)
+    else:
+        add_scenario(((future_adr / adr_netto) - 1) * 100, f"+{future_increment*100:.0f}% (Anno Successivo)",
+                     future_adr * (1 + iva_rate), future_adr, future_adr / adr_netto)
+
+    return scenarios
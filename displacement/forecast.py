@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+
+from displacement.dates import holiday_mask, same_day_last_year_index
+
+FORECAST_METHODS = ["LY - OTB", "Basato su LY", "Percentuale su OTB", "Valore assoluto", "Curva pickup"]
+
+# Limite inferiore (giorni prima dell'arrivo) di ogni fascia della curva di pickup
+LEAD_BUCKETS = np.array([0, 1, 4, 8, 15, 31, 61, 91, 181])
+LEAD_LABELS = ["0", "1-3", "4-7", "8-14", "15-30", "31-60", "61-90", "91-180", "181+"]
+
+
+def lead_bucket(lead_days):
+    lead_days = np.clip(np.asarray(lead_days, dtype=float), 0, None)
+    return np.searchsorted(LEAD_BUCKETS, lead_days, side='right') - 1
+
+
+def history_from_frame(df, as_of):
+    as_of = pd.Timestamp(as_of).normalize()
+    data = pd.to_datetime(df['data'])
+
+    if 'data_ly' in df.columns:
+        data_ly = pd.to_datetime(df['data_ly'])
+    else:
+        data_ly = pd.Series(same_day_last_year_index(data), index=df.index)
+
+    return pd.DataFrame({
+        'data': data_ly.values,
+        'lead': (data - as_of).dt.days.values,
+        'otb_rn': df['otb_ind_rn'].astype(float).values,
+        'final_rn': df['ly_ind_rn'].astype(float).values
+    })
+
+
+def history_from_ly(idv_cy_data, idv_ly_data, as_of):
+    if idv_cy_data is None or idv_ly_data is None:
+        return pd.DataFrame(columns=['data', 'lead', 'otb_rn', 'final_rn'])
+
+    cy = idv_cy_data.groupby('data', as_index=False)['otb_ind_rn'].sum()
+    ly = idv_ly_data.groupby('data', as_index=False)['ly_ind_rn'].sum().rename(columns={'data': 'data_ly'})
+
+    cy['data_ly'] = same_day_last_year_index(cy['data'])
+    aligned = pd.merge(cy, ly, on='data_ly', how='inner')
+
+    return history_from_frame(aligned, as_of)
+
+
+class PickupCurve:
+    def __init__(self, ratios, pickup, holiday_factor=1.0, observations=0):
+        self.ratios = ratios
+        self.pickup = pickup
+        self.holiday_factor = holiday_factor
+        self.observations = observations
+
+    @classmethod
+    def fit(cls, history):
+        n_buckets = len(LEAD_BUCKETS)
+        history = history.dropna(subset=['otb_rn', 'final_rn'])
+        history = history[history['lead'] >= 0]
+
+        if history.empty:
+            return cls(np.ones((7, n_buckets)), np.zeros((7, n_buckets)))
+
+        dates = pd.DatetimeIndex(history['data'])
+        dow = dates.dayofweek.values
+        bucket = lead_bucket(history['lead'].values)
+        festivo = holiday_mask(dates)
+        otb = history['otb_rn'].values
+        final = history['final_rn'].values
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(otb > 0, final / otb, np.nan)
+
+        holiday_factor = 1.0
+        if festivo.any() and (~festivo).any():
+            ratio_festivo = np.nanmedian(ratio[festivo]) if np.isfinite(ratio[festivo]).any() else np.nan
+            ratio_feriale = np.nanmedian(ratio[~festivo]) if np.isfinite(ratio[~festivo]).any() else np.nan
+            if np.isfinite(ratio_festivo) and np.isfinite(ratio_feriale) and ratio_feriale > 0:
+                holiday_factor = float(ratio_festivo / ratio_feriale)
+
+        adjustment = np.where(festivo, holiday_factor, 1.0)
+
+        cells = pd.DataFrame({
+            'dow': dow,
+            'bucket': bucket,
+            'ratio': ratio / adjustment,
+            'pickup': final / adjustment - otb
+        })
+
+        ratios = cls._cell_medians(cells, 'ratio', n_buckets, default=1.0)
+        pickup = cls._cell_medians(cells, 'pickup', n_buckets, default=0.0)
+
+        return cls(ratios, pickup, holiday_factor, observations=len(cells))
+
+    @staticmethod
+    def _cell_medians(cells, column, n_buckets, default):
+        valid = cells.dropna(subset=[column])
+        matrix = np.full((7, n_buckets), np.nan)
+
+        if valid.empty:
+            matrix[:] = default
+            return matrix
+
+        by_cell = valid.groupby(['dow', 'bucket'])[column].median()
+        matrix[by_cell.index.get_level_values('dow'), by_cell.index.get_level_values('bucket')] = by_cell.values
+
+        by_bucket = valid.groupby('bucket')[column].median().reindex(range(n_buckets))
+        by_bucket = by_bucket.fillna(valid[column].median()).values
+
+        return np.where(np.isnan(matrix), by_bucket[np.newaxis, :], matrix)
+
+    def forecast(self, df, as_of):
+        as_of = pd.Timestamp(as_of).normalize()
+        dates = pd.DatetimeIndex(df['data'])
+        lead = (dates - as_of).days.values
+
+        dow = dates.dayofweek.values
+        bucket = lead_bucket(lead)
+        festivo = holiday_mask(dates)
+        otb = df['otb_ind_rn'].astype(float).values
+
+        total = np.where(otb > 0, otb * self.ratios[dow, bucket], otb + self.pickup[dow, bucket])
+        total = total * np.where(festivo, self.holiday_factor, 1.0)
+
+        remaining = np.where(lead < 0, 0, np.ceil(np.clip(total - otb, 0, None)))
+        return pd.Series(remaining, index=df.index)
+
+    def to_frame(self):
+        days = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+        return pd.DataFrame(self.ratios, index=days, columns=LEAD_LABELS)
+
+
+def forecast_ind_rn(df, method, pickup_factor=1.0, pickup_percentage=20, pickup_value=10, curve=None, as_of=None):
+    if method == "Basato su LY":
+        return np.ceil(df['ly_ind_rn'] * pickup_factor)
+    elif method == "Percentuale su OTB":
+        return np.ceil(df['otb_ind_rn'] * (1 + pickup_percentage/100))
+    elif method == "Valore assoluto":
+        return df['otb_ind_rn'] + pickup_value
+    elif method == "Curva pickup":
+        if as_of is None:
+            as_of = pd.Timestamp.today()
+        if curve is None:
+            curve = PickupCurve.fit(history_from_frame(df, as_of))
+        return curve.forecast(df, as_of)
+    else:
+        return (df['ly_ind_rn'] - df['otb_ind_rn']).clip(lower=0)
@@ -0,0 +1,357 @@
+import argparse
+import json
+import math
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from displacement.dates import same_day_last_year, same_day_last_year_index
+from displacement.engine import adr_scenarios, build_analysis_frame, evaluate_request, prepare_segments
+from displacement.graph import build_analysis_graph
+from displacement.importer import import_excel_files
+from displacement.options import option_blocks
+from displacement.synthetic import pms_export
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden_expected.json")
+REL_TOLERANCE = 1e-9
+ABS_TOLERANCE = 1e-6
+
+# Tutte le colonne giornaliere prodotte dall'analisi, incluse quelle non mostrate nell'interfaccia
+DAILY_COLUMNS = ['data', 'giorno', 'data_ly', 'giorno_ly', 'otb_ind_rn', 'otb_ind_adr', 'ly_ind_rn', 'ly_ind_adr',
+                 'grp_otb_rn', 'grp_otb_adr', 'grp_opz_rn', 'grp_opz_adr', 'fcst_ind_rn', 'fcst_ind_adr',
+                 'otb_ind_rev', 'ly_ind_rev', 'grp_otb_rev', 'grp_opz_rev', 'fcst_ind_rev', 'finale_rn',
+                 'finale_opz_rn', 'finale_rev', 'finale_adr', 'camere_gruppo', 'adr_gruppo_lordo', 'adr_gruppo_netto',
+                 'revenue_camere_gruppo', 'revenue_fb_gruppo', 'revenue_meeting_gruppo', 'revenue_other_gruppo',
+                 'revenue_ancillare_gruppo', 'revenue_totale_gruppo', 'camere_disponibili', 'camere_displaced',
+                 'camere_gruppo_accettate', 'revenue_displaced', 'revenue_camere_gruppo_effettivo',
+                 'impatto_revenue_camera', 'impatto_revenue_totale', 'occupazione_attuale', 'occupazione_con_gruppo',
+                 'avg_adr_cy', 'avg_adr_ly', 'extra_vs_ly']
+
+METRIC_KEYS = ['revenue_displaced', 'group_room_revenue', 'group_ancillary', 'total_impact', 'total_lordo',
+               'needs_authorization', 'should_accept', 'current_adr_lordo', 'current_adr_netto', 'avg_adr_cy',
+               'avg_adr_ly', 'extra_vs_ly', 'total_group_rooms', 'accepted_rooms', 'displaced_rooms', 'avg_occ_current',
+               'avg_occ_with_group', 'room_profit', 'total_rev_profit', 'profit_per_room']
+
+ROOM_TYPES = [
+    {"tipo": "ROH", "numero": 18, "adr_addon": 0.0},
+    {"tipo": "DUS", "numero": 6, "adr_addon": 35.0},
+    {"tipo": "Suite", "numero": 2, "adr_addon": 120.0}
+]
+
+GOLDEN_CASES = [
+    {'name': "roh_ly_otb", 'start': "2025-06-10", 'nights': 7, 'num_rooms': 30, 'occupancy': 0.55},
+    {'name': "roh_displacement", 'start': "2025-09-18", 'nights': 5, 'num_rooms': 40, 'occupancy': 0.85},
+    {'name': "roh_basato_su_ly", 'start': "2025-05-02", 'nights': 4, 'num_rooms': 25, 'occupancy': 0.7,
+     'forecast_method': "Basato su LY", 'pickup_factor': 1.1},
+    {'name': "roh_percentuale_otb", 'start': "2025-05-02", 'nights': 4, 'num_rooms': 25, 'occupancy': 0.7,
+     'forecast_method': "Percentuale su OTB", 'pickup_percentage': 25},
+    {'name': "roh_valore_assoluto", 'start': "2025-05-02", 'nights': 4, 'num_rooms': 25, 'occupancy': 0.7,
+     'forecast_method': "Valore assoluto", 'pickup_value': 8},
+    {'name': "roh_curva_pickup", 'start': "2025-10-06", 'nights': 6, 'num_rooms': 20, 'occupancy': 0.6,
+     'forecast_method': "Curva pickup"},
+    {'name': "variable_rooms", 'start': "2025-07-14", 'nights': 6, 'room_config': "Camere variabili per giorno",
+     'rooms': [10, 25, 40, 40, 25, 5], 'occupancy': 0.75},
+    {'name': "multiple_types", 'start': "2025-11-03", 'nights': 3, 'room_config': "Tipologie multiple",
+     'occupancy': 0.8, 'fb_revenue': 2400.0, 'meeting_revenue': 900.0},
+    {'name': "leap_year_cy", 'start': "2024-02-26", 'nights': 6, 'num_rooms': 30, 'occupancy': 0.65},
+    {'name': "leap_year_ly", 'start': "2025-02-26", 'nights': 6, 'num_rooms': 30, 'occupancy': 0.65},
+    {'name': "leap_day_2028", 'start': "2028-02-27", 'nights': 4, 'num_rooms': 35, 'occupancy': 0.9,
+     'current_year': 2026},
+    {'name': "subset_dates", 'start': "2025-04-22", 'nights': 5, 'num_rooms': 45, 'occupancy': 0.8,
+     'exclude_nights': [1, 3]}
+]
+
+# Export gruppi con camere opzionate: il file OPZ viene prima, così una classificazione sbagliata
+# sovrascriverebbe i confermati. Nomi senza stato (primo caso) o filtri senza stato (secondo caso)
+IMPORT_CASES = [
+    {'name': "opzioni_stato_nei_filtri", 'otb': ("gruppi_b.xlsx", "Confermata"), 'opz': ("gruppi_a.xlsx", "Opzionata")},
+    {'name': "opzioni_stato_nel_nome", 'otb': ("GRP_OTB.xlsx", None), 'opz': ("GRP_OPZ.xlsx", None)}
+]
+
+
+def case_segments(case, capacity=66):
+    seed = sum(ord(char) for char in case['name'])
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(case['start'])
+    nights = case['nights']
+
+    cy_dates = pd.date_range(start - pd.Timedelta(days=7), start + pd.Timedelta(days=nights + 7))
+    ly_dates = pd.date_range(same_day_last_year(cy_dates[0]) - pd.Timedelta(days=7), periods=len(cy_dates) + 14)
+
+    def segment(dates, level, adr_low, adr_high):
+        return pd.DataFrame({
+            'data': dates,
+            'Room nights': np.round(level * capacity * rng.uniform(0.7, 1.1, len(dates))),
+            'ADR Cam': np.round(rng.uniform(adr_low, adr_high, len(dates)), 2)
+        })
+
+    occupancy = case['occupancy']
+    return {
+        'idv_cy': segment(cy_dates, occupancy * 0.6, 120, 260),
+        'idv_ly': segment(ly_dates, occupancy, 110, 240),
+        'grp_otb': segment(cy_dates, 0.1, 90, 150),
+        'grp_opz': segment(cy_dates, 0.05, 90, 150)
+    }
+
+
+def case_request(case):
+    start = pd.Timestamp(case['start'])
+    nights = case['nights']
+    date_range = pd.date_range(start, periods=nights)
+
+    request = {
+        'room_config': case.get('room_config', "Contingente fisso ROH"),
+        'start_date': start,
+        'end_date': start + pd.Timedelta(days=nights),
+        'num_rooms': case.get('num_rooms', 0),
+        'adr_lordo': case.get('adr_lordo', 175.0),
+        'fb_revenue': case.get('fb_revenue', 1200.0),
+        'meeting_revenue': case.get('meeting_revenue', 0.0),
+        'other_revenue': case.get('other_revenue', 150.0)
+    }
+    if 'rooms' in case:
+        request['rooms_data'] = pd.DataFrame({'data': date_range, 'camere': case['rooms']})
+    if request['room_config'] == "Tipologie multiple":
+        request['room_types'] = ROOM_TYPES
+
+    dates = None
+    if 'exclude_nights' in case:
+        dates = date_range.delete(case['exclude_nights'])
+
+    return date_range, request, dates
+
+
+def case_inputs(case, capacity=66):
+    raw = case_segments(case, capacity)
+    date_range, request, dates = case_request(case)
+    start = date_range[0]
+
+    segments = prepare_segments(raw['idv_cy'], raw['idv_ly'], raw['grp_otb'], raw['grp_opz'])
+
+    data = build_analysis_frame(
+        segments,
+        date_range,
+        case.get('forecast_method', "LY - OTB"),
+        pickup_factor=case.get('pickup_factor', 1.0),
+        pickup_percentage=case.get('pickup_percentage', 20),
+        pickup_value=case.get('pickup_value', 10),
+        as_of=start - pd.Timedelta(days=30)
+    )
+
+    return data, request, dates
+
+
+def engine_request(data, request, hotel_capacity, iva_rate, dates=None):
+    _, result_df, metrics = evaluate_request(data, request, hotel_capacity, iva_rate, dates=dates)
+    return result_df, metrics
+
+
+def graph_engine(data, request, hotel_capacity, iva_rate, dates=None):
+    graph = build_analysis_graph()
+    graph.input('data', data)
+    graph.input('request', request)
+    graph.input('hotel_capacity', hotel_capacity)
+    graph.input('iva_rate', iva_rate)
+    graph.input('adr_netto', None)
+    graph.input('dates', dates)
+    return graph.get('result'), graph.get('metrics')
+
+
+ENGINES = {
+    'engine': engine_request,
+    'graph': graph_engine
+}
+
+
+def register_engine(name, engine):
+    ENGINES[name] = engine
+
+
+def _plain(value):
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).strftime('%Y-%m-%d')
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+    return value
+
+
+def run_case(case, engine='engine', capacity=66, iva_rate=0.1):
+    data, request, dates = case_inputs(case, capacity)
+    result_df, metrics = ENGINES[engine](data, request, capacity, iva_rate, dates=dates)
+
+    scenarios = adr_scenarios(data, request, capacity, iva_rate, metrics, dates=dates,
+                              current_year=case.get('current_year', 2025))
+
+    ly_scalar = [same_day_last_year(day) for day in data['data']]
+    ly_vector = list(same_day_last_year_index(data['data']))
+
+    return {
+        'metrics': {key: _plain(metrics[key]) for key in METRIC_KEYS},
+        'daily': {column: [_plain(value) for value in result_df[column]] for column in DAILY_COLUMNS},
+        'scenarios': {scenario['variation_label']: _plain(scenario['total_rev_profit']) for scenario in scenarios},
+        'ly_alignment': {
+            'scalare': [_plain(day) for day in ly_scalar],
+            'vettoriale': [_plain(day) for day in ly_vector]
+        }
+    }
+
+
+def import_case_files(case, capacity=66):
+    rng = np.random.default_rng(sum(ord(char) for char in case['name']))
+    dates = pd.date_range("2025-05-01", periods=60)
+    otb_rn = np.where(rng.random(len(dates)) < 0.3, rng.integers(5, 25, len(dates)), 0).astype(float)
+    opz_rn = np.zeros(len(dates))
+    opz_rn[10:14] = 12
+    opz_rn[40:43] = 8
+
+    (otb_name, otb_status), (opz_name, opz_status) = case['otb'], case['opz']
+    files = [
+        (opz_name, pms_export("GRP", 2025, dates, opz_rn, rng.uniform(110, 200, len(dates)), capacity, status=opz_status)),
+        (otb_name, pms_export("GRP", 2025, dates, otb_rn, rng.uniform(110, 200, len(dates)), capacity, status=otb_status))
+    ]
+    return files, otb_rn, opz_rn
+
+
+def check_import_case(case):
+    files, otb_rn, opz_rn = import_case_files(case)
+    imported, messages, _ = import_excel_files(files, current_year=2025, use_processes=False)
+
+    differences = [f"messaggio {level}: {text}" for level, text in messages if level != 'success']
+    for key, expected in [('grp_otb', otb_rn), ('grp_opz', opz_rn)]:
+        if imported[key] is None:
+            differences.append(f"{key}: mancante")
+        elif not math.isclose(imported[key]['Room nights'].sum(), expected.sum()):
+            differences.append(f"{key}: {imported[key]['Room nights'].sum():g} camere invece di {expected.sum():g}")
+
+    if imported['grp_opz'] is not None:
+        blocks = option_blocks(imported['grp_opz'].rename(columns={'Room nights': 'grp_opz_rn', 'ADR Cam': 'grp_opz_adr'}))
+        if blocks['blocco'].nunique() != 2:
+            differences.append(f"blocchi opzione: {blocks['blocco'].nunique()} invece di 2")
+    return differences
+
+
+def check_imports():
+    differences = {}
+    for case in IMPORT_CASES:
+        case_differences = check_import_case(case)
+        if case_differences:
+            differences[case['name']] = case_differences
+    return differences
+
+
+def freeze(path=GOLDEN_PATH, engine='engine'):
+    # Gli output attesi esistenti (congelati dal calcolo originale di app.py) non vengono mai riscritti:
+    # il motore corrente congela solo i casi nuovi
+    expected = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            expected = json.load(f)
+    added = [case for case in GOLDEN_CASES if case['name'] not in expected]
+    for case in added:
+        expected[case['name']] = run_case(case, engine)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(expected, f, indent=1, ensure_ascii=False, sort_keys=True)
+    return added
+
+
+def _differences(expected, actual, prefix=""):
+    if isinstance(expected, dict):
+        differences = []
+        for key in sorted(set(expected) | set(actual if isinstance(actual, dict) else {})):
+            if not isinstance(actual, dict) or key not in actual:
+                differences.append(f"{prefix}{key}: mancante")
+            elif key not in expected:
+                differences.append(f"{prefix}{key}: non previsto")
+            else:
+                differences.extend(_differences(expected[key], actual[key], f"{prefix}{key}."))
+        return differences
+
+    if isinstance(expected, list):
+        if not isinstance(actual, list) or len(expected) != len(actual):
+            return [f"{prefix.rstrip('.')}: lunghezza {len(actual) if isinstance(actual, list) else '-'} invece di {len(expected)}"]
+        differences = []
+        for index, (expected_item, actual_item) in enumerate(zip(expected, actual)):
+            differences.extend(_differences(expected_item, actual_item, f"{prefix}{index}."))
+        return differences
+
+    if isinstance(expected, float) and not isinstance(actual, bool) and isinstance(actual, (int, float)):
+        if math.isnan(expected) and math.isnan(actual):
+            return []
+        if math.isclose(expected, actual, rel_tol=REL_TOLERANCE, abs_tol=ABS_TOLERANCE):
+            return []
+    elif expected == actual:
+        return []
+
+    return [f"{prefix.rstrip('.')}: {actual!r} invece di {expected!r}"]
+
+
+def check(engine='engine', path=GOLDEN_PATH):
+    with open(path, encoding="utf-8") as f:
+        expected = json.load(f)
+
+    differences = {}
+    for case in GOLDEN_CASES:
+        if case['name'] not in expected:
+            differences[case['name']] = ["caso non presente nel file golden"]
+            continue
+        actual = run_case(case, engine)
+        case_differences = _differences(expected[case['name']], actual)
+        if case_differences:
+            differences[case['name']] = case_differences
+
+    return differences
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m displacement.golden",
+        description="Verifica dei risultati del motore di displacement rispetto agli output golden congelati"
+    )
+    parser.add_argument("command", choices=["check", "freeze"])
+    parser.add_argument("--engine", default="all", help=f"Motore da verificare ({', '.join(ENGINES)} o all)")
+    parser.add_argument("--path", default=GOLDEN_PATH, help="File JSON con gli output attesi")
+    args = parser.parse_args(argv)
+
+    if args.command == "freeze":
+        engine = "engine" if args.engine == "all" else args.engine
+        added = freeze(args.path, engine)
+        print(f"{len(added)} casi nuovi congelati con il motore {engine} in {args.path}")
+        return 0
+
+    engines = list(ENGINES) if args.engine == "all" else [args.engine]
+    failed = False
+    for engine in engines:
+        differences = check(engine, args.path)
+        if differences:
+            failed = True
+            print(f"[{engine}] {len(differences)} casi su {len(GOLDEN_CASES)} diversi dagli output golden:")
+            for name, case_differences in differences.items():
+                print(f"  {name}:")
+                for difference in case_differences[:10]:
+                    print(f"    {difference}")
+                if len(case_differences) > 10:
+                    print(f"    ... altre {len(case_differences) - 10} differenze")
+        else:
+            print(f"[{engine}] {len(GOLDEN_CASES)} casi identici agli output golden")
+
+    if args.engine == "all":
+        differences = check_imports()
+        if differences:
+            failed = True
+            print(f"[import] {len(differences)} casi su {len(IMPORT_CASES)} con ruoli dei file gruppi errati:")
+            for name, case_differences in differences.items():
+                print(f"  {name}:")
+                for difference in case_differences:
+                    print(f"    {difference}")
+        else:
+            print(f"[import] {len(IMPORT_CASES)} casi con gruppi confermati e opzionati riconosciuti")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import hashlib
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from displacement.engine import ExcelCompatibleDisplacementAnalyzer, adr_scenarios, filter_analysis_dates
+from displacement.report import generate_excel_report
+
+
+def fingerprint(value):
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        try:
+            # Digest dei bytes riga per riga: una somma degli hash non cambierebbe scambiando l'ordine delle righe
+            hashes = pd.util.hash_pandas_object(value, index=not isinstance(value, pd.Index))
+        except TypeError:
+            return ('id', id(value))
+        hashed = hashlib.sha1(hashes.to_numpy().tobytes()).hexdigest()
+        if isinstance(value, pd.DataFrame):
+            columns = tuple(zip(value.columns, map(str, value.dtypes)))
+        else:
+            columns = (value.name, str(value.dtype))
+        return (type(value).__name__, columns, len(value), hashed)
+    if isinstance(value, np.ndarray):
+        return ('ndarray', value.shape, str(value.dtype), hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest())
+    if isinstance(value, dict):
+        return ('dict', tuple((key, fingerprint(item)) for key, item in sorted(value.items(), key=lambda kv: str(kv[0]))))
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(fingerprint(item) for item in value))
+    if isinstance(value, (float, np.floating)) and np.isnan(value):
+        return 'nan'
+    if value is None or isinstance(value, (str, int, float, bool, np.generic, date, datetime, pd.Timestamp)):
+        return value
+    # Oggetti non confrontabili (es. figure Plotly): considerati sempre cambiati
+    return ('id', id(value))
+
+
+class ComputationGraph:
+    def __init__(self, diagnostics=None):
+        self.diagnostics = diagnostics
+        self._functions = {}
+        self._dependencies = {}
+        self._values = {}
+        self._fingerprints = {}
+        self._versions = {}
+        self._computed_with = {}
+        self.computations = {}
+
+    def node(self, name, function, dependencies):
+        self._functions[name] = function
+        self._dependencies[name] = list(dependencies)
+        return self
+
+    def input(self, name, value):
+        value_fingerprint = fingerprint(value)
+        if name in self._fingerprints and self._fingerprints[name] == value_fingerprint:
+            # Dopo release() il valore torna senza cambiare versione: i nodi a valle restano validi
+            self._values.setdefault(name, value)
+            return False
+        self._values[name] = value
+        self._fingerprints[name] = value_fingerprint
+        self._versions[name] = self._versions.get(name, 0) + 1
+        return True
+
+    def get(self, name):
+        if name not in self._functions:
+            if name not in self._values:
+                raise KeyError(f"Input del grafo non impostato: {name}")
+            return self._values[name]
+
+        arguments = [self.get(dependency) for dependency in self._dependencies[name]]
+        versions = tuple(self._versions[dependency] for dependency in self._dependencies[name])
+        if self._computed_with.get(name) == versions and name in self._values:
+            return self._values[name]
+
+        started = time.perf_counter()
+        value = self._functions[name](*arguments)
+        elapsed = time.perf_counter() - started
+
+        self._computed_with[name] = versions
+        self.computations[name] = self.computations.get(name, 0) + 1
+        if self.diagnostics is not None:
+            self.diagnostics.record_timing(f"grafo: {name}", elapsed, rows=len(value) if isinstance(value, pd.DataFrame) else None)
+
+        # Early cutoff: se il risultato non cambia, i nodi a valle restano validi
+        value_fingerprint = fingerprint(value)
+        if name not in self._fingerprints or self._fingerprints[name] != value_fingerprint:
+            self._fingerprints[name] = value_fingerprint
+            self._versions[name] = self._versions.get(name, 0) + 1
+        self._values[name] = value
+        return value
+
+    def invalidate(self, name=None):
+        names = list(self._functions) if name is None else [name]
+        for node in names:
+            self._computed_with.pop(node, None)
+
+    def release(self):
+        # Libera la memoria dei valori mantenendo impronte e versioni: al prossimo get() si ricalcola solo ciò che serve
+        self._values.clear()
+
+    def stats(self):
+        return pd.DataFrame([
+            {'nodo': name, 'dipendenze': ", ".join(self._dependencies[name]),
+             'ricalcoli': self.computations.get(name, 0), 'versione': self._versions.get(name, 0)}
+            for name in self._functions
+        ])
+
+
+def _analyzer(data, hotel_capacity=None, iva_rate=0.1):
+    return ExcelCompatibleDisplacementAnalyzer(hotel_capacity=hotel_capacity, iva_rate=iva_rate).set_data(data)
+
+
+def _group(request, hotel_capacity, iva_rate, adr_netto):
+    return _analyzer(None, hotel_capacity, iva_rate).set_request(request, adr_netto=adr_netto).group_request
+
+
+def _detail_figure(result_df, metrics, hotel_capacity, events):
+    # Plotly viene importato solo quando un grafico viene effettivamente richiesto
+    from displacement.charts import create_detail_figure
+    if events is not None and events.empty:
+        events = None
+    return create_detail_figure(result_df, metrics, hotel_capacity, events)
+
+
+def _summary_figure(metrics):
+    from displacement.charts import create_summary_figure
+    return create_summary_figure(metrics)
+
+
+def build_analysis_graph(diagnostics=None):
+    graph = ComputationGraph(diagnostics)
+
+    # Richiesta → displacement camere → revenue → metriche → grafici / scenari / report
+    graph.node('group', _group, ['request', 'hotel_capacity', 'iva_rate', 'adr_netto'])
+    graph.node('group_rooms', lambda group: group[['data', 'camere_gruppo']], ['group'])
+    graph.node('rooms', lambda data, group_rooms, hotel_capacity:
+               _analyzer(data, hotel_capacity).analyze_rooms(group_rooms),
+               ['data', 'group_rooms', 'hotel_capacity'])
+    graph.node('displacement', lambda data, rooms, group: _analyzer(data).analyze_revenue(rooms, group),
+               ['data', 'rooms', 'group'])
+    graph.node('result', filter_analysis_dates, ['displacement', 'dates'])
+    graph.node('metrics', lambda result_df, iva_rate: _analyzer(None, iva_rate=iva_rate).get_summary_metrics(result_df),
+               ['result', 'iva_rate'])
+    graph.node('counter_offer', lambda result_df, hotel_capacity: _analyzer(None, hotel_capacity).optimal_block(result_df),
+               ['result', 'hotel_capacity'])
+    graph.node('counter_metrics', lambda counter_offer, iva_rate:
+               _analyzer(None, iva_rate=iva_rate).get_summary_metrics(counter_offer),
+               ['counter_offer', 'iva_rate'])
+    graph.node('detail_figure', _detail_figure, ['result', 'metrics', 'hotel_capacity', 'events'])
+    graph.node('summary_figure', _summary_figure, ['metrics'])
+    graph.node('scenarios', lambda data, request, hotel_capacity, iva_rate, metrics, decision_params, dates:
+               adr_scenarios(data, request, hotel_capacity, iva_rate, metrics, decision_params=decision_params, dates=dates),
+               ['data', 'request', 'hotel_capacity', 'iva_rate', 'metrics', 'decision_params', 'dates'])
+    graph.node('report', generate_excel_report, ['result', 'metrics', 'group_info', 'hotel_info', 'author'])
+
+    return graph
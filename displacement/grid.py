@@ -0,0 +1,145 @@
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from displacement.engine import (ADR_VARIATIONS, ExcelCompatibleDisplacementAnalyzer, build_analysis_frame,
+                                 filter_analysis_dates, floor_adr)
+from displacement.forecast import FORECAST_METHODS, forecast_ind_rn
+
+# Parametro che ogni metodo di forecast usa davvero: variare gli altri non cambierebbe il risultato
+METHOD_PARAMETERS = {
+    "Basato su LY": 'pickup_factor',
+    "Percentuale su OTB": 'pickup_percentage',
+    "Valore assoluto": 'pickup_value'
+}
+# Celle (forecast x capacità x date) calcolate in una sola operazione vettoriale
+BATCH_CELLS = 2_000_000
+
+GRID_COLUMNS = ['metodo_forecast', 'parametro_forecast', 'capacita', 'adr_lordo', 'adr_netto', 'camere_gruppo',
+                'camere_displaced', 'revenue_displaced', 'revenue_camere_gruppo', 'revenue_ancillare', 'impatto',
+                'totale_lordo', 'adr_minimo_lordo', 'accetta']
+
+_worker_state = {}
+
+
+def forecast_settings(methods=FORECAST_METHODS, pickup_factors=(1.0,), pickup_percentages=(20,), pickup_values=(10,)):
+    values = {'pickup_factor': pickup_factors, 'pickup_percentage': pickup_percentages, 'pickup_value': pickup_values}
+
+    settings = []
+    for method in methods:
+        if method not in FORECAST_METHODS:
+            raise ValueError(f"Metodo di forecast non supportato: {method}")
+        parameter = METHOD_PARAMETERS.get(method)
+        for value in (values[parameter] if parameter else [None]):
+            setting = {'forecast_method': method}
+            if parameter:
+                setting[parameter] = value
+            settings.append(setting)
+    return settings
+
+
+def _init_worker(state):
+    _worker_state.update(state)
+
+
+def _grid_batch(fcst):
+    # fcst: (forecast, date) -> camere e revenue displaced per (forecast, capacità)
+    otb_rn = _worker_state['otb_ind_rn']
+    otb_adr = _worker_state['otb_ind_adr']
+    grp_otb_rn = _worker_state['grp_otb_rn']
+
+    # Stesse operazioni di finale_columns, in colonna per ogni forecast
+    finale_rn = fcst + otb_rn + grp_otb_rn
+    finale_rev = otb_rn * otb_adr + fcst * otb_adr + grp_otb_rn * _worker_state['grp_otb_adr']
+    finale_adr = np.divide(finale_rev, finale_rn, out=np.zeros(finale_rn.shape), where=finale_rn > 0)
+
+    capacities = _worker_state['capacities'][None, :, None]
+    displaced = np.maximum(0, finale_rn[:, None, :] + _worker_state['rooms'] - capacities)
+    return displaced.sum(axis=2), (displaced * finale_adr[:, None, :]).sum(axis=2)
+
+
+def scenario_grid(segments, request, capacities, adr_levels=None, forecasts=None, iva_rate=0.1, curve=None,
+                  as_of=None, dates=None, workers=None):
+    # Cubo ordinato forecast x capacità x ADR: il displacement non dipende dall'ADR del gruppo, quindi si calcola
+    # una volta per (forecast, capacità) e l'asse ADR si aggiunge per somma
+    if forecasts is None:
+        forecasts = forecast_settings()
+    if adr_levels is None:
+        adr_levels = [request['adr_lordo'] * (1 + variation / 100) for variation in ADR_VARIATIONS]
+    capacities = np.asarray(capacities, dtype=float)
+    adr_levels = np.asarray(adr_levels, dtype=float)
+    if not len(forecasts) or not len(capacities) or not len(adr_levels):
+        return pd.DataFrame(columns=GRID_COLUMNS)
+
+    analyzer = ExcelCompatibleDisplacementAnalyzer(hotel_capacity=0, iva_rate=iva_rate)
+    groups = []
+    for adr_lordo in adr_levels:
+        addon_factor = adr_lordo / request['adr_lordo'] if request['adr_lordo'] else None
+        analyzer.set_request(request, adr_lordo=adr_lordo, addon_factor=addon_factor)
+        groups.append(filter_analysis_dates(analyzer.group_request, dates))
+    group = groups[0]
+
+    if as_of is None:
+        as_of = pd.Timestamp.today().normalize()
+    # Unione dei segmenti una sola volta: per ogni forecast cambia solo fcst_ind_rn. Il forecast copre tutte le
+    # notti richieste (la curva pickup senza storico si stima su queste), poi restano solo le date analizzate
+    days = build_analysis_frame(segments, analyzer.group_request['data'], curve=curve, as_of=as_of)
+    fcst = np.array([forecast_ind_rn(days, setting['forecast_method'], curve=curve, as_of=as_of,
+                                     **{key: value for key, value in setting.items() if key != 'forecast_method'})
+                     for setting in forecasts], dtype=float)
+    analyzed = days['data'].isin(group['data']).to_numpy()
+    days = days[analyzed]
+    fcst = fcst[:, analyzed]
+
+    state = {column: days[column].to_numpy(dtype=float) for column in ['otb_ind_rn', 'otb_ind_adr', 'grp_otb_rn',
+                                                                        'grp_otb_adr']}
+    state['rooms'] = group['camere_gruppo'].to_numpy(dtype=float)
+    state['capacities'] = capacities
+
+    per_batch = max(1, BATCH_CELLS // max(1, len(capacities) * len(group)))
+    batches = [fcst[start:start + per_batch] for start in range(0, len(fcst), per_batch)]
+    workers = min(workers or 1, len(batches))
+    if workers > 1:
+        context = multiprocessing.get_context("fork") if sys.platform.startswith("linux") else None
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(state,)) as executor:
+            results = list(executor.map(_grid_batch, batches))
+    else:
+        _init_worker(state)
+        results = [_grid_batch(batch) for batch in batches]
+    displaced = np.concatenate([result[0] for result in results])
+    displaced_revenue = np.concatenate([result[1] for result in results])
+
+    total_rooms = state['rooms'].sum()
+    room_revenue = np.array([(g['camere_gruppo'] * g['adr_gruppo_netto']).sum() for g in groups])
+    ancillary = float(group['revenue_ancillare_gruppo'].sum())
+    impact = room_revenue[None, None, :] + ancillary - displaced_revenue[:, :, None]
+    if total_rooms > 0:
+        floor = floor_adr(displaced_revenue, ancillary, np.full(displaced_revenue.shape, total_rooms)) * (1 + iva_rate)
+    else:
+        floor = np.zeros(displaced_revenue.shape)
+
+    f, c, a = (axis.ravel() for axis in np.meshgrid(np.arange(len(forecasts)), np.arange(len(capacities)),
+                                                   np.arange(len(adr_levels)), indexing='ij'))
+    methods = np.array([setting['forecast_method'] for setting in forecasts], dtype=object)
+    parameters = np.array([setting.get(METHOD_PARAMETERS.get(setting['forecast_method']), np.nan)
+                           for setting in forecasts], dtype=float)
+    return pd.DataFrame({
+        'metodo_forecast': methods[f],
+        'parametro_forecast': parameters[f],
+        'capacita': capacities[c].astype(int),
+        'adr_lordo': adr_levels[a],
+        'adr_netto': np.array([g['adr_gruppo_netto'].mean() for g in groups])[a],
+        'camere_gruppo': total_rooms,
+        'camere_displaced': displaced[f, c],
+        'revenue_displaced': displaced_revenue[f, c],
+        'revenue_camere_gruppo': room_revenue[a],
+        'revenue_ancillare': ancillary,
+        'impatto': impact[f, c, a],
+        'totale_lordo': room_revenue[a] * (1 + iva_rate) + ancillary,
+        'adr_minimo_lordo': floor[f, c],
+        'accetta': impact[f, c, a] > 0
+    })[GRID_COLUMNS]
@@ -0,0 +1,386 @@
+import io
+import multiprocessing
+import os
+import queue
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime
+
+import pandas as pd
+
+from displacement.shared import content_digest
+
+IMPORT_STAGES = ["lettura", "intestazioni", "date", "aggregazione"]
+STAGE_LABELS = {
+    "in coda": "In coda",
+    "lettura": "Lettura file",
+    "intestazioni": "Riconoscimento intestazioni",
+    "date": "Parsing date",
+    "aggregazione": "Aggregazione valori",
+    "completato": "Completato",
+    "errore": "Errore"
+}
+
+DATE_COL_CANDIDATES = ['Giorno', 'Data', 'Date', 'day', 'date']
+NUMERIC_COLS = ['Room nights', 'Bed nights', 'ADR Cam', 'ADR Bed', 'Room Revenue', 'RevPar']
+
+_progress_queue = None
+
+
+def safe_date_conversion(date_val):
+    if pd.isna(date_val):
+        return pd.NaT
+
+    if isinstance(date_val, (datetime, date)):
+        return pd.to_datetime(date_val)
+
+    date_str = str(date_val)
+    date_only = re.search(r'(\d{2}/\d{2}/\d{4})', date_str)
+    if date_only:
+        try:
+            return pd.to_datetime(date_only.group(1), format='%d/%m/%Y')
+        except:
+            pass
+
+    formats = ['%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%m/%d/%Y']
+    for fmt in formats:
+        try:
+            return pd.to_datetime(date_str, format=fmt, errors='coerce')
+        except:
+            continue
+
+    return pd.NaT
+
+
+def find_filter_text(df):
+    for idx, row in df.iterrows():
+        row_str = ' '.join([str(val) for val in row.values if pd.notna(val)])
+        if 'Filtri applicati:' in row_str:
+            return row_str
+    return None
+
+
+def identify_excel_file_type(df, filter_text=None):
+    if filter_text is None:
+        filter_text = find_filter_text(df)
+
+    if filter_text is None:
+        return "UNKNOWN", None, None
+
+    year_match = re.search(r'(\d{4})\s+\(S_Esercizio\)', filter_text)
+    month_match = re.search(r'(\w+)\s+(\d{4})\s+\(S_Anno\s+Mese\)', filter_text)
+
+    year = year_match.group(1) if year_match else None
+    month_year = month_match.group(0).split('(')[0].strip() if month_match else None
+
+    if "Descrizione Mercato TOB non è Gruppi" in filter_text:
+        return "IDV", year, month_year
+    elif "Descrizione Mercato TOB è Gruppi" in filter_text:
+        return "GRP", year, month_year
+    else:
+        return "UNKNOWN", year, month_year
+
+
+def group_status(filter_text, file_name):
+    # Gruppi confermati (OTB) o opzionati (OPZ): prima dai filtri dell'export PMS, poi dal nome del file.
+    # Il totale delle camere non distingue: anche un export di opzioni ha camere sulle sue date
+    filters = (filter_text or "").lower()
+    if re.search(r'non\s+(è|e)\s+opzion', filters) or re.search(r'confermat|definitiv', filters):
+        return "OTB"
+    if re.search(r'opzion|option', filters):
+        return "OPZ"
+
+    name = os.path.splitext(os.path.basename(file_name or ""))[0].upper()
+    if re.search(r'(^|[^A-Z])(OPZ|OPZION|OPTION)', name):
+        return "OPZ"
+    if re.search(r'(^|[^A-Z])(OTB|CONF)', name):
+        return "OTB"
+    return None
+
+
+def parse_excel_file(file_name, content, progress=None):
+    def report(stage):
+        if progress is not None:
+            progress(stage)
+
+    parsed = {
+        'name': file_name,
+        'file_type': "UNKNOWN",
+        'year': None,
+        'month_year': None,
+        'filters': None,
+        'data': None,
+        'error': None,
+        'traceback': None
+    }
+
+    try:
+        report("lettura")
+        df = pd.read_excel(io.BytesIO(content))
+
+        report("intestazioni")
+        filter_text = find_filter_text(df)
+        file_type, year, month_year = identify_excel_file_type(df, filter_text)
+        parsed.update({'file_type': file_type, 'year': year, 'month_year': month_year, 'filters': filter_text})
+
+        data_rows = None
+        for candidate in DATE_COL_CANDIDATES:
+            mask = df.iloc[:, 0].astype(str).str.contains(candidate, case=False, na=False)
+            if mask.any():
+                data_rows = df[mask].index[0]
+                break
+
+        if data_rows is None:
+            parsed['error'] = f"Formato del file {file_name} non riconosciuto: nessuna colonna data trovata"
+            report("errore")
+            return parsed
+
+        headers = df.iloc[data_rows].values.tolist()
+
+        data_df = df.iloc[data_rows+1:].reset_index(drop=True)
+        data_df.columns = headers[:len(data_df.columns)]
+
+        date_column = None
+        for col in data_df.columns:
+            if isinstance(col, str) and any(candidate.lower() in col.lower() for candidate in DATE_COL_CANDIDATES):
+                date_column = col
+                break
+
+        if date_column is None:
+            date_column = data_df.columns[0]
+
+        data_df = data_df.rename(columns={date_column: 'Giorno'})
+
+        report("date")
+        data_df = data_df[~data_df['Giorno'].isna()]
+        data_df = data_df[~data_df['Giorno'].astype(str).str.contains('Filtri applicati:', na=False)]
+
+        data_df['Giorno'] = data_df['Giorno'].apply(safe_date_conversion)
+        data_df = data_df.dropna(subset=['Giorno'])
+
+        if len(data_df) == 0:
+            parsed['error'] = f"Il file {file_name} non contiene date valide dopo la pulizia"
+            report("errore")
+            return parsed
+
+        report("aggregazione")
+        for col in NUMERIC_COLS:
+            if col in data_df.columns:
+                data_df[col] = pd.to_numeric(data_df[col], errors='coerce').fillna(0)
+
+        data_df.rename(columns={'Giorno': 'data'}, inplace=True)
+        parsed['data'] = data_df
+        report("completato")
+
+    except Exception as e:
+        parsed['error'] = f"Errore nell'elaborazione del file {file_name}: {str(e)}"
+        parsed['traceback'] = traceback.format_exc()
+        report("errore")
+
+    return parsed
+
+
+def assign_import_roles(parsed_files, current_year=None):
+    if current_year is None:
+        current_year = datetime.now().year
+
+    imported = {'idv_cy': None, 'idv_ly': None, 'grp_otb': None, 'grp_opz': None}
+    messages = []
+    unclassified = []
+
+    for parsed in parsed_files:
+        if parsed['error'] is not None:
+            messages.append(('error', parsed['error']))
+            continue
+
+        data_df = parsed['data']
+        year = parsed['year']
+        month_year = parsed['month_year']
+
+        if parsed['file_type'] == "IDV":
+            if str(current_year) in str(year) or (month_year and str(current_year) in str(month_year)):
+                imported['idv_cy'] = data_df
+                messages.append(('success', f"File IDV Anno Corrente riconosciuto: {parsed['name']}"))
+            else:
+                imported['idv_ly'] = data_df
+                messages.append(('success', f"File IDV Anno Precedente riconosciuto: {parsed['name']}"))
+        elif parsed['file_type'] == "GRP":
+            status = group_status(parsed.get('filters'), parsed['name'])
+            if status == "OTB":
+                imported['grp_otb'] = data_df
+                messages.append(('success', f"File Gruppi Confermati riconosciuto: {parsed['name']}"))
+            elif status == "OPZ":
+                imported['grp_opz'] = data_df
+                messages.append(('success', f"File Gruppi Opzionati riconosciuto: {parsed['name']}"))
+            else:
+                unclassified.append(parsed)
+
+    # Export gruppi senza stato nei filtri né nel nome: occupano i ruoli rimasti liberi, prima i confermati
+    for parsed in unclassified:
+        if imported['grp_otb'] is None:
+            imported['grp_otb'] = parsed['data']
+            messages.append(('warning', f"File Gruppi senza stato prenotazione nei filtri o nel nome, "
+                                        f"considerato Gruppi Confermati: {parsed['name']}"))
+        elif imported['grp_opz'] is None:
+            imported['grp_opz'] = parsed['data']
+            messages.append(('warning', f"File Gruppi senza stato prenotazione nei filtri o nel nome, "
+                                        f"considerato Gruppi Opzionati: {parsed['name']}"))
+        else:
+            messages.append(('warning', f"File Gruppi ignorato, stato prenotazione non riconosciuto: {parsed['name']}"))
+
+    return imported, messages
+
+
+def _init_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def _parse_task(index, file_name, content, progress_queue=None):
+    if progress_queue is None:
+        progress_queue = _progress_queue
+
+    def progress(stage):
+        progress_queue.put((index, stage, time.time()))
+
+    return parse_excel_file(file_name, content, progress)
+
+
+class ImportJob:
+    def __init__(self, files, use_processes=None, max_workers=None, store=None):
+        self.files = [(name, content) for name, content in files]
+        self.file_names = [name for name, _ in self.files]
+        # Store condiviso tra sessioni: un file con lo stesso contenuto già elaborato non viene riletto
+        self.store = store
+        self.digests = [content_digest(content) if store is not None else None for _, content in self.files]
+        self.handles = {}
+        if use_processes is None:
+            use_processes = os.environ.get("DISPLACEMENT_IMPORT_EXECUTOR", "thread") == "process"
+        # Default a thread: il fork di un server multi-thread come Streamlit non è sicuro.
+        # Il pool di processi ("fork", solo Linux) resta disponibile su richiesta per i comandi a riga di comando
+        self.use_processes = use_processes and sys.platform.startswith("linux")
+        self.max_workers = max_workers or max(1, min(len(self.files), os.cpu_count() or 1))
+        self.stages = {index: "in coda" for index in range(len(self.files))}
+        self.events = []
+        self.started_at = None
+        self._executor = None
+        self._futures = []
+        self._queue = None
+
+    def start(self):
+        self.started_at = time.time()
+
+        if self.use_processes:
+            context = multiprocessing.get_context("fork")
+            self._queue = context.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(self._queue,)
+            )
+        else:
+            self._queue = queue.Queue()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        self._futures = []
+        for index, (name, content) in enumerate(self.files):
+            handle = self.store.acquire(self.digests[index]) if self.store is not None else None
+            if handle is not None:
+                self.handles[index] = handle
+                self.stages[index] = "completato"
+                future = Future()
+                future.set_result(dict(handle.value, name=name))
+            elif self.use_processes:
+                future = self._executor.submit(_parse_task, index, name, content)
+            else:
+                future = self._executor.submit(_parse_task, index, name, content, self._queue)
+            self._futures.append(future)
+
+        self._executor.shutdown(wait=False)
+        return self
+
+    def poll(self):
+        while True:
+            try:
+                index, stage, timestamp = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            except (EOFError, OSError):
+                break
+            self.stages[index] = stage
+            self.events.append({'file': self.file_names[index], 'stage': stage, 'time': timestamp})
+
+        for index, future in enumerate(self._futures):
+            if future.done() and self.stages[index] not in ("completato", "errore"):
+                self.stages[index] = "errore" if future.exception() is not None else "completato"
+
+        return self.stages
+
+    def done(self):
+        return self._executor is not None and all(future.done() for future in self._futures)
+
+    def wait(self, interval=0.05):
+        while not self.done():
+            self.poll()
+            time.sleep(interval)
+        return self.result()
+
+    def progress_frame(self):
+        self.poll()
+        rows = []
+        for index, name in enumerate(self.file_names):
+            stage = self.stages[index]
+            completed = len(IMPORT_STAGES) if stage in ("completato", "errore") else (
+                IMPORT_STAGES.index(stage) if stage in IMPORT_STAGES else 0)
+            rows.append({
+                'file': name,
+                'fase': STAGE_LABELS.get(stage, stage),
+                'avanzamento': completed / len(IMPORT_STAGES)
+            })
+        return pd.DataFrame(rows)
+
+    def stage_timings(self):
+        timings = []
+        last_event = {}
+        for event in self.events:
+            previous = last_event.get(event['file'])
+            if previous is not None:
+                timings.append((event['file'], previous['stage'], event['time'] - previous['time']))
+            last_event[event['file']] = event
+        return timings
+
+    def result(self):
+        parsed_files = []
+        for index, future in enumerate(self._futures):
+            try:
+                parsed_files.append(future.result())
+            except Exception as e:
+                parsed_files.append({
+                    'name': self.file_names[index],
+                    'file_type': "UNKNOWN",
+                    'year': None,
+                    'month_year': None,
+                    'data': None,
+                    'error': f"Errore nell'elaborazione del file {self.file_names[index]}: {str(e)}",
+                    'traceback': traceback.format_exc()
+                })
+        self.poll()
+
+        if self.store is not None:
+            for index, parsed in enumerate(parsed_files):
+                if index not in self.handles and parsed['error'] is None:
+                    shared = {key: value for key, value in parsed.items() if key != 'name'}
+                    self.handles[index] = self.store.put(self.digests[index], shared)
+                if index in self.handles:
+                    parsed_files[index] = dict(self.handles[index].value, name=parsed['name'])
+        return parsed_files
+
+
+def import_excel_files(files, current_year=None, use_processes=None, max_workers=None):
+    parsed_files = ImportJob(files, use_processes=use_processes, max_workers=max_workers).start().wait()
+    imported, messages = assign_import_roles(parsed_files, current_year)
+    return imported, messages, parsed_files
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+
+from displacement.dates import same_day_last_year_index
+from displacement.engine import finale_columns
+from displacement.forecast import forecast_ind_rn
+
+# Colonne mostrate da ciascun editor dell'inserimento manuale (chiave = key del widget)
+EDITOR_COLUMNS = {
+    'rn_cy': ['data', 'giorno', 'otb_ind_rn', 'grp_otb_rn', 'grp_opz_rn'],
+    'adr_cy': ['data', 'giorno', 'otb_ind_adr', 'grp_otb_adr', 'grp_opz_adr'],
+    'rn_ly': ['data_ly', 'giorno_ly', 'ly_ind_rn'],
+    'adr_ly': ['data_ly', 'giorno_ly', 'ly_ind_adr']
+}
+INPUT_COLUMNS = ['data', 'giorno', 'otb_ind_rn', 'grp_otb_rn', 'grp_opz_rn', 'data_ly', 'ly_ind_rn',
+                 'otb_ind_adr', 'grp_otb_adr', 'grp_opz_adr', 'ly_ind_adr']
+READ_ONLY_COLUMNS = ['data', 'giorno', 'data_ly', 'giorno_ly']
+
+
+class ManualInputs:
+    def __init__(self, date_range):
+        dates = pd.DatetimeIndex(date_range)
+        dates_ly = same_day_last_year_index(dates)
+        rooms = np.zeros(len(dates), dtype=int)
+        adr = np.zeros(len(dates))
+
+        self.date_range = dates
+        self.base = pd.DataFrame({
+            'data': dates,
+            'giorno': dates.strftime('%a'),
+            'data_ly': dates_ly,
+            'giorno_ly': dates_ly.strftime('%a'),
+            'otb_ind_rn': rooms,
+            'ly_ind_rn': rooms,
+            'grp_otb_rn': rooms,
+            'grp_opz_rn': rooms,
+            'otb_ind_adr': adr,
+            'ly_ind_adr': adr,
+            'grp_otb_adr': adr,
+            'grp_opz_adr': adr
+        })
+        # Viste fisse passate agli editor: restano gli stessi oggetti tra un rerun e l'altro
+        self.views = {key: self.base[columns] for key, columns in EDITOR_COLUMNS.items()}
+        self.frame = self.base[INPUT_COLUMNS].copy()
+        self.forecast_params = None
+        self._applied = {key: {} for key in EDITOR_COLUMNS}
+
+    def matches(self, date_range):
+        return self.date_range.equals(pd.DatetimeIndex(date_range))
+
+    def _set_value(self, row, column, value):
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            value = np.nan
+        if pd.api.types.is_integer_dtype(self.frame[column]) and not float(value).is_integer():
+            self.frame[column] = self.frame[column].astype(float)
+        elif pd.api.types.is_integer_dtype(self.frame[column]):
+            value = int(value)
+        self.frame.at[row, column] = value
+
+    def apply_edits(self, key, state):
+        # Lo stato del data_editor contiene tutte le modifiche rispetto alla vista iniziale: si applica solo la differenza
+        edited = {int(row): dict(values) for row, values in (state or {}).get('edited_rows', {}).items()}
+        previous = self._applied[key]
+
+        changed_rows = set()
+        for row in set(previous) | set(edited):
+            old_values = previous.get(row, {})
+            new_values = edited.get(row, {})
+            if old_values == new_values:
+                continue
+            for column in set(old_values) | set(new_values):
+                if column in READ_ONLY_COLUMNS:
+                    continue
+                self._set_value(row, column, new_values.get(column, self.base.at[row, column]))
+            changed_rows.add(row)
+
+        self._applied[key] = edited
+        return changed_rows
+
+    def _derive(self, rows=None):
+        params = self.forecast_params
+        subset = self.frame if rows is None else self.frame.loc[rows]
+        subset = subset[INPUT_COLUMNS].copy()
+        subset['fcst_ind_rn'] = forecast_ind_rn(
+            subset,
+            params['forecast_method'],
+            pickup_factor=params['pickup_factor'],
+            pickup_percentage=params['pickup_percentage'],
+            pickup_value=params['pickup_value']
+        )
+        subset = finale_columns(subset)
+
+        if rows is None:
+            self.frame = subset
+            return
+
+        derived = [column for column in subset.columns if column not in INPUT_COLUMNS]
+        if any(subset[column].dtype != self.frame[column].dtype for column in derived):
+            self._derive()
+            return
+        self.frame.loc[rows, derived] = subset[derived]
+
+    def update(self, editor_states, forecast_params):
+        changed_rows = set()
+        for key in EDITOR_COLUMNS:
+            changed_rows |= self.apply_edits(key, editor_states.get(key))
+
+        # La curva di pickup si stima su tutto il periodo: una modifica può cambiare il forecast di ogni riga
+        full = (self.forecast_params != forecast_params or 'fcst_ind_rn' not in self.frame.columns
+                or (forecast_params['forecast_method'] == "Curva pickup" and changed_rows))
+        self.forecast_params = dict(forecast_params)
+
+        if full:
+            self._derive()
+        elif changed_rows:
+            self._derive(sorted(changed_rows))
+
+        return self.frame
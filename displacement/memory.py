@@ -0,0 +1,198 @@
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import uuid
+import weakref
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from displacement.shared import SHARED_STORE
+
+SESSION_BUDGET_MB = float(os.environ.get("DISPLACEMENT_SESSION_BUDGET_MB", "200"))
+SPILL_DIR = os.environ.get("DISPLACEMENT_SPILL_DIR") or None
+
+# Dati della sessione che possono andare su disco: tornano in memoria al primo accesso successivo
+SPILLABLE_KEYS = ['raw_excel_data', 'analyzed_data', 'series_data', 'events_data_cache']
+# Modificati sul posto (append dei passaggi): il file su disco va sempre riscritto
+MUTABLE_KEYS = ['series_data']
+# Cache ricalcolabili: oltre il budget si eliminano senza salvarle
+DROPPABLE_KEYS = ['demand_grid']
+# Chiavi di servizio non contate nel footprint
+IGNORED_KEYS = ['session_memory']
+MAX_DEPTH = 8
+
+FOOTPRINT_COLUMNS = ['chiave', 'memoria_mb', 'su_disco_mb', 'stato']
+PROCESS_COLUMNS = ['sessione', 'utente', 'memoria_mb', 'su_disco_mb', 'budget_mb', 'espulsioni', 'ricaricamenti']
+
+_sessions = weakref.WeakSet()
+_sessions_lock = threading.Lock()
+
+
+def footprint(value, seen=None, depth=0):
+    # Byte stimati dell'oggetto e di ciò che contiene; un oggetto già contato (seen) vale zero
+    if seen is None:
+        seen = set()
+    if id(value) in seen or depth > MAX_DEPTH:
+        return 0
+    seen.add(id(value))
+
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(footprint(key, seen, depth + 1) + footprint(item, seen, depth + 1)
+                                          for key, item in list(value.items()))
+    if isinstance(value, (list, tuple, set, frozenset, deque)):
+        return sys.getsizeof(value) + sum(footprint(item, seen, depth + 1) for item in list(value))
+    if hasattr(value, '__dict__') and not isinstance(value, type):
+        return sys.getsizeof(value) + footprint(vars(value), seen, depth + 1)
+    return sys.getsizeof(value)
+
+
+class Spilled:
+    # Segnaposto in session_state: la chiave resta presente (i controlli "in" non cambiano), i dati sono su disco
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def __repr__(self):
+        return f"Spilled({os.path.basename(self.path)}, {self.size / 1024 / 1024:.1f} MB)"
+
+
+class SessionMemory:
+    def __init__(self, budget_mb=SESSION_BUDGET_MB, directory=SPILL_DIR, owner=None):
+        self.session = uuid.uuid4().hex[:8]
+        self.owner = owner
+        self.budget = budget_mb * 1024 * 1024
+        self.directory = tempfile.mkdtemp(prefix=f"displacement_{self.session}_", dir=directory)
+        self.evictions = 0
+        self.restores = 0
+        self.report = pd.DataFrame(columns=FOOTPRINT_COLUMNS)
+        self.total = 0
+        self.on_disk = 0
+        self._run = 0
+        self._pending = False
+        self._used = {}
+        # Ultimo oggetto visto per chiave e oggetto già scritto su disco: se è ancora lui il file non si riscrive
+        self._known = {}
+        self._written = {}
+        # La cartella dei file sparisce con la sessione, anche senza logout
+        self._cleanup = weakref.finalize(self, shutil.rmtree, self.directory, True)
+
+        with _sessions_lock:
+            _sessions.add(self)
+
+    def begin_run(self, state, graph=None):
+        # Un'esecuzione interrotta da st.rerun o st.stop non arriva al controllo di fine pagina: si fa ora
+        if self._pending:
+            self.enforce(state, graph)
+        self._run += 1
+        self._pending = True
+
+    def load(self, state, key):
+        value = state[key]
+        if isinstance(value, Spilled):
+            with open(value.path, 'rb') as f:
+                value = pickle.load(f)
+            state[key] = value
+            self._known[key] = value
+            self._written[key] = value
+            self.restores += 1
+        self._used[key] = self._run
+        return value
+
+    def measure(self, state):
+        # I dati dello store condiviso tra sessioni non pesano sul budget della singola sessione
+        seen = SHARED_STORE.shared_ids()
+        rows = []
+        # Prima i dati spostabili: un DataFrame condiviso (es. nel grafo di calcolo) si attribuisce a loro
+        keys = [key for key in SPILLABLE_KEYS if key in state]
+        keys += [key for key in list(state.keys()) if key not in SPILLABLE_KEYS and key not in IGNORED_KEYS]
+        for key in [key for key in self._known if key not in state or isinstance(state[key], Spilled)]:
+            self._known.pop(key)
+            self._written.pop(key, None)
+        for key in keys:
+            value = state[key]
+            if isinstance(value, Spilled):
+                rows.append({'chiave': key, 'memoria_mb': 0.0, 'su_disco_mb': value.size / 1024 / 1024,
+                             'stato': "su disco"})
+                continue
+            if key in SPILLABLE_KEYS and self._known.get(key) is not value:
+                # Nuovo valore assegnato dall'app in questa esecuzione: è in uso
+                self._known[key] = value
+                self._written.pop(key, None)
+                self._used[key] = self._run
+            size = footprint(value, seen)
+            rows.append({'chiave': key, 'memoria_mb': size / 1024 / 1024, 'su_disco_mb': 0.0, 'stato': "in memoria"})
+
+        self.report = (pd.DataFrame(rows, columns=FOOTPRINT_COLUMNS)
+                       .sort_values('memoria_mb', ascending=False, ignore_index=True))
+        self.total = int(self.report['memoria_mb'].sum() * 1024 * 1024)
+        self.on_disk = int(self.report['su_disco_mb'].sum() * 1024 * 1024)
+        return self.report
+
+    def enforce(self, state, graph=None):
+        self._pending = False
+        self.measure(state)
+        if self.budget <= 0:
+            return self.report
+
+        # Ordine di espulsione: cache ricalcolabili, dati non usati di recente, valori del grafo, dati in uso
+        for action in self._evictions(state, graph):
+            if self.total <= self.budget:
+                break
+            action()
+            self.evictions += 1
+            self.measure(state)
+        return self.report
+
+    def _evictions(self, state, graph):
+        sizes = dict(zip(self.report['chiave'], self.report['memoria_mb']))
+        # Senza dati propri (es. import condiviso) spostare su disco non libererebbe memoria
+        spillable = sorted((key for key in SPILLABLE_KEYS if key in state and not isinstance(state[key], Spilled)
+                            and sizes.get(key, 0) > 0),
+                           key=lambda key: sizes.get(key, 0), reverse=True)
+        recent = [key for key in spillable if self._used.get(key, 0) >= self._run - 1]
+
+        actions = [lambda key=key: state.pop(key, None) for key in DROPPABLE_KEYS if key in state]
+        actions += [lambda key=key: self._spill(state, key) for key in spillable if key not in recent]
+        if graph is not None:
+            actions.append(graph.release)
+        actions += [lambda key=key: self._spill(state, key) for key in recent]
+        return actions
+
+    def _spill(self, state, key):
+        value = state[key]
+        path = os.path.join(self.directory, f"{key}.pkl")
+        if self._written.get(key) is not value or key in MUTABLE_KEYS or not os.path.exists(path):
+            with open(path + ".tmp", 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+        self._known.pop(key, None)
+        self._written.pop(key, None)
+        state[key] = Spilled(path, os.path.getsize(path))
+
+    def close(self):
+        self._cleanup()
+
+
+def process_footprint():
+    # Una riga per sessione attiva nel processo, con l'ultima misura fatta da ciascuna
+    with _sessions_lock:
+        sessions = list(_sessions)
+    return pd.DataFrame([
+        {'sessione': memory.session, 'utente': memory.owner, 'memoria_mb': memory.total / 1024 / 1024,
+         'su_disco_mb': memory.on_disk / 1024 / 1024, 'budget_mb': memory.budget / 1024 / 1024,
+         'espulsioni': memory.evictions, 'ricaricamenti': memory.restores}
+        for memory in sessions
+    ], columns=PROCESS_COLUMNS)
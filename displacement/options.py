@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+REVIEW_COLUMNS = ['blocco', 'start_date', 'end_date', 'notti', 'camere', 'adr_opzione', 'revenue_opzione',
+                  'camere_displaced', 'revenue_displaced', 'impatto', 'notti_alto_valore', 'date_alto_valore',
+                  'rilascio_consigliato']
+
+
+def option_blocks(data, start=None):
+    # L'export dei gruppi opzionati è giornaliero: ogni blocco di giorni consecutivi con camere opzionate è un'opzione
+    if data is None or data.empty or 'grp_opz_rn' not in data.columns:
+        return pd.DataFrame(columns=['data', 'grp_opz_rn', 'grp_opz_adr', 'blocco'])
+
+    daily = data.groupby('data').agg({'grp_opz_rn': 'sum', 'grp_opz_adr': 'mean'}).reset_index()
+    daily = daily[daily['grp_opz_rn'] > 0]
+    if start is not None:
+        daily = daily[daily['data'] >= pd.Timestamp(start)]
+
+    daily = daily.reset_index(drop=True)
+    daily['blocco'] = (daily['data'].diff() != pd.Timedelta(days=1)).cumsum()
+    return daily
+
+
+def review_options(data, hotel_capacity, blocks=None):
+    # L'export GRP OPZ è un totale giornaliero: opzioni diverse sulle stesse date non sono distinguibili,
+    # quindi ogni blocco viene valutato da solo contro l'OTB e il forecast attuali (finale_rn)
+    if blocks is None:
+        blocks = option_blocks(data)
+
+    days = data.drop_duplicates('data').set_index('data')
+    blocks = blocks[blocks['data'].isin(days.index)]
+    if blocks.empty:
+        return pd.DataFrame(columns=REVIEW_COLUMNS)
+
+    finale_rn = (days['fcst_ind_rn'] + days['otb_ind_rn'] + days['grp_otb_rn']).reindex(blocks['data']).to_numpy(dtype=float)
+    finale_adr = days['finale_adr'].reindex(blocks['data']).to_numpy(dtype=float)
+    rooms = blocks['grp_opz_rn'].to_numpy(dtype=float)
+    option_adr = blocks['grp_opz_adr'].to_numpy(dtype=float)
+
+    displaced = np.maximum(0, finale_rn + rooms - hotel_capacity)
+    nights = blocks.assign(
+        revenue=rooms * option_adr,
+        displaced=displaced,
+        revenue_displaced=displaced * finale_adr,
+        high_value=(displaced > 0) & (finale_adr > option_adr)
+    )
+
+    grouped = nights.groupby('blocco')
+    review = grouped.agg(
+        start_date=('data', 'min'),
+        end_date=('data', 'max'),
+        notti=('data', 'size'),
+        camere=('grp_opz_rn', 'sum'),
+        revenue_opzione=('revenue', 'sum'),
+        camere_displaced=('displaced', 'sum'),
+        revenue_displaced=('revenue_displaced', 'sum'),
+        notti_alto_valore=('high_value', 'sum')
+    ).reset_index()
+    review['end_date'] = review['end_date'] + pd.Timedelta(days=1)
+    review['adr_opzione'] = np.where(review['camere'] > 0, review['revenue_opzione'] / review['camere'].where(review['camere'] > 0, 1), 0.0)
+    review['impatto'] = review['revenue_opzione'] - review['revenue_displaced']
+    review['date_alto_valore'] = (nights[nights['high_value']]
+                                  .groupby('blocco')['data']
+                                  .agg(lambda dates: ", ".join(dates.dt.strftime('%d/%m')))
+                                  .reindex(review['blocco'], fill_value="")
+                                  .to_numpy())
+    review['rilascio_consigliato'] = (review['impatto'] < 0) | (review['notti_alto_valore'] > 0)
+
+    return review[REVIEW_COLUMNS].sort_values('impatto').reset_index(drop=True)
@@ -0,0 +1,215 @@
+import json
+import os
+import sqlite3
+from contextlib import closing
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from displacement.snapshots import DATA_DIR
+
+DAY_COLUMNS = ['data', 'camere_gruppo', 'camere_gruppo_accettate', 'camere_displaced', 'finale_rn', 'finale_adr',
+               'adr_gruppo_netto', 'revenue_displaced', 'impatto_revenue_totale']
+QUOTE_COLUMNS = ['id', 'hotel', 'group_name', 'start_date', 'end_date', 'room_config', 'group_rooms', 'adr_lordo',
+                 'hotel_capacity', 'forecast_method', 'decision', 'total_impact', 'displaced_rooms', 'total_lordo',
+                 'floor_adr_lordo', 'username', 'created_at', 'events', 'outcome', 'outcome_at']
+# Esito commerciale registrato dopo la risposta del cliente; senza esito il preventivo è ancora pendente
+QUOTE_OUTCOMES = ["Vinto", "Perso"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS quotes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    hotel TEXT NOT NULL,
+    group_name TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    room_config TEXT NOT NULL,
+    group_rooms REAL NOT NULL,
+    adr_lordo REAL NOT NULL,
+    hotel_capacity INTEGER NOT NULL,
+    forecast_method TEXT,
+    decision TEXT NOT NULL,
+    total_impact REAL NOT NULL,
+    displaced_rooms REAL NOT NULL,
+    total_lordo REAL NOT NULL,
+    floor_adr_lordo REAL,
+    username TEXT,
+    created_at TEXT NOT NULL,
+    events INTEGER NOT NULL DEFAULT 0,
+    outcome TEXT,
+    outcome_at TEXT,
+    inputs TEXT NOT NULL,
+    metrics TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS quote_days (
+    quote_id INTEGER NOT NULL REFERENCES quotes (id) ON DELETE CASCADE,
+    data TEXT NOT NULL,
+    camere_gruppo REAL,
+    camere_gruppo_accettate REAL,
+    camere_displaced REAL,
+    finale_rn REAL,
+    finale_adr REAL,
+    adr_gruppo_netto REAL,
+    revenue_displaced REAL,
+    impatto_revenue_totale REAL,
+    PRIMARY KEY (quote_id, data)
+);
+CREATE INDEX IF NOT EXISTS idx_quotes_stay ON quotes (hotel, start_date, end_date);
+CREATE INDEX IF NOT EXISTS idx_quotes_group ON quotes (hotel, group_name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_quotes_created ON quotes (hotel, created_at);
+CREATE INDEX IF NOT EXISTS idx_quote_days_stay ON quote_days (data);
+CREATE INDEX IF NOT EXISTS idx_quotes_outcome ON quotes (hotel, outcome);
+"""
+
+# Colonne aggiunte dopo la prima versione dello storico preventivi
+ADDED_COLUMNS = {
+    'events': "INTEGER NOT NULL DEFAULT 0",
+    'outcome': "TEXT",
+    'outcome_at': "TEXT"
+}
+
+
+def _plain(value):
+    # Richiesta e parametri in JSON: date come AAAA-MM-GG, tabelle (camere per giorno, tipologie) come record
+    if isinstance(value, pd.DataFrame):
+        return [_plain(record) for record in value.to_dict('records')]
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if isinstance(value, (pd.Timestamp, date)):
+        return pd.Timestamp(value).strftime('%Y-%m-%d')
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class QuoteStore:
+    def __init__(self, path=None, hotel="default"):
+        self.path = path or os.path.join(DATA_DIR, "quotes.sqlite")
+        self.hotel = hotel
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with closing(self._connect()) as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(quotes)")}
+            if columns:
+                for column, definition in ADDED_COLUMNS.items():
+                    if column not in columns:
+                        conn.execute(f"ALTER TABLE quotes ADD COLUMN {column} {definition}")
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def save_quote(self, group_name, request, metrics, result_df, settings=None, username=None):
+        settings = settings or {}
+        row = (
+            self.hotel,
+            group_name,
+            pd.Timestamp(request['start_date']).strftime('%Y-%m-%d'),
+            pd.Timestamp(request['end_date']).strftime('%Y-%m-%d'),
+            request.get('room_config', "Contingente fisso ROH"),
+            float(metrics['total_group_rooms']),
+            float(request['adr_lordo']),
+            int(settings.get('hotel_capacity', 0)),
+            settings.get('forecast_method'),
+            "ACCETTA" if metrics['should_accept'] else "DECLINA",
+            float(metrics['total_impact']),
+            float(metrics['displaced_rooms']),
+            float(metrics['total_lordo']),
+            float(metrics['floor_adr_lordo']) if 'floor_adr_lordo' in metrics else None,
+            username,
+            pd.Timestamp.now().isoformat(timespec='seconds'),
+            int(settings.get('events', 0)),
+            None,
+            None,
+            json.dumps(_plain(dict(settings, request=request))),
+            json.dumps(_plain(metrics))
+        )
+
+        days = result_df[[column for column in DAY_COLUMNS if column in result_df.columns]].reindex(columns=DAY_COLUMNS)
+        days = days.assign(data=pd.to_datetime(days['data']).dt.strftime('%Y-%m-%d')).astype(object)
+        days = days.where(days.notna(), None)
+
+        with closing(self._connect()) as conn, conn:
+            quote_id = conn.execute(f"INSERT INTO quotes ({', '.join(QUOTE_COLUMNS[1:])}, inputs, metrics) "
+                                    f"VALUES ({', '.join('?' * (len(QUOTE_COLUMNS) + 1))})", row).lastrowid
+            conn.executemany(f"INSERT INTO quote_days VALUES ({', '.join('?' * (len(DAY_COLUMNS) + 1))})",
+                             [(quote_id,) + tuple(values) for values in days.itertuples(index=False)])
+
+        return quote_id
+
+    def quotes(self, start=None, end=None, group_name=None, limit=None):
+        # Preventivi del soggiorno [start, end) (sovrapposti anche solo per una notte) e/o dello stesso gruppo
+        query = f"SELECT {', '.join(QUOTE_COLUMNS)} FROM quotes WHERE hotel = ?"
+        params = [self.hotel]
+
+        if end is not None:
+            query += " AND start_date < ?"
+            params.append(pd.Timestamp(end).strftime('%Y-%m-%d'))
+        if start is not None:
+            query += " AND end_date > ?"
+            params.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+        if group_name is not None:
+            query += " AND group_name = ? COLLATE NOCASE"
+            params.append(group_name)
+        query += " ORDER BY created_at DESC, id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(int(limit))
+
+        with closing(self._connect()) as conn:
+            quotes = pd.read_sql_query(query, conn, params=params)
+
+        for column in ['start_date', 'end_date', 'created_at', 'outcome_at']:
+            quotes[column] = pd.to_datetime(quotes[column])
+        return quotes
+
+    def set_outcome(self, quote_id, outcome):
+        if outcome is not None and outcome not in QUOTE_OUTCOMES:
+            raise ValueError(f"Esito non valido: {outcome}")
+
+        outcome_at = pd.Timestamp.now().isoformat(timespec='seconds') if outcome is not None else None
+        with closing(self._connect()) as conn, conn:
+            updated = conn.execute("UPDATE quotes SET outcome = ?, outcome_at = ? WHERE id = ? AND hotel = ?",
+                                   (outcome, outcome_at, int(quote_id), self.hotel)).rowcount
+        if not updated:
+            raise KeyError(f"Preventivo {quote_id} non trovato per l'hotel {self.hotel}")
+
+    def decided_quotes(self):
+        # Solo i campi numerici usati dall'analisi win/loss, senza caricare richieste e dettaglio giornaliero
+        query = """
+            SELECT id, start_date, end_date, created_at, group_rooms, adr_lordo, displaced_rooms, total_impact,
+                   events, outcome,
+                   json_extract(metrics, '$.current_adr_netto') AS adr_netto,
+                   json_extract(metrics, '$.avg_adr_ly') AS avg_adr_ly
+            FROM quotes WHERE hotel = ? AND outcome IS NOT NULL
+        """
+        with closing(self._connect()) as conn:
+            quotes = pd.read_sql_query(query, conn, params=(self.hotel,))
+
+        for column in ['start_date', 'end_date', 'created_at']:
+            quotes[column] = pd.to_datetime(quotes[column])
+        return quotes
+
+    def load_quote(self, quote_id):
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM quotes WHERE id = ? AND hotel = ?", (int(quote_id), self.hotel)).fetchone()
+            if row is None:
+                raise KeyError(f"Preventivo {quote_id} non trovato per l'hotel {self.hotel}")
+            days = pd.read_sql_query(f"SELECT {', '.join(DAY_COLUMNS)} FROM quote_days WHERE quote_id = ? ORDER BY data",
+                                     conn, params=(int(quote_id),))
+
+        quote = dict(row)
+        quote['inputs'] = json.loads(quote['inputs'])
+        quote['metrics'] = json.loads(quote['metrics'])
+        days['data'] = pd.to_datetime(days['data'])
+        return quote, days
@@ -0,0 +1,222 @@
+import io
+import math
+from datetime import datetime
+
+import xlsxwriter
+
+from displacement.theme import COLOR_PALETTE
+
+
+def generate_excel_report(result_df, metrics, group_info, hotel_info, author=""):
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+
+    title_format = workbook.add_format({
+        'bold': True,
+        'font_size': 16,
+        'align': 'center',
+        'valign': 'vcenter',
+        'bg_color': COLOR_PALETTE["background"],
+        'font_color': COLOR_PALETTE["text"],
+        'border': 1
+    })
+
+    header_format = workbook.add_format({
+        'bold': True,
+        'font_size': 12,
+        'align': 'center',
+        'valign': 'vcenter',
+        'bg_color': COLOR_PALETTE["primary"],
+        'font_color': 'white',
+        'border': 1
+    })
+
+    cell_format = workbook.add_format({
+        'align': 'center',
+        'valign': 'vcenter',
+        'border': 1
+    })
+
+    number_format = workbook.add_format({
+        'align': 'center',
+        'valign': 'vcenter',
+        'border': 1,
+        'num_format': '#,##0'
+    })
+
+    currency_format = workbook.add_format({
+        'align': 'center',
+        'valign': 'vcenter',
+        'border': 1,
+        'num_format': '€#,##0.00'
+    })
+
+    percentage_format = workbook.add_format({
+        'align': 'center',
+        'valign': 'vcenter',
+        'border': 1,
+        'num_format': '0.0%'
+    })
+
+    date_format = workbook.add_format({
+        'align': 'center',
+        'valign': 'vcenter',
+        'border': 1,
+        'num_format': 'dd/mm/yyyy'
+    })
+
+    section_format = workbook.add_format({
+        'bold': True,
+        'font_size': 14,
+        'align': 'left',
+        'valign': 'vcenter',
+        'bg_color': COLOR_PALETTE["secondary"],
+        'font_color': 'white',
+        'border': 1
+    })
+
+    result_positive = workbook.add_format({
+        'bold': True,
+        'font_size': 14,
+        'align': 'center',
+        'valign': 'vcenter',
+        'bg_color': COLOR_PALETTE["positive"],
+        'font_color': 'white',
+        'border': 1
+    })
+
+    result_negative = workbook.add_format({
+        'bold': True,
+        'font_size': 14,
+        'align': 'center',
+        'valign': 'vcenter',
+        'bg_color': COLOR_PALETTE["negative"],
+        'font_color': 'white',
+        'border': 1
+    })
+
+    summary_sheet = workbook.add_worksheet('Riepilogo')
+    summary_sheet.set_column('A:A', 30)
+    summary_sheet.set_column('B:B', 30)
+    summary_sheet.set_column('C:C', 20)
+    summary_sheet.set_column('D:D', 20)
+
+    summary_sheet.merge_range('A1:D1', 'RIEPILOGO ANALISI DISPLACEMENT', title_format)
+
+    summary_sheet.merge_range('A3:D3', 'DATI HOTEL', section_format)
+    summary_sheet.write('A4', 'Hotel', cell_format)
+    summary_sheet.write('B4', hotel_info['name'], cell_format)
+    summary_sheet.write('A5', 'Capacità camere', cell_format)
+    summary_sheet.write('B5', hotel_info['capacity'], number_format)
+    summary_sheet.write('A6', 'Aliquota IVA', cell_format)
+    summary_sheet.write('B6', hotel_info['iva_rate'], percentage_format)
+
+    summary_sheet.merge_range('A8:D8', 'DATI GRUPPO', section_format)
+    summary_sheet.write('A9', 'Nome gruppo', cell_format)
+    summary_sheet.write('B9', group_info['name'], cell_format)
+    summary_sheet.write('A10', 'Data arrivo', cell_format)
+    summary_sheet.write('B10', group_info['arrival_date'], date_format)
+    summary_sheet.write('A11', 'Data partenza', cell_format)
+    summary_sheet.write('B11', group_info['departure_date'], date_format)
+    summary_sheet.write('A12', 'Numero camere', cell_format)
+    summary_sheet.write('B12', group_info['num_rooms'], number_format)
+    summary_sheet.write('A13', 'ADR lordo', cell_format)
+    summary_sheet.write('B13', group_info['adr_lordo'], currency_format)
+    summary_sheet.write('A14', 'ADR netto', cell_format)
+    summary_sheet.write('B14', group_info['adr_netto'], currency_format)
+    summary_sheet.write('A15', 'Revenue ancillare', cell_format)
+    summary_sheet.write('B15', group_info['ancillary_revenue'], currency_format)
+
+    summary_sheet.merge_range('A17:D17', 'RISULTATI ANALISI', section_format)
+    summary_sheet.write('A18', 'Camere richieste', cell_format)
+    summary_sheet.write('B18', metrics['total_group_rooms'], number_format)
+    summary_sheet.write('A19', 'Camere accettate', cell_format)
+    summary_sheet.write('B19', metrics['accepted_rooms'], number_format)
+    summary_sheet.write('A20', 'Camere displaced', cell_format)
+    summary_sheet.write('B20', metrics['displaced_rooms'], number_format)
+    summary_sheet.write('A21', 'Revenue camere gruppo', cell_format)
+    summary_sheet.write('B21', metrics['group_room_revenue'], currency_format)
+    summary_sheet.write('A22', 'Revenue ancillare', cell_format)
+    summary_sheet.write('B22', metrics['group_ancillary'], currency_format)
+    summary_sheet.write('A23', 'Revenue displaced', cell_format)
+    summary_sheet.write('B23', metrics['revenue_displaced'], currency_format)
+    summary_sheet.write('A24', 'Impatto totale', cell_format)
+    summary_sheet.write('B24', metrics['total_impact'], currency_format)
+    summary_sheet.write('A25', 'Valore totale lordo', cell_format)
+    summary_sheet.write('B25', metrics['total_lordo'], currency_format)
+    summary_sheet.write('A26', 'ADR minimo lordo (soggiorno)', cell_format)
+    summary_sheet.write('B26', metrics['floor_adr_lordo'], currency_format)
+    summary_sheet.write('A27', 'ADR minimo netto (soggiorno)', cell_format)
+    summary_sheet.write('B27', metrics['floor_adr_netto'], currency_format)
+
+    decision_text = "ACCETTA GRUPPO" if metrics['should_accept'] else "DECLINA GRUPPO"
+    decision_format = result_positive if metrics['should_accept'] else result_negative
+    summary_sheet.merge_range('A29:D29', decision_text, decision_format)
+
+    if metrics['needs_authorization']:
+        summary_sheet.merge_range('A31:D31', 'ATTENZIONE: RICHIEDE AUTORIZZAZIONE (>€35.000)', result_negative)
+
+    summary_sheet.merge_range('A33:D33', f'Report generato il {datetime.now().strftime("%d/%m/%Y %H:%M")} da {author}', cell_format)
+
+    data_sheet = workbook.add_worksheet('Dati Dettagliati')
+
+    columns = ['data', 'giorno', 'finale_rn', 'camere_gruppo', 'camere_disponibili', 
+              'camere_displaced', 'adr_gruppo_netto', 'finale_adr', 
+              'revenue_camere_gruppo_effettivo', 'revenue_displaced', 'impatto_revenue_totale', 'adr_minimo_netto']
+
+    headers = ['Data', 'Giorno', 'FCST OTB', 'REQ', 'Disponibili', 
+              'DSPL', 'ADR Netto', 'ADR Attuale', 
+              'REV REQ', 'REV DSPL', 'DIFF', 'ADR Min Netto']
+
+    for i, col in enumerate(columns):
+        data_sheet.set_column(i, i, 15)
+
+    for i, header in enumerate(headers):
+        data_sheet.write(0, i, header, header_format)
+
+    for i, row in result_df.reset_index(drop=True).iterrows():
+        data_sheet.write(i+1, 0, row['data'], date_format)
+        data_sheet.write(i+1, 1, row['giorno'], cell_format)
+        data_sheet.write(i+1, 2, row['finale_rn'], number_format)
+        data_sheet.write(i+1, 3, row['camere_gruppo'], number_format)
+        data_sheet.write(i+1, 4, row['camere_disponibili'], number_format)
+        data_sheet.write(i+1, 5, row['camere_displaced'], number_format)
+        data_sheet.write(i+1, 6, row['adr_gruppo_netto'], currency_format)
+        data_sheet.write(i+1, 7, row['finale_adr'], currency_format)
+        data_sheet.write(i+1, 8, row['revenue_camere_gruppo_effettivo'], currency_format)
+        data_sheet.write(i+1, 9, row['revenue_displaced'], currency_format)
+        data_sheet.write(i+1, 10, row['impatto_revenue_totale'], currency_format)
+        # Notti senza camere del gruppo: nessuna soglia
+        if math.isnan(row['adr_minimo_netto']):
+            data_sheet.write_blank(i+1, 11, None, cell_format)
+        else:
+            data_sheet.write(i+1, 11, row['adr_minimo_netto'], currency_format)
+
+    forecast_sheet = workbook.add_worksheet('Forecast e OTB')
+
+    forecast_cols = ['data', 'giorno', 'otb_ind_rn', 'ly_ind_rn', 'fcst_ind_rn', 
+                    'grp_otb_rn', 'grp_opz_rn', 'finale_rn']
+
+    forecast_headers = ['Data', 'Giorno', 'OTB IND', 'LY IND', 'FCST IND', 
+                        'GRP OTB', 'GRP OPZ', 'TOTALE']
+
+    for i, col in enumerate(forecast_cols):
+        forecast_sheet.set_column(i, i, 15)
+
+    for i, header in enumerate(forecast_headers):
+        forecast_sheet.write(0, i, header, header_format)
+
+    for i, row in result_df.reset_index(drop=True).iterrows():
+        forecast_sheet.write(i+1, 0, row['data'], date_format)
+        forecast_sheet.write(i+1, 1, row['giorno'], cell_format)
+        forecast_sheet.write(i+1, 2, row['otb_ind_rn'], number_format)
+        forecast_sheet.write(i+1, 3, row['ly_ind_rn'], number_format)
+        forecast_sheet.write(i+1, 4, row['fcst_ind_rn'], number_format)
+        forecast_sheet.write(i+1, 5, row['grp_otb_rn'], number_format)
+        forecast_sheet.write(i+1, 6, row['grp_opz_rn'], number_format)
+        forecast_sheet.write(i+1, 7, row['finale_rn'], number_format)
+
+    workbook.close()
+
+    output.seek(0)
+    return output.getvalue()
@@ -0,0 +1,476 @@
+import argparse
+import hmac
+import json
+import os
+import re
+import threading
+import time
+from datetime import date, datetime
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from fastapi import Depends, FastAPI, File, Form, Header, HTTPException, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+from displacement.engine import (ADR_VARIATIONS, DEFAULT_DECISION_PARAMETERS, ROOM_CONFIG_OPTIONS, SEGMENT_COLUMNS,
+                                 adr_scenarios, build_analysis_frame, evaluate_request, fit_pickup_curve,
+                                 prepare_segments)
+from displacement.forecast import FORECAST_METHODS
+from displacement.grid import GRID_COLUMNS, forecast_settings, scenario_grid
+from displacement.importer import import_excel_files
+from displacement.report import generate_excel_report
+from displacement.snapshots import DATA_DIR, SnapshotStore
+
+API_KEY = os.environ.get("DISPLACEMENT_API_KEY")
+HOTEL_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+DAILY_COLUMNS = ['data', 'giorno', 'finale_rn', 'camere_gruppo', 'camere_disponibili', 'camere_displaced',
+                 'adr_gruppo_netto', 'finale_adr', 'revenue_camere_gruppo_effettivo', 'revenue_displaced',
+                 'impatto_revenue_totale', 'adr_minimo_netto']
+
+
+class HotelNotFoundError(LookupError):
+    pass
+
+
+class HotelDataStore:
+    def __init__(self, directory=None):
+        self.directory = directory or os.path.join(DATA_DIR, "service")
+        self._hotels = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, hotel):
+        return os.path.join(self.directory, f"{hotel}.json")
+
+    def _dump(self, entry):
+        # Solo date e colonne numeriche usate dal motore, in JSON: nessun pickle caricato da disco
+        segments = {}
+        for key, segment in entry['segments'].items():
+            if segment is None:
+                segments[key] = None
+                continue
+            columns = [column for column in ('data',) + SEGMENT_COLUMNS[key] if column in segment.columns]
+            values = segment[columns].assign(data=segment['data'].dt.strftime('%Y-%m-%d'))
+            segments[key] = values.to_dict('list')
+        return {
+            'as_of': entry['as_of'].strftime('%Y-%m-%d'),
+            'imported_at': entry['imported_at'].isoformat(),
+            'segments': segments
+        }
+
+    def _load(self, path):
+        with open(path, encoding="utf-8") as f:
+            stored = json.load(f)
+
+        segments = {}
+        for key, values in stored['segments'].items():
+            if values is None:
+                segments[key] = None
+                continue
+            segment = pd.DataFrame(values)
+            segment['data'] = pd.to_datetime(segment['data'])
+            for column in segment.columns.drop('data'):
+                segment[column] = pd.to_numeric(segment[column], errors='coerce').fillna(0)
+            segments[key] = segment
+
+        return {
+            'segments': segments,
+            'as_of': pd.Timestamp(stored['as_of']),
+            'imported_at': datetime.fromisoformat(stored['imported_at'])
+        }
+
+    def put(self, hotel, imported, as_of):
+        entry = {
+            'segments': prepare_segments(imported['idv_cy'], imported['idv_ly'], imported['grp_otb'], imported['grp_opz']),
+            'as_of': pd.Timestamp(as_of).normalize(),
+            'imported_at': datetime.now()
+        }
+
+        # Su disco i segmenti restano disponibili agli altri worker uvicorn e dopo un riavvio
+        path = self._path(hotel)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._dump(entry), f)
+        os.replace(path + ".tmp", path)
+
+        with self._lock:
+            self._hotels[hotel] = dict(entry, mtime=os.path.getmtime(path), curves={})
+            return self._hotels[hotel]
+
+    def get(self, hotel):
+        path = self._path(hotel)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+
+        with self._lock:
+            entry = self._hotels.get(hotel)
+            if entry is not None and (mtime is None or entry['mtime'] >= mtime):
+                return entry
+
+        if mtime is None:
+            raise HotelNotFoundError(hotel)
+
+        entry = dict(self._load(path), mtime=mtime, curves={})
+        with self._lock:
+            self._hotels[hotel] = entry
+        return entry
+
+    def pickup_curve(self, hotel, as_of):
+        entry = self.get(hotel)
+        key = pd.Timestamp(as_of).strftime('%Y-%m-%d')
+        with self._lock:
+            curve = entry['curves'].get(key)
+        if curve is not None:
+            return curve
+
+        # Stima fuori dal lock; se due richieste la calcolano insieme resta la prima registrata
+        history = SnapshotStore(hotel=hotel).pickup_history(as_of=as_of)
+        curve = fit_pickup_curve(entry['segments'], as_of, history)
+        with self._lock:
+            return entry['curves'].setdefault(key, curve)
+
+    def hotels(self):
+        return sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith(".json"))
+
+
+class RoomsPerDay(BaseModel):
+    data: date
+    camere: int
+
+
+class RoomType(BaseModel):
+    tipo: str = "ROH"
+    numero: int
+    adr_addon: float = 0.0
+
+
+class GroupRequest(BaseModel):
+    name: str = "Gruppo"
+    start_date: date
+    end_date: date
+    room_config: str = "Contingente fisso ROH"
+    num_rooms: int = 0
+    rooms: list[RoomsPerDay] = []
+    room_types: list[RoomType] = []
+    adr_lordo: float
+    fb_revenue: float = 0.0
+    meeting_revenue: float = 0.0
+    other_revenue: float = 0.0
+    hotel_capacity: int = 66
+    iva_rate: float = 0.1
+    forecast_method: str = "LY - OTB"
+    pickup_factor: float = 1.0
+    pickup_percentage: float = 20
+    pickup_value: float = 10
+    as_of: Optional[date] = None
+    dates: Optional[list[date]] = None
+
+
+class GridRequest(GroupRequest):
+    # Liste vuote: si usa il valore singolo della richiesta (capacità, ADR, metodo e parametri di forecast)
+    capacities: list[int] = []
+    adr_levels: list[float] = []
+    forecast_methods: list[str] = []
+    pickup_factors: list[float] = []
+    pickup_percentages: list[float] = []
+    pickup_values: list[float] = []
+
+
+_store = None
+_store_lock = threading.Lock()
+app = FastAPI(title="Hotel Group Displacement API", version="0.9.6")
+
+
+def hotel_store():
+    # Creato alla prima richiesta: importare il modulo non crea cartelle su disco
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = HotelDataStore()
+        return _store
+
+
+def require_api_key(x_api_key: Optional[str] = Header(default=None)):
+    # Senza chiave configurata il servizio rifiuta tutte le richieste invece di restare aperto
+    if not API_KEY:
+        raise HTTPException(status_code=503, detail="Servizio non configurato: impostare DISPLACEMENT_API_KEY")
+    if x_api_key is None or not hmac.compare_digest(x_api_key.encode(), API_KEY.encode()):
+        raise HTTPException(status_code=401, detail="Chiave API non valida")
+
+
+def _hotel(hotel):
+    if not HOTEL_PATTERN.match(hotel):
+        raise HTTPException(status_code=422, detail=f"Codice hotel non valido: {hotel}")
+    return hotel
+
+
+def _plain(value):
+    # NaN e infiniti non sono JSON validi: diventano null
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, str):
+        return value
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+def _plain_metrics(metrics):
+    return {key: _plain(value) for key, value in metrics.items()}
+
+
+def _records(df, columns):
+    return json.loads(df[columns].to_json(orient='records', date_format='iso'))
+
+
+def _group_request(body):
+    if body.end_date <= body.start_date:
+        raise ValueError("La data di partenza deve essere successiva alla data di arrivo")
+    if body.room_config not in ROOM_CONFIG_OPTIONS:
+        raise ValueError(f"Configurazione camere non supportata: {body.room_config}")
+
+    request = {
+        'room_config': body.room_config,
+        'start_date': pd.Timestamp(body.start_date),
+        'end_date': pd.Timestamp(body.end_date),
+        'num_rooms': body.num_rooms,
+        'adr_lordo': body.adr_lordo,
+        'fb_revenue': body.fb_revenue,
+        'meeting_revenue': body.meeting_revenue,
+        'other_revenue': body.other_revenue
+    }
+    if body.room_config == "Camere variabili per giorno":
+        request['rooms_data'] = pd.DataFrame({
+            'data': pd.to_datetime([day.data for day in body.rooms]),
+            'camere': [day.camere for day in body.rooms]
+        })
+    elif body.room_config == "Tipologie multiple":
+        request['room_types'] = [room_type.model_dump() for room_type in body.room_types]
+
+    dates = None
+    if body.dates is not None:
+        # Le date analizzate devono essere notti del soggiorno, altrimenti le metriche sarebbero vuote (NaN)
+        if not body.dates:
+            raise ValueError("Nessuna data da analizzare: omettere dates per analizzare l'intero soggiorno")
+        dates = pd.to_datetime(body.dates)
+        outside = [day.strftime('%Y-%m-%d') for day in dates
+                   if not request['start_date'] <= day < request['end_date']]
+        if outside:
+            raise ValueError(f"Date fuori dal soggiorno {body.start_date.isoformat()} - {body.end_date.isoformat()}: "
+                             f"{', '.join(outside)}")
+    return request, dates
+
+
+def _analysis_inputs(hotel, body):
+    request, dates = _group_request(body)
+    if body.forecast_method not in FORECAST_METHODS:
+        raise ValueError(f"Metodo di forecast non supportato: {body.forecast_method}")
+
+    store = hotel_store()
+    entry = store.get(hotel)
+    as_of = pd.Timestamp(body.as_of) if body.as_of is not None else entry['as_of']
+    date_range = pd.date_range(body.start_date, pd.Timestamp(body.end_date) - pd.Timedelta(days=1))
+
+    curve = store.pickup_curve(hotel, as_of) if body.forecast_method == "Curva pickup" else None
+    data = build_analysis_frame(
+        entry['segments'],
+        date_range,
+        body.forecast_method,
+        pickup_factor=body.pickup_factor,
+        pickup_percentage=body.pickup_percentage,
+        pickup_value=body.pickup_value,
+        curve=curve,
+        as_of=as_of
+    )
+    return data, request, dates
+
+
+def analyze_group(hotel, body):
+    data, request, dates = _analysis_inputs(hotel, body)
+    _, result_df, metrics = evaluate_request(data, request, body.hotel_capacity, body.iva_rate,
+                                             DEFAULT_DECISION_PARAMETERS, dates)
+    return result_df, metrics
+
+
+def _run(function, *args):
+    try:
+        return function(*args)
+    except HotelNotFoundError as e:
+        raise HTTPException(status_code=404, detail=f"Nessun dato importato per l'hotel {e.args[0]}")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.middleware("http")
+async def process_time_header(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    response.headers["X-Process-Time-Ms"] = f"{(time.perf_counter() - started) * 1000:.1f}"
+    return response
+
+
+@app.get("/health")
+async def health():
+    return {'stato': "ok"}
+
+
+@app.get("/hotels", dependencies=[Depends(require_api_key)])
+async def list_hotels():
+    return {'hotels': hotel_store().hotels()}
+
+
+@app.get("/hotels/{hotel}", dependencies=[Depends(require_api_key)])
+async def hotel_status(hotel: str):
+    entry = _run(hotel_store().get, _hotel(hotel))
+    segments = {}
+    for key, segment in entry['segments'].items():
+        segments[key] = None if segment is None else {
+            'righe': len(segment),
+            'dal': segment['data'].min().strftime('%Y-%m-%d') if len(segment) else None,
+            'al': segment['data'].max().strftime('%Y-%m-%d') if len(segment) else None
+        }
+    return {
+        'hotel': hotel,
+        'as_of': entry['as_of'].strftime('%Y-%m-%d'),
+        'importato_il': entry['imported_at'].isoformat(timespec='seconds'),
+        'segmenti': segments
+    }
+
+
+@app.post("/hotels/{hotel}/import", dependencies=[Depends(require_api_key)])
+async def import_files(hotel: str, files: list[UploadFile] = File(...), as_of: Optional[date] = Form(default=None)):
+    hotel = _hotel(hotel)
+    contents = [(upload.filename, await upload.read()) for upload in files]
+    as_of = as_of or date.today()
+
+    def run_import():
+        # Nel servizio l'import usa thread: il fork di un processo con thread attivi non è sicuro
+        imported, messages, _ = import_excel_files(contents, use_processes=False)
+        if imported['idv_cy'] is None:
+            raise ValueError("File IDV anno corrente mancante o non riconosciuto")
+        hotel_store().put(hotel, imported, as_of)
+        saved = SnapshotStore(hotel=hotel).save_import(as_of, imported)
+        return messages, saved
+
+    messages, saved = await run_in_threadpool(_run, run_import)
+    return {
+        'hotel': hotel,
+        'as_of': as_of.isoformat(),
+        'messaggi': [{'livello': level, 'testo': text} for level, text in messages],
+        'snapshot': saved
+    }
+
+
+@app.post("/hotels/{hotel}/analyze", dependencies=[Depends(require_api_key)])
+async def analyze(hotel: str, body: GroupRequest, dettaglio: bool = True):
+    result_df, metrics = await run_in_threadpool(_run, analyze_group, _hotel(hotel), body)
+    response = {
+        'hotel': hotel,
+        'gruppo': body.name,
+        'decisione': "ACCETTA" if metrics['should_accept'] else "DECLINA",
+        'richiede_autorizzazione': bool(metrics['needs_authorization']),
+        'metriche': _plain_metrics(metrics)
+    }
+    if dettaglio:
+        response['giorni'] = _records(result_df, DAILY_COLUMNS)
+    return response
+
+
+@app.post("/hotels/{hotel}/scenarios", dependencies=[Depends(require_api_key)])
+async def scenarios(hotel: str, body: GroupRequest):
+    hotel = _hotel(hotel)
+
+    def run_scenarios():
+        data, request, dates = _analysis_inputs(hotel, body)
+        _, _, metrics = evaluate_request(data, request, body.hotel_capacity, body.iva_rate,
+                                         DEFAULT_DECISION_PARAMETERS, dates)
+        return adr_scenarios(data, request, body.hotel_capacity, body.iva_rate, metrics,
+                             DEFAULT_DECISION_PARAMETERS, dates, ADR_VARIATIONS)
+
+    results = await run_in_threadpool(_run, run_scenarios)
+    results = [{key: _plain(value) for key, value in scenario.items()} for scenario in results]
+    valued = [scenario for scenario in results if scenario['total_rev_profit'] is not None]
+    return {
+        'hotel': hotel,
+        'gruppo': body.name,
+        'scenari': results,
+        'ottimale': max(valued, key=lambda scenario: scenario['total_rev_profit']) if valued else None
+    }
+
+
+@app.post("/hotels/{hotel}/grid", dependencies=[Depends(require_api_key)])
+async def grid(hotel: str, body: GridRequest):
+    hotel = _hotel(hotel)
+
+    def run_grid():
+        # Nel servizio la griglia resta nel thread della richiesta: niente pool di processi (fork con thread attivi)
+        request, dates = _group_request(body)
+        store = hotel_store()
+        entry = store.get(hotel)
+        as_of = pd.Timestamp(body.as_of) if body.as_of is not None else entry['as_of']
+        methods = body.forecast_methods or [body.forecast_method]
+        forecasts = forecast_settings(methods, body.pickup_factors or [body.pickup_factor],
+                                      body.pickup_percentages or [body.pickup_percentage],
+                                      body.pickup_values or [body.pickup_value])
+        curve = store.pickup_curve(hotel, as_of) if "Curva pickup" in methods else None
+        return scenario_grid(entry['segments'], request, body.capacities or [body.hotel_capacity],
+                             body.adr_levels or [body.adr_lordo], forecasts, body.iva_rate, curve, as_of, dates)
+
+    cube = await run_in_threadpool(_run, run_grid)
+    return {
+        'hotel': hotel,
+        'gruppo': body.name,
+        'celle': _records(cube, GRID_COLUMNS)
+    }
+
+
+@app.post("/hotels/{hotel}/report", dependencies=[Depends(require_api_key)])
+async def report(hotel: str, body: GroupRequest):
+    hotel = _hotel(hotel)
+
+    def run_report():
+        result_df, metrics = analyze_group(hotel, body)
+        group_info = {
+            'name': body.name,
+            'arrival_date': pd.Timestamp(body.start_date),
+            'departure_date': pd.Timestamp(body.end_date),
+            'num_rooms': body.num_rooms,
+            'adr_lordo': body.adr_lordo,
+            'adr_netto': body.adr_lordo / (1 + body.iva_rate),
+            'ancillary_revenue': body.fb_revenue + body.meeting_revenue + body.other_revenue
+        }
+        hotel_info = {
+            'name': f"Hotel {hotel} (capacità: {body.hotel_capacity} camere)",
+            'capacity': body.hotel_capacity,
+            'iva_rate': body.iva_rate
+        }
+        return generate_excel_report(result_df, metrics, group_info, hotel_info, author="API")
+
+    content = await run_in_threadpool(_run, run_report)
+    filename = f"Report_Displacement_{re.sub(r'[^A-Za-z0-9_-]', '_', body.name)}_{datetime.now().strftime('%Y%m%d')}.xlsx"
+    return Response(
+        content=content,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(prog="python -m displacement.service",
+                                     description="Servizio REST/JSON per l'analisi displacement")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="Numero di worker uvicorn")
+    args = parser.parse_args(argv)
+
+    if not API_KEY:
+        parser.error("variabile DISPLACEMENT_API_KEY non impostata: il servizio non viene avviato senza chiave API")
+
+    uvicorn.run("displacement.service:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import hashlib
+import threading
+import weakref
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+SHARED_COLUMNS = ['contenuto', 'righe', 'memoria_mb', 'sessioni', 'riutilizzi', 'creato']
+
+
+def content_digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def freeze(value):
+    # Copia in sola lettura: ogni colonna è un array NumPy non scrivibile, quindi condivisibile tra sessioni.
+    # Le trasformazioni del motore (rename, merge, assign) lavorano già su copie
+    if isinstance(value, pd.DataFrame):
+        arrays = []
+        for position in range(value.shape[1]):
+            array = np.array(value.iloc[:, position].to_numpy(), copy=True)
+            array.flags.writeable = False
+            arrays.append(array)
+        frozen = pd.DataFrame(dict(enumerate(arrays)), index=value.index, copy=False)
+        frozen.columns = value.columns
+        return frozen
+    if isinstance(value, dict):
+        return {key: freeze(item) for key, item in value.items()}
+    return value
+
+
+def _frames(value):
+    if isinstance(value, pd.DataFrame):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _frames(item)
+
+
+class SharedHandle:
+    # Riferimento leggero di una sessione a un valore condiviso: quando la sessione lo abbandona il conteggio scende
+    def __init__(self, store, key, value):
+        self.key = key
+        self.value = value
+        weakref.finalize(self, store._release, key)
+
+
+class SharedStore:
+    def __init__(self):
+        self._entries = {}
+        # Rientrante: il rilascio di un handle può scattare durante la garbage collection mentre il lock è già preso
+        self._lock = threading.RLock()
+
+    def acquire(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry['sessioni'] += 1
+            entry['riutilizzi'] += 1
+            return SharedHandle(self, key, entry['value'])
+
+    def put(self, key, value):
+        # Se un'altra sessione ha già pubblicato lo stesso contenuto si usa il suo valore
+        with self._lock:
+            if key in self._entries:
+                return self.acquire(key)
+            value = freeze(value)
+            self._entries[key] = {
+                'value': value,
+                'righe': sum(len(frame) for frame in _frames(value)),
+                'memoria': sum(int(frame.memory_usage(deep=True).sum()) for frame in _frames(value)),
+                'sessioni': 1,
+                'riutilizzi': 0,
+                'creato': datetime.now()
+            }
+            return SharedHandle(self, key, value)
+
+    def _release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry['sessioni'] -= 1
+            if entry['sessioni'] <= 0:
+                del self._entries[key]
+
+    def shared_ids(self):
+        with self._lock:
+            entries = list(self._entries.values())
+        return {id(item) for entry in entries for item in [entry['value'], *_frames(entry['value'])]}
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._entries.items())
+        return pd.DataFrame([
+            {'contenuto': key[:12], 'righe': entry['righe'], 'memoria_mb': entry['memoria'] / 1024 / 1024,
+             'sessioni': entry['sessioni'], 'riutilizzi': entry['riutilizzi'], 'creato': entry['creato']}
+            for key, entry in entries
+        ], columns=SHARED_COLUMNS)
+
+
+# Un solo store per processo: tutte le sessioni Streamlit del server lo condividono
+SHARED_STORE = SharedStore()
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+MAX_SHIFT_DAYS = 3
+
+SHIFT = "Spostamento"
+EXTENSION = "Estensione"
+REDUCTION = "Riduzione"
+
+SHOULDER_COLUMNS = ['tipo', 'arrivo', 'partenza', 'notti', 'spostamento_arrivo', 'spostamento_partenza',
+                    'notte_ridotta', 'camere_ridotte', 'camere_gruppo', 'camere_displaced', 'revenue_displaced',
+                    'revenue_gruppo', 'impatto', 'differenza', 'impatto_per_camera', 'differenza_per_camera']
+
+
+def shoulder_variants(data, group_request, hotel_capacity, max_shift=MAX_SHIFT_DAYS, top_k=10):
+    # Ogni combinazione di arrivo e partenza spostati di ±max_shift giorni, con e senza riduzione della notte di picco.
+    # Restituisce le migliori top_k a parità di durata (Spostamento) e le migliori top_k con durata diversa
+    requested = group_request.sort_values('data')
+    nights = len(requested)
+    if nights == 0:
+        return pd.DataFrame(columns=SHOULDER_COLUMNS)
+
+    arrival = pd.Timestamp(requested['data'].iloc[0])
+    timeline = pd.date_range(arrival - pd.Timedelta(days=max_shift), periods=nights + 2 * max_shift)
+    days = data.set_index('data')[['finale_rn', 'finale_adr']].sort_index()
+    days = days[~days.index.duplicated()].reindex(timeline)
+
+    # Le notti aggiunte prima o dopo il soggiorno ripetono camere e ADR della prima o dell'ultima notte richiesta
+    rooms = np.pad(requested['camere_gruppo'].to_numpy(dtype=float), max_shift, mode='edge')
+    adr = np.pad(requested['adr_gruppo_netto'].to_numpy(dtype=float), max_shift, mode='edge')
+    # L'ancillare (F&B, meeting) è legato all'evento, non alle notti: resta quello della richiesta
+    ancillary = float(requested['revenue_ancillare_gruppo'].sum())
+
+    finale_rn = days['finale_rn'].to_numpy(dtype=float)
+    finale_adr = days['finale_adr'].to_numpy(dtype=float)
+    displaced = np.maximum(0, finale_rn + rooms - hotel_capacity)
+    displaced_revenue = displaced * finale_adr
+    room_revenue = rooms * adr
+
+    # Riducendo la notte di picco alle camere libere non si sposta nessuna camera ma si perde il loro revenue
+    trimmed_rooms = rooms - np.clip(hotel_capacity - finale_rn, 0, rooms)
+    trim_gain = displaced_revenue - trimmed_rooms * adr
+
+    # Griglia (arrivo, partenza, notte): una sola operazione vettoriale per tutte le (2k+1)² varianti
+    shifts = np.arange(-max_shift, max_shift + 1)
+    start = (max_shift + shifts)[:, None, None]
+    end = (max_shift + nights + shifts)[None, :, None]
+    positions = np.arange(len(timeline))[None, None, :]
+    stay = (positions >= start) & (positions < end)
+
+    total_rooms = np.where(stay, rooms, 0).sum(axis=2)
+    total_displaced = np.where(stay, displaced, 0).sum(axis=2)
+    total_displaced_revenue = np.where(stay, displaced_revenue, 0).sum(axis=2)
+    group_revenue = np.where(stay, room_revenue, 0).sum(axis=2) + ancillary
+    impact = group_revenue - total_displaced_revenue
+
+    peak = np.where(stay, displaced, -1).argmax(axis=2)
+    peak_displaced = displaced[peak]
+    peak_trimmed = trimmed_rooms[peak]
+
+    arrivals = np.broadcast_to(shifts[:, None], impact.shape)
+    departures = np.broadcast_to(shifts[None, :], impact.shape)
+    # Varianti senza notti o con giorni mancanti nell'import escluse; la riduzione solo se il picco sposta camere
+    valid = (end - start)[..., 0] > 0
+    valid &= ~np.isnan(impact)
+    trim_valid = valid & (peak_displaced > 0)
+
+    trimmed_peak = peak[trim_valid]
+    variants = pd.DataFrame({
+        'spostamento_arrivo': np.concatenate([arrivals[valid], arrivals[trim_valid]]),
+        'spostamento_partenza': np.concatenate([departures[valid], departures[trim_valid]]),
+        'notte_ridotta': np.concatenate([np.full(valid.sum(), np.datetime64('NaT'), dtype='datetime64[ns]'),
+                                         timeline[trimmed_peak].to_numpy()]),
+        'camere_ridotte': np.concatenate([np.zeros(valid.sum()), peak_trimmed[trim_valid]]),
+        'camere_gruppo': np.concatenate([total_rooms[valid], total_rooms[trim_valid] - peak_trimmed[trim_valid]]),
+        'camere_displaced': np.concatenate([total_displaced[valid],
+                                            total_displaced[trim_valid] - peak_displaced[trim_valid]]),
+        'revenue_displaced': np.concatenate([total_displaced_revenue[valid],
+                                             total_displaced_revenue[trim_valid] - displaced_revenue[trimmed_peak]]),
+        'revenue_gruppo': np.concatenate([group_revenue[valid],
+                                          group_revenue[trim_valid] - (trimmed_rooms * adr)[trimmed_peak]]),
+        'impatto': np.concatenate([impact[valid], impact[trim_valid] + trim_gain[trimmed_peak]])
+    })
+    variants['arrivo'] = arrival + pd.to_timedelta(variants['spostamento_arrivo'], unit='D')
+    variants['partenza'] = arrival + pd.to_timedelta(nights + variants['spostamento_partenza'], unit='D')
+
+    variants['notti'] = (variants['partenza'] - variants['arrivo']).dt.days
+    variants['tipo'] = np.where(variants['notti'] == nights, SHIFT,
+                                np.where(variants['notti'] > nights, EXTENSION, REDUCTION))
+    # Per room night senza l'ancillare: fisso per evento, diviso per meno notti premierebbe i soggiorni più corti
+    variants['impatto_per_camera'] = ((variants['impatto'] - ancillary)
+                                      / variants['camere_gruppo'].where(variants['camere_gruppo'] > 0))
+
+    requested_variant = ((variants['spostamento_arrivo'] == 0) & (variants['spostamento_partenza'] == 0)
+                         & variants['notte_ridotta'].isna())
+    baseline = variants.loc[requested_variant, 'impatto'].iloc[0] if requested_variant.any() else np.nan
+    baseline_per_room = variants.loc[requested_variant, 'impatto_per_camera'].iloc[0] if requested_variant.any() else np.nan
+    variants['differenza'] = variants['impatto'] - baseline
+    variants['differenza_per_camera'] = variants['impatto_per_camera'] - baseline_per_room
+
+    # A parità di impatto prima le varianti che cambiano meno la richiesta
+    variants['_modifiche'] = (variants['spostamento_arrivo'].abs() + variants['spostamento_partenza'].abs()
+                              + variants['notte_ridotta'].notna())
+    # Stessa durata: confronto sull'impatto totale. Durata diversa: ogni notte aggiunta ripete camere e ADR di bordo,
+    # quindi l'impatto totale premierebbe sempre il soggiorno più lungo; si confronta l'impatto per room night
+    shifts = variants[variants['tipo'] == SHIFT].sort_values(['impatto', '_modifiche'], ascending=[False, True],
+                                                             kind='stable')
+    lengths = variants[(variants['tipo'] != SHIFT) & variants['impatto_per_camera'].notna()].sort_values(
+        ['impatto_per_camera', '_modifiche'], ascending=[False, True], kind='stable')
+    variants = pd.concat([shifts.head(top_k), lengths.head(top_k)])
+    return variants[SHOULDER_COLUMNS].reset_index(drop=True)
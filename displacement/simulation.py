@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+from displacement.forecast import LEAD_BUCKETS, lead_bucket
+
+DEFAULT_SIMULATIONS = 10000
+# Dispersione del pickup (log del rapporto finale/OTB) usata quando lo storico non basta
+DEFAULT_SIGMA = 0.15
+MIN_BUCKET_OBSERVATIONS = 10
+# Quota dello shock comune a tutte le date: la domanda di un periodo tende a muoversi insieme
+DEFAULT_CORRELATION = 0.5
+
+
+def pickup_sigma(history, min_observations=MIN_BUCKET_OBSERVATIONS, default=DEFAULT_SIGMA):
+    # Scarto robusto (MAD) del log(finale/OTB) per fascia di giorni all'arrivo, attorno alla mediana della fascia
+    if history is None or history.empty:
+        return np.full(len(LEAD_BUCKETS), default)
+
+    history = history.dropna(subset=['otb_rn', 'final_rn'])
+    history = history[(history['lead'] >= 0) & (history['otb_rn'] > 0) & (history['final_rn'] > 0)]
+    if history.empty:
+        return np.full(len(LEAD_BUCKETS), default)
+
+    cells = pd.DataFrame({
+        'bucket': lead_bucket(history['lead'].to_numpy()),
+        'log_ratio': np.log(history['final_rn'].to_numpy(dtype=float) / history['otb_rn'].to_numpy(dtype=float))
+    })
+    residual = cells['log_ratio'] - cells.groupby('bucket')['log_ratio'].transform('median')
+    spread = residual.abs().groupby(cells['bucket']).agg(['median', 'size'])
+    spread = spread[spread['size'] >= min_observations]
+    sigma = np.full(len(LEAD_BUCKETS), np.nan)
+    sigma[spread.index.to_numpy()] = 1.4826 * spread['median'].to_numpy()
+
+    overall = 1.4826 * residual.abs().median() if len(residual) >= min_observations else default
+    return np.where(np.isnan(sigma), overall, sigma)
+
+
+def simulate_impact(result_df, hotel_capacity, sigma, as_of, simulations=DEFAULT_SIMULATIONS,
+                    correlation=DEFAULT_CORRELATION, seed=0):
+    # Matrice (simulazioni x date) della domanda individuale: OTB confermato, forecast con shock lognormale
+    as_of = pd.Timestamp(as_of).normalize()
+    # Come nei totali dell'analisi, le date senza dati (fuori dal periodo importato) non contano
+    result_df = result_df[result_df['impatto_revenue_totale'].notna()]
+    dates = pd.DatetimeIndex(result_df['data'])
+    lead = (dates - as_of).days.to_numpy()
+
+    otb = result_df['otb_ind_rn'].to_numpy(dtype=float)
+    fcst = result_df['fcst_ind_rn'].to_numpy(dtype=float)
+    grp_otb = result_df['grp_otb_rn'].to_numpy(dtype=float)
+    finale_adr = result_df['finale_adr'].to_numpy(dtype=float)
+    rooms = result_df['camere_gruppo_accettate'].to_numpy(dtype=float)
+    group_revenue = float((result_df['revenue_camere_gruppo_effettivo'] + result_df['revenue_ancillare_gruppo']).sum())
+
+    # Date già passate: nessuna incertezza residua
+    date_sigma = np.where(lead < 0, 0.0, np.asarray(sigma)[lead_bucket(lead)])
+
+    rng = np.random.default_rng(seed)
+    common = rng.standard_normal((simulations, 1))
+    own = rng.standard_normal((simulations, len(dates)))
+    shocks = np.sqrt(correlation) * common + np.sqrt(1 - correlation) * own
+
+    # Shock a media unitaria sulla domanda totale; l'OTB già in casa non può diminuire
+    demand = (otb + fcst) * np.exp(date_sigma * shocks - date_sigma ** 2 / 2)
+    finale_rn = np.maximum(demand, otb) + grp_otb
+    displaced = np.maximum(0, finale_rn + rooms - hotel_capacity)
+    impact = group_revenue - (displaced * finale_adr).sum(axis=1)
+
+    return {
+        'impatti': impact,
+        'impatto_medio': float(impact.mean()),
+        'probabilita_positivo': float((impact > 0).mean()),
+        'percentili': {p: float(value) for p, value in zip((5, 50, 95), np.percentile(impact, [5, 50, 95]))},
+        'camere_displaced_attese': float(displaced.sum(axis=1).mean()),
+        'displaced_per_data': pd.DataFrame({
+            'data': dates,
+            'camere_displaced_attese': displaced.mean(axis=0),
+            'probabilita_displacement': (displaced > 0).mean(axis=0)
+        }),
+        'simulazioni': simulations
+    }
@@ -0,0 +1,197 @@
+import os
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+DATA_DIR = os.environ.get("DISPLACEMENT_DATA_DIR", "data")
+
+SEGMENTS = {
+    'idv_cy': 'IDV',
+    'grp_otb': 'GRP_OTB',
+    'grp_opz': 'GRP_OPZ'
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS otb_snapshots (
+    hotel TEXT NOT NULL,
+    segment TEXT NOT NULL,
+    as_of TEXT NOT NULL,
+    data TEXT NOT NULL,
+    room_nights REAL NOT NULL,
+    adr REAL NOT NULL,
+    source_file TEXT,
+    imported_at TEXT NOT NULL,
+    PRIMARY KEY (hotel, segment, as_of, data, imported_at)
+);
+CREATE INDEX IF NOT EXISTS idx_snapshots_stay ON otb_snapshots (hotel, segment, data, as_of);
+CREATE INDEX IF NOT EXISTS idx_snapshots_as_of ON otb_snapshots (hotel, as_of);
+CREATE INDEX IF NOT EXISTS idx_snapshots_import ON otb_snapshots (hotel, segment, as_of, imported_at);
+"""
+
+# Le prime versioni dello storico avevano una sola riga per data as-of (import sovrascritti)
+MIGRATION = """
+ALTER TABLE otb_snapshots RENAME TO otb_snapshots_v1;
+DROP INDEX IF EXISTS idx_snapshots_stay;
+DROP INDEX IF EXISTS idx_snapshots_as_of;
+""" + SCHEMA + """
+INSERT INTO otb_snapshots SELECT * FROM otb_snapshots_v1;
+DROP TABLE otb_snapshots_v1;
+"""
+
+# Ogni import resta nello storico: per ogni data as-of si legge l'import più recente
+LATEST_IMPORT = """imported_at = (
+    SELECT MAX(latest.imported_at) FROM otb_snapshots latest
+    WHERE latest.hotel = otb_snapshots.hotel AND latest.segment = otb_snapshots.segment
+      AND latest.as_of = otb_snapshots.as_of
+)"""
+
+
+class SnapshotStore:
+    def __init__(self, path=None, hotel="default"):
+        self.path = path or os.path.join(DATA_DIR, "otb_snapshots.sqlite")
+        self.hotel = hotel
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with closing(self._connect()) as conn:
+            primary_key = [row[1] for row in sorted(conn.execute("PRAGMA table_info(otb_snapshots)"), key=lambda row: row[5]) if row[5]]
+            if primary_key and 'imported_at' not in primary_key:
+                conn.executescript(MIGRATION)
+            else:
+                conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def save_snapshot(self, as_of, segment, data_df, rn_column='Room nights', adr_column='ADR Cam', source_file=None,
+                      replace=False):
+        if data_df is None or data_df.empty or rn_column not in data_df.columns:
+            return 0
+
+        frame = data_df[['data', rn_column] + ([adr_column] if adr_column in data_df.columns else [])].copy()
+        if adr_column not in frame.columns:
+            frame[adr_column] = 0.0
+
+        daily = frame.groupby('data').agg({rn_column: 'sum', adr_column: 'mean'}).reset_index()
+        as_of = pd.Timestamp(as_of).strftime('%Y-%m-%d')
+        imported_at = pd.Timestamp.now().isoformat(timespec='microseconds')
+
+        rows = list(zip(
+            [self.hotel] * len(daily),
+            [segment] * len(daily),
+            [as_of] * len(daily),
+            pd.to_datetime(daily['data']).dt.strftime('%Y-%m-%d'),
+            daily[rn_column].astype(float),
+            daily[adr_column].fillna(0).astype(float),
+            [source_file] * len(daily),
+            [imported_at] * len(daily)
+        ))
+
+        # Storico in sola aggiunta: la sovrascrittura degli import con la stessa data as-of va richiesta esplicitamente
+        with closing(self._connect()) as conn, conn:
+            if replace:
+                conn.execute("DELETE FROM otb_snapshots WHERE hotel = ? AND segment = ? AND as_of = ?",
+                             (self.hotel, segment, as_of))
+            conn.executemany("INSERT INTO otb_snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+        return len(rows)
+
+    def save_import(self, as_of, imported, source_files=None, replace=False):
+        source_files = source_files or {}
+        saved = {}
+        for key, segment in SEGMENTS.items():
+            saved[segment] = self.save_snapshot(as_of, segment, imported.get(key), source_file=source_files.get(key),
+                                                replace=replace)
+        return saved
+
+    def as_of_dates(self, segment='IDV'):
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT as_of FROM otb_snapshots WHERE hotel = ? AND segment = ? ORDER BY as_of",
+                (self.hotel, segment)
+            ).fetchall()
+        return pd.to_datetime([row[0] for row in rows])
+
+    def load(self, segment='IDV', start=None, end=None, as_of_until=None, max_lead=None):
+        query = f"SELECT as_of, data, room_nights, adr FROM otb_snapshots WHERE hotel = ? AND segment = ? AND {LATEST_IMPORT}"
+        params = [self.hotel, segment]
+
+        if start is not None:
+            query += " AND data >= ?"
+            params.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+        if end is not None:
+            query += " AND data <= ?"
+            params.append(pd.Timestamp(end).strftime('%Y-%m-%d'))
+        if as_of_until is not None:
+            query += " AND as_of <= ?"
+            params.append(pd.Timestamp(as_of_until).strftime('%Y-%m-%d'))
+        if max_lead is not None:
+            query += " AND julianday(data) - julianday(as_of) <= ?"
+            params.append(max_lead)
+
+        with closing(self._connect()) as conn:
+            snapshots = pd.read_sql_query(query, conn, params=params)
+
+        snapshots['as_of'] = pd.to_datetime(snapshots['as_of'])
+        snapshots['data'] = pd.to_datetime(snapshots['data'])
+        return snapshots
+
+    def otb_days_before(self, stay_dates, days_before, segment='IDV'):
+        stay_dates = pd.DatetimeIndex(stay_dates).normalize()
+        result = pd.DataFrame({'data': stay_dates, 'target_as_of': stay_dates - pd.Timedelta(days=days_before)})
+
+        if len(stay_dates) == 0:
+            return result.assign(as_of=pd.NaT, room_nights=float('nan'), adr=float('nan'))
+
+        snapshots = self.load(segment, start=stay_dates.min(), end=stay_dates.max())
+        snapshots = snapshots.sort_values('as_of')
+
+        # merge_asof non accetta chiavi datetime in "by": si usa la data come stringa
+        result['stay_key'] = result['data'].dt.strftime('%Y-%m-%d')
+        snapshots['stay_key'] = snapshots.pop('data').dt.strftime('%Y-%m-%d')
+
+        result = pd.merge_asof(
+            result.sort_values('target_as_of'),
+            snapshots,
+            left_on='target_as_of',
+            right_on='as_of',
+            by='stay_key',
+            direction='backward'
+        )
+
+        return result.drop(columns='stay_key').sort_values('data').reset_index(drop=True)
+
+    def pace(self, stay_dates, days_before=(0, 7, 14, 30), segment='IDV'):
+        pace_df = pd.DataFrame({'data': pd.DatetimeIndex(stay_dates).normalize()})
+
+        for days in days_before:
+            snapshot = self.otb_days_before(stay_dates, days, segment)
+            pace_df[f'otb_{days}'] = snapshot['room_nights'].values
+
+        return pace_df
+
+    def pickup_history(self, segment='IDV', as_of=None, lookback_days=730, max_lead=365):
+        # Solo soggiorni già conclusi alla data as-of, negli ultimi lookback_days giorni e con anticipo fino a max_lead
+        as_of = pd.Timestamp.today().normalize() if as_of is None else pd.Timestamp(as_of).normalize()
+        snapshots = self.load(segment, start=as_of - pd.Timedelta(days=lookback_days), end=as_of - pd.Timedelta(days=1),
+                              as_of_until=as_of, max_lead=max_lead)
+
+        if snapshots.empty:
+            return pd.DataFrame(columns=['data', 'lead', 'otb_rn', 'final_rn'])
+
+        snapshots['lead'] = (snapshots['data'] - snapshots['as_of']).dt.days
+
+        # Il valore finale di una data è il primo snapshot estratto dopo il soggiorno
+        finals = (snapshots[snapshots['lead'] < 0]
+                  .sort_values('as_of')
+                  .drop_duplicates('data', keep='first')[['data', 'room_nights']]
+                  .rename(columns={'room_nights': 'final_rn'}))
+
+        history = pd.merge(snapshots[snapshots['lead'] >= 0], finals, on='data', how='inner')
+
+        return history.rename(columns={'room_nights': 'otb_rn'})[['data', 'lead', 'otb_rn', 'final_rn']]
@@ -0,0 +1,93 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from displacement.dates import same_day_last_year
+
+SIZES = {
+    '1m': 31,
+    '3m': 92,
+    '6m': 183,
+    '1y': 365,
+    '2y': 730,
+    '5y': 1826
+}
+
+EXPORT_COLUMNS = ['Giorno', 'Room nights', 'Bed nights', 'ADR Cam', 'ADR Bed', 'Room Revenue', 'RevPar']
+WEEKDAYS = ['Lun', 'Mar', 'Mer', 'Gio', 'Ven', 'Sab', 'Dom']
+
+
+def size_to_days(size):
+    if size in SIZES:
+        return SIZES[size]
+    return int(size)
+
+
+def pms_export(kind, fiscal_year, dates, room_nights, adr, capacity=66, status=None):
+    dates = pd.DatetimeIndex(dates)
+    room_nights = np.asarray(room_nights, dtype=float)
+    adr = np.asarray(adr, dtype=float)
+    market = "non è Gruppi" if kind == "IDV" else "è Gruppi"
+    filter_text = f"Filtri applicati: {fiscal_year} (S_Esercizio), Descrizione Mercato TOB {market}"
+    if status is not None:
+        filter_text += f", Stato Prenotazione è {status}"
+
+    # Stesso layout dell'export PMS: titolo, riga filtri, intestazioni e una riga per giorno
+    rows = [
+        ["Statistiche produzione"] + [None] * (len(EXPORT_COLUMNS) - 1),
+        [filter_text] + [None] * (len(EXPORT_COLUMNS) - 1),
+        [None] * len(EXPORT_COLUMNS),
+        EXPORT_COLUMNS
+    ]
+
+    labels = [f"{WEEKDAYS[d.dayofweek]} {d.strftime('%d/%m/%Y')}" for d in dates]
+    revenue = room_nights * adr
+    data = pd.DataFrame({
+        'Giorno': labels,
+        'Room nights': room_nights,
+        'Bed nights': room_nights * 2,
+        'ADR Cam': np.round(adr, 2),
+        'ADR Bed': np.round(adr / 2, 2),
+        'Room Revenue': np.round(revenue, 2),
+        'RevPar': np.round(revenue / capacity, 2)
+    })
+
+    sheet = pd.concat([pd.DataFrame(rows, columns=EXPORT_COLUMNS), data], ignore_index=True)
+
+    output = io.BytesIO()
+    sheet.to_excel(output, index=False, header=False)
+    return output.getvalue()
+
+
+def _occupancy(dates, rng, capacity, level):
+    weekend = np.isin(pd.DatetimeIndex(dates).dayofweek, [4, 5])
+    season = 0.15 * np.sin(2 * np.pi * (pd.DatetimeIndex(dates).dayofyear - 80) / 365)
+    occupancy = level + season + np.where(weekend, 0.12, 0) + rng.normal(0, 0.05, len(dates))
+    return np.clip(np.round(occupancy * capacity), 0, capacity)
+
+
+def synthetic_imports(days, start=None, capacity=66, seed=0):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(start) if start is not None else pd.Timestamp(pd.Timestamp.today().year, 1, 1)
+    cy_dates = pd.date_range(start, periods=days)
+    ly_dates = pd.date_range(same_day_last_year(cy_dates[0]), periods=days + 7)
+
+    ly_rn = _occupancy(ly_dates, rng, capacity, 0.68)
+    otb_rn = np.round(_occupancy(cy_dates, rng, capacity, 0.45) * rng.uniform(0.6, 1.0, days))
+    grp_rn = np.where(rng.random(days) < 0.2, rng.integers(5, 25, days), 0)
+
+    # Opzioni a blocchi di 2-5 notti consecutive, entro le camere ancora libere
+    opz_rn = np.zeros(days)
+    for first in np.flatnonzero(rng.random(days) < 0.05):
+        opz_rn[first:first + rng.integers(2, 6)] = rng.integers(5, 20)
+    opz_rn = np.clip(np.minimum(opz_rn, capacity - otb_rn - grp_rn), 0, None)
+
+    return [
+        ("IDV_CY.xlsx", pms_export("IDV", cy_dates[0].year, cy_dates, otb_rn, rng.uniform(140, 320, days), capacity)),
+        ("IDV_LY.xlsx", pms_export("IDV", ly_dates[0].year, ly_dates, ly_rn, rng.uniform(130, 300, days + 7), capacity)),
+        ("GRP_OTB.xlsx", pms_export("GRP", cy_dates[0].year, cy_dates, grp_rn, rng.uniform(110, 200, days), capacity,
+                                    status="Confermata")),
+        ("GRP_OPZ.xlsx", pms_export("GRP", cy_dates[0].year, cy_dates, opz_rn, rng.uniform(110, 200, days), capacity,
+                                    status="Opzionata"))
+    ]
@@ -0,0 +1,43 @@
+import threading
+import weakref
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# (id del DataFrame, colonne) -> (riferimento debole al DataFrame, tabella Arrow)
+_tables = {}
+# Rientrante: la rimozione di una voce scatta quando il DataFrame viene liberato, anche mentre il lock è preso
+_lock = threading.RLock()
+
+
+def _drop(key):
+    with _lock:
+        _tables.pop(key, None)
+
+
+def arrow_table(frame, columns=None):
+    # Tabella Arrow per st.dataframe convertita una sola volta per DataFrame (e colonne): ai rerun successivi
+    # Streamlit la serializza direttamente senza ripetere la conversione da pandas. Le colonne numeriche
+    # condividono i buffer NumPy; la voce sparisce con il DataFrame, che quindi non va modificato sul posto
+    subset_columns = None if columns is None else tuple(columns)
+    if pa is None:
+        return frame if subset_columns is None else frame[list(subset_columns)]
+
+    key = (id(frame), subset_columns)
+    with _lock:
+        cached = _tables.get(key)
+    if cached is not None and cached[0]() is frame:
+        return cached[1]
+
+    subset = frame if subset_columns is None else frame[list(subset_columns)]
+    try:
+        table = pa.Table.from_pandas(subset)
+    except (pa.ArrowTypeError, pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        # Colonne miste non convertibili: st.dataframe applica le sue correzioni partendo dal DataFrame
+        return subset
+
+    with _lock:
+        _tables[key] = (weakref.ref(frame, lambda _, key=key: _drop(key)), table)
+    return table
@@ -0,0 +1,9 @@
+COLOR_PALETTE = {
+    "primary": "#D8C0B7",
+    "secondary": "#8CA68C",
+    "text": "#5E5E5E",
+    "background": "#F8F6F4",
+    "accent": "#B6805C",
+    "positive": "#8CA68C",
+    "negative": "#D8837F"
+}
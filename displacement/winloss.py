@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+from displacement.forecast import LEAD_LABELS, lead_bucket
+
+OUTCOME_WON = "Vinto"
+MIN_DECIDED_QUOTES = 30
+
+SEASONS = {12: "Inverno", 1: "Inverno", 2: "Inverno", 3: "Primavera", 4: "Primavera", 5: "Primavera",
+           6: "Estate", 7: "Estate", 8: "Estate", 9: "Autunno", 10: "Autunno", 11: "Autunno"}
+ADR_RATIO_BINS = [0, 0.8, 0.9, 1.0, 1.1, 1.2, np.inf]
+ADR_RATIO_LABELS = ["<80%", "80-90%", "90-100%", "100-110%", "110-120%", ">120%"]
+DISPLACEMENT_BINS = [-np.inf, 0, 0.1, 0.25, 0.5, np.inf]
+DISPLACEMENT_LABELS = ["Nessuno", "≤10%", "10-25%", "25-50%", ">50%"]
+
+# Dimensioni dell'analisi win/loss: colonna delle caratteristiche -> etichetta mostrata
+DIMENSIONS = {
+    'anticipo': "Giorni all'arrivo",
+    'stagione': "Stagione",
+    'adr_vs_ly': "ADR gruppo vs ADR LY",
+    'displacement': "Camere displaced",
+    'eventi': "Eventi in città"
+}
+
+
+def quote_features(quotes):
+    # Una riga per preventivo deciso, con le fasce usate nei raggruppamenti
+    lead = (quotes['start_date'] - quotes['created_at'].dt.normalize()).dt.days.clip(lower=0).to_numpy()
+    avg_adr_ly = quotes['avg_adr_ly'].to_numpy(dtype=float)
+    adr_ratio = np.divide(quotes['adr_netto'].to_numpy(dtype=float), avg_adr_ly,
+                          out=np.full(len(quotes), np.nan), where=avg_adr_ly > 0)
+    group_rooms = quotes['group_rooms'].to_numpy(dtype=float)
+    displaced_share = np.divide(quotes['displaced_rooms'].to_numpy(dtype=float), group_rooms,
+                                out=np.zeros(len(quotes)), where=group_rooms > 0)
+
+    return pd.DataFrame({
+        'id': quotes['id'].to_numpy(),
+        'vinto': (quotes['outcome'] == OUTCOME_WON).to_numpy(),
+        'anticipo': pd.Categorical(np.array(LEAD_LABELS)[lead_bucket(lead)], categories=LEAD_LABELS, ordered=True),
+        'stagione': pd.Categorical(quotes['start_date'].dt.month.map(SEASONS),
+                                   categories=["Inverno", "Primavera", "Estate", "Autunno"], ordered=True),
+        'adr_ratio': adr_ratio,
+        'adr_vs_ly': pd.cut(adr_ratio, ADR_RATIO_BINS, labels=ADR_RATIO_LABELS, right=False),
+        'displacement': pd.cut(displaced_share, DISPLACEMENT_BINS, labels=DISPLACEMENT_LABELS),
+        'eventi': pd.Categorical(np.where(quotes['events'].to_numpy() > 0, "Con eventi", "Senza eventi"),
+                                 categories=["Senza eventi", "Con eventi"], ordered=True)
+    })
+
+
+def win_rates(features, by):
+    return (features.groupby(by, observed=True)['vinto']
+            .agg(preventivi='size', vinti='sum', win_rate='mean')
+            .reset_index())
+
+
+class AcceptanceCurve:
+    # Probabilità di vincere il preventivo in funzione dell'ADR del gruppo rispetto all'ADR LY del periodo:
+    # regressione logistica sul logaritmo del rapporto
+    def __init__(self, intercept, slope, observations=0):
+        self.intercept = intercept
+        self.slope = slope
+        self.observations = observations
+
+    @classmethod
+    def fit(cls, features, min_observations=MIN_DECIDED_QUOTES, iterations=25, ridge=1e-3):
+        known = features[np.isfinite(features['adr_ratio']) & (features['adr_ratio'] > 0)]
+        won = known['vinto'].to_numpy(dtype=float)
+        if len(known) < min_observations or won.min() == won.max():
+            return None
+
+        x = np.column_stack([np.ones(len(known)), np.log(known['adr_ratio'].to_numpy(dtype=float))])
+        beta = np.array([np.log(won.mean() / (1 - won.mean())), 0.0])
+        for _ in range(iterations):
+            p = 1 / (1 + np.exp(-x @ beta))
+            weights = p * (1 - p)
+            # Piccola penalità ridge: con esiti perfettamente separati la stima resterebbe finita
+            hessian = (x * weights[:, None]).T @ x + ridge * np.eye(2)
+            step = np.linalg.solve(hessian, x.T @ (won - p) - ridge * beta)
+            beta += step
+            if np.abs(step).max() < 1e-8:
+                break
+
+        return cls(float(beta[0]), float(beta[1]), observations=len(known))
+
+    def probability(self, adr_ratio):
+        adr_ratio = np.asarray(adr_ratio, dtype=float)
+        log_ratio = np.log(np.where(adr_ratio > 0, adr_ratio, np.nan))
+        return 1 / (1 + np.exp(-(self.intercept + self.slope * log_ratio)))
+
+    def to_frame(self, ratios=None):
+        ratios = np.linspace(0.6, 1.4, 17) if ratios is None else np.asarray(ratios, dtype=float)
+        return pd.DataFrame({'adr_ratio': ratios, 'probabilita_accettazione': self.probability(ratios)})